@@ -4,64 +4,211 @@
 
 from __future__ import print_function
 import argparse
+import contextlib
 import getpass
+import heapq
+import importlib
 import itertools
 import os
-import re
-import yaml
+import sys
+import time
 
 from pyprelude.file_system import make_path
 
 from repotool import __description__, __project_name__, __version__
-from repotool.bitbucket import Bitbucket
-from repotool.github import GitHub
-from repotool.gitlab import GitLab
+from repotool.async_provider import AsyncBackend
+from repotool.cache import DEFAULT_CACHE_TTL, PageCache
+from repotool.concurrency import DEFAULT_MAX_WORKERS, gather, iter_concurrently, iter_concurrently_in_order
+from repotool.config import get_config_stamp, read_config
+from repotool.index import ProjectIndex, make_name_matcher
+from repotool.instrument import TRACE_FORMATS, Stats, TraceWriter, add_callback, remove_callback
+from repotool.output import FIELDS, FORMATS, TEXT_FORMAT, RecordWriter, parse_fields
+from repotool.similarity import DEFAULT_THRESHOLD, find_similar
+from repotool.table import Table
 
 _PROJECT_KEY_FUNC = lambda p: (p.name, p.scm)
+_SOCKET_FILE_NAME = "daemon.sock"
 _PROVIDER_KEY_FUNC = lambda p: p.name
+
+# Provider modules pull in requests and OAuth support, so each one is only
+# imported once a provider of its type is used
 _PROVIDER_CLASSES = {
-    "bitbucket": Bitbucket,
-    "github": GitHub,
-    "gitlab": GitLab
+    "bitbucket": ("repotool.bitbucket", "Bitbucket"),
+    "github": ("repotool.github", "GitHub"),
+    "gitlab": ("repotool.gitlab", "GitLab")
 }
 
-def _read_config(config_path):
-    if os.path.isfile(config_path):
-        with open(config_path, "rt") as f:
-            return yaml.load(f)
-    else:
-        config_obj = {}
-        provider_config_obj = []
-        config_obj["providers"] = provider_config_obj
+def _get_provider_class(provider_type_name):
+    module_name, class_name = _PROVIDER_CLASSES[provider_type_name]
+    return getattr(importlib.import_module(module_name), class_name)
 
-        for provider_type_name in sorted(_PROVIDER_CLASSES.keys()):
-            cls = _PROVIDER_CLASSES[provider_type_name]
-            provider_config_obj.append(cls.make_sample_config())
+def _make_sample_config():
+    config_obj = {}
+    provider_config_obj = []
+    config_obj["providers"] = provider_config_obj
 
-        with open(config_path, "wt") as f:
-            f.write(yaml.dump(config_obj))
+    for provider_type_name in sorted(_PROVIDER_CLASSES.keys()):
+        cls = _get_provider_class(provider_type_name)
+        provider_config_obj.append(cls.make_sample_config())
 
-        return config_obj
+    return config_obj
 
-def _filter_projects(filter_expr, projects):
-    if filter_expr is None:
-        return projects
-    else:
-        regex = re.compile(filter_expr)
-        return filter(lambda p: regex.match(p.name) is not None, projects)
+class _ProviderMap(object):
+    """
+    Maps provider names to providers, building each provider from its
+    configuration the first time it is looked up
+    """
+    def __init__(self, provider_config_objs, make_provider):
+        self._config_objs = { o["name"]: o for o in provider_config_objs }
+        self._make_provider = make_provider
+        self._providers = {}
+
+    def __contains__(self, name):
+        return name in self._config_objs
+
+    def __getitem__(self, name):
+        provider = self._providers.get(name)
+        if provider is None:
+            provider = self._make_provider(self._config_objs[name])
+            self._providers[name] = provider
+        return provider
+
+    def get(self, name):
+        return self[name] if name in self._config_objs else None
+
+    def keys(self):
+        return self._config_objs.keys()
+
+    def values(self):
+        return [self[name] for name in self._config_objs]
+
+def _make_name_matcher(filter_expr):
+    return None if filter_expr is None else make_name_matcher(filter_expr)
 
 def _show_providers(providers):
     print("Providers: {}".format("(none)" if len(providers) == 0 else ", ".join(
         map(lambda p: "{} ({})".format(p.name, p.provider_name), providers))))
 
-def _get_projects(providers, include_archived=False):
+def _make_record_writer(args, extra_fields=()):
+    # Text output is printed by each command in its own layout
+    if args.format == TEXT_FORMAT:
+        return None
+
+    return RecordWriter(args.format, fields=args.fields, extra_fields=extra_fields)
+
+def _show_provider_error(provider, error):
+    print("Failed to get projects from {} ({}): {}".format(
+        provider.name,
+        provider.provider_name,
+        error), file=sys.stderr)
+
+def _iter_projects(providers, include_archived=False, incremental=False, max_workers=DEFAULT_MAX_WORKERS, name_matcher=None, lazy=False, in_order=False):
+    # Projects arrive from all providers at once and are yielded as they
+    # arrive or, if in_order is True, provider by provider
+    entries = (iter_concurrently_in_order if in_order else iter_concurrently)(
+        lambda p: p.iter_projects(
+            include_archived=include_archived,
+            incremental=incremental,
+            name_matcher=name_matcher,
+            lazy=lazy),
+        providers,
+        max_workers=max_workers)
+
+    for provider, project, error in entries:
+        if error is None:
+            yield project
+        else:
+            _show_provider_error(provider, error)
+
+def _decorate_run(run_index, projects):
+    return ((_PROJECT_KEY_FUNC(p), run_index, i, p) for i, p in enumerate(projects))
+
+def _iter_sorted_projects(providers, include_archived=False, incremental=False, max_workers=DEFAULT_MAX_WORKERS, name_matcher=None, lazy=False):
+    # Each provider's projects are sorted by the worker that lists them and
+    # the sorted runs are then merged instead of sorting everything again
+    entries = iter_concurrently_in_order(
+        lambda p: sorted(p.iter_projects(
+            include_archived=include_archived,
+            incremental=incremental,
+            name_matcher=name_matcher,
+            lazy=lazy), key=_PROJECT_KEY_FUNC),
+        providers,
+        max_workers=max_workers)
+
+    runs = []
+    for provider, provider_entries in itertools.groupby(entries, lambda e: e[0]):
+        run = []
+        for _, project, error in provider_entries:
+            if error is None:
+                run.append(project)
+            else:
+                _show_provider_error(provider, error)
+        runs.append(run)
+
+    # heapq.merge has no key function under Python 2.7, so runs are merged
+    # on (key, run, position) and never compare projects themselves
+    for _, _, _, project in heapq.merge(*[_decorate_run(i, r) for i, r in enumerate(runs)]):
+        yield project
+
+def _get_projects(providers, include_archived=False, incremental=False, max_workers=DEFAULT_MAX_WORKERS, name_matcher=None):
+    with AsyncBackend(max_workers) as backend:
+        results = gather([
+            backend.wrap(p).get_projects(include_archived=include_archived, incremental=incremental, name_matcher=name_matcher)
+            for p in providers
+        ])
+
     all_projects = []
-    for provider in providers:
-        all_projects.extend(provider.get_projects(include_archived=include_archived))
+    for provider, (provider_projects, error) in zip(providers, results):
+        if error is None:
+            all_projects.extend(provider_projects)
+        else:
+            _show_provider_error(provider, error)
 
     projects = sorted(all_projects, key=_PROJECT_KEY_FUNC)
     return projects
 
+def _find_projects(args, provider, project_names, index=None):
+    """
+    Looks up each of project_names and returns a (project, error) pair per
+    name in the same order, fetching the projects concurrently and each
+    distinct name only once
+
+    Names are resolved from index first, which is built over the local
+    catalog when none is given and the catalog can be loaded without
+    downloading the full listing again
+    """
+    if index is None and (args.offline or args.incremental):
+        index = ProjectIndex(_iter_projects([provider], incremental=args.incremental, lazy=True))
+
+    results = {}
+    if index is not None:
+        for project_name in set(project_names):
+            project = index.get(provider.name, project_name)
+            if project is not None:
+                results[project_name] = (project, None)
+
+    missing_names = sorted(set(project_names) - set(results.keys()))
+    if len(missing_names) > 0:
+        with AsyncBackend(min(args.max_workers, len(missing_names))) as backend:
+            async_provider = backend.wrap(provider)
+            results.update(zip(missing_names, gather([async_provider.get_project(n) for n in missing_names])))
+
+    return [results[n] for n in project_names]
+
+def _find_project(args, provider):
+    project, error = _find_projects(args, provider, [args.project_name])[0]
+    if error is not None:
+        raise error
+    return project
+
+def _read_project_names(path):
+    f = sys.stdin if path == "-" else open(path, "rt")
+    try:
+        return [line.strip() for line in f if len(line.strip()) > 0]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
 def _confirm_operation(project, op):
     table = project.make_table()
     print()
@@ -91,23 +238,84 @@ def _do_list(args, provider_map):
 
     providers = sorted(providers, key=_PROVIDER_KEY_FUNC)
 
-    _show_providers(providers)
+    writer = _make_record_writer(args)
+    if writer is None:
+        _show_providers(providers)
 
-    all_projects = _get_projects(providers, include_archived=args.include_archived)
-    projects = _filter_projects(args.project_filter_expr, all_projects)
-    for project in projects:
-        print("{} [{}] {}".format(project.name, project.id, project.clone_link("ssh")))
+    # Projects are filtered by name before they are built and are only
+    # built in full when printed. Sorting has to wait for every page of
+    # every provider, so projects are otherwise printed provider by
+    # provider as they arrive
+    name_matcher = _make_name_matcher(args.project_filter_expr)
+    if args.sort:
+        projects = _iter_sorted_projects(
+            providers,
+            include_archived=args.include_archived,
+            incremental=args.incremental,
+            max_workers=args.max_workers,
+            name_matcher=name_matcher,
+            lazy=True)
+    else:
+        projects = _iter_projects(
+            providers,
+            include_archived=args.include_archived,
+            incremental=args.incremental,
+            max_workers=args.max_workers,
+            name_matcher=name_matcher,
+            lazy=True,
+            in_order=True)
+
+    # Close the listing even when output stops early, such as on a broken
+    # pipe, so that its workers are stopped before the interpreter exits
+    with contextlib.closing(projects):
+        if writer is not None:
+            with writer:
+                for project in projects:
+                    writer.write(project)
+            return
 
-    print("Total: {} projects".format(len(projects)))
+        project_count = 0
+        for project in projects:
+            print("{} [{}] {}".format(project.name, project.id, project.clone_link("ssh")))
+            project_count += 1
+
+    print("Total: {} projects".format(project_count))
 
 def _do_info(args, provider_map):
     provider = provider_map.get(args.provider_name)
-    project = provider.get_project(args.project_name)
-    table = project.make_table()
-    print()
-    print("PROJECT INFORMATION\n")
-    table.show()
-    print()
+
+    project_names = list(args.project_names)
+    if args.names_path is not None:
+        project_names.extend(_read_project_names(args.names_path))
+
+    # Projects matching the filter and any names given with them are
+    # resolved from the listing instead of being fetched one by one
+    index = None
+    if args.project_filter_expr is not None:
+        index = ProjectIndex(_iter_projects([provider], incremental=args.incremental, lazy=True))
+        project_names.extend(p.name for p in index.filter(args.project_filter_expr))
+
+    writer = _make_record_writer(args)
+    failure_count = 0
+    try:
+        for project_name, (project, error) in zip(project_names, _find_projects(args, provider, project_names, index=index)):
+            if error is not None:
+                failure_count += 1
+                print("Failed to get project {} from {}: {}".format(project_name, provider.name, error), file=sys.stderr)
+            elif writer is not None:
+                writer.write(project)
+            else:
+                table = project.make_table()
+                print()
+                print("PROJECT INFORMATION\n")
+                table.show()
+                print()
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if failure_count > 0:
+        sys.exit(1)
 
 def _do_create(args, provider_map):
     provider = provider_map.get(args.provider_name)
@@ -115,8 +323,16 @@ def _do_create(args, provider_map):
     print("Project {} created.".format(args.project_name))
 
 def _do_delete(args, provider_map):
+    if args.project_filter_expr is not None:
+        _do_bulk_operation(args, provider_map, "delete", "deleted")
+        return
+
     provider = provider_map.get(args.provider_name)
-    project = provider.get_project(args.project_name)
+    project = _find_project(args, provider)
+
+    if args.dry_run:
+        _show_dry_run(project)
+        return
 
     confirmation_token = _confirm_operation(project, "delete")
     if not confirmation_token:
@@ -127,8 +343,16 @@ def _do_delete(args, provider_map):
     print("Project {} deleted.".format(project.name))
 
 def _do_archive(args, provider_map):
+    if args.project_filter_expr is not None:
+        _do_bulk_operation(args, provider_map, "archive", "archived")
+        return
+
     provider = provider_map.get(args.provider_name)
-    project = provider.get_project(args.project_name)
+    project = _find_project(args, provider)
+
+    if args.dry_run:
+        _show_dry_run(project)
+        return
 
     confirmation_token = _confirm_operation(project, "archive")
     if not confirmation_token:
@@ -138,42 +362,637 @@ def _do_archive(args, provider_map):
     project.archive(confirmation_token=confirmation_token)
     print("Project {} archived.".format(project.name))
 
+def _show_dry_run(project):
+    table = project.make_table()
+    print()
+    print("PROJECT INFORMATION\n")
+    table.show()
+    print()
+    print("Dry run: project was not changed.")
+
+def _make_projects_table(projects):
+    table = Table()
+    for project in projects:
+        table.add_row(project.provider.name, "{} [{}]".format(project.full_name, project.id))
+    return table
+
+def _confirm_bulk_operation(projects, op):
+    table = _make_projects_table(projects)
+    print()
+    print("PROJECTS\n")
+    table.show(indent=1)
+    print()
+    result = raw_input("Do you really want to {} these {} projects? [Enter \"YES\" to confirm] ".format(
+        op,
+        len(projects)))
+    if result != "YES":
+        return False
+
+    result = raw_input("Really? [Enter \"REALLY\" to confirm] ")
+    if result != "REALLY":
+        return False
+
+    return True
+
+def _show_rate_limit_warnings(projects):
+    counts = {}
+    for project in projects:
+        counts[project.provider] = counts.get(project.provider, 0) + 1
+
+    for provider in sorted(counts.keys(), key=_PROVIDER_KEY_FUNC):
+        budget = provider.rate_limit_budget
+        if budget.remaining is not None and budget.remaining < counts[provider]:
+            print("Warning: {} operations exceed the remaining rate limit of {} for {}; requests will be paced until it resets".format(
+                counts[provider],
+                budget.remaining,
+                provider.name), file=sys.stderr)
+
+def _do_bulk_operation(args, provider_map, op, op_past_tense):
+    method_name = "{}_project".format(op)
+    providers = []
+    for provider in sorted([provider_map[n] for n in set(args.provider_names)], key=_PROVIDER_KEY_FUNC):
+        if hasattr(provider, method_name):
+            providers.append(provider)
+        else:
+            print("{} ({}) does not support {} operations".format(provider.name, provider.provider_name, op), file=sys.stderr)
+
+    _show_providers(providers)
+
+    projects = sorted(_iter_projects(
+        providers,
+        incremental=args.incremental,
+        max_workers=args.max_workers,
+        name_matcher=_make_name_matcher(args.project_filter_expr)), key=_PROJECT_KEY_FUNC)
+    if op == "archive":
+        projects = [p for p in projects if not p.is_archived]
+
+    if len(projects) == 0:
+        print("No matching projects.")
+        return
+
+    if args.dry_run:
+        _make_projects_table(projects).show(indent=1)
+        print("Dry run: {} projects would be {}.".format(len(projects), op_past_tense))
+        return
+
+    confirmation_token = _confirm_bulk_operation(projects, op)
+    if not confirmation_token:
+        print("Aborted.")
+        return
+
+    _show_rate_limit_warnings(projects)
+
+    with AsyncBackend(args.max_workers) as backend:
+        results = gather([
+            getattr(backend.wrap(p.provider), method_name)(p, confirmation_token=confirmation_token)
+            for p in projects
+        ])
+
+    success_count = 0
+    for project, (_, error) in zip(projects, results):
+        if error is None:
+            success_count += 1
+            print("Project {} ({}) {}.".format(project.name, project.provider.name, op_past_tense))
+        else:
+            print("Project {} ({}) failed: {}".format(project.name, project.provider.name, error), file=sys.stderr)
+
+    print("Total: {} of {} projects {}".format(success_count, len(projects), op_past_tense))
+
 def _do_dupes(args, provider_map):
     providers = sorted(provider_map.values(), key=_PROVIDER_KEY_FUNC)
 
-    _show_providers(providers)
+    if args.format == TEXT_FORMAT:
+        _show_providers(providers)
+
+    projects = _get_projects(providers, incremental=args.incremental, max_workers=args.max_workers)
 
-    projects = _get_projects(providers)
+    if args.content:
+        _show_content_dupes(args, projects)
+        return
+
+    if args.fuzzy:
+        _show_fuzzy_dupes(args, projects)
+        return
 
+    writer = _make_record_writer(args, ["group"])
     groups = itertools.groupby(projects, _PROJECT_KEY_FUNC)
     group_count = 0
-    for key, group_iter in groups:
-        group = list(group_iter)
-        if len(group) > 1:
-            group_count += 1
-            project_name, _ = key
-            print("{}:".format(project_name))
+    try:
+        for key, group_iter in groups:
+            group = list(group_iter)
+            if len(group) > 1:
+                group_count += 1
+                project_name, _ = key
+                if writer is not None:
+                    for project in group:
+                        writer.write(project, project_name)
+                    continue
+
+                print("{}:".format(project_name))
+                for project in group:
+                    print("  {} [{}] {}".format(project.provider.provider_name, project.id, project.clone_link("ssh")))
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        print("Total: {} groups of possibly duplicate projects".format(group_count))
+
+def _show_content_dupes(args, projects):
+    from repotool.fingerprint import FingerprintCache, get_fingerprints, group_by_fingerprint
+
+    projects = [p for p in projects if p.scm == "git" and args.clone_link_key in p.clone_link_keys()]
+
+    cache = FingerprintCache(make_path(args.config_dir, "fingerprints.json"))
+    results = get_fingerprints(projects, clone_link_key=args.clone_link_key, cache=cache, max_workers=args.max_workers)
+    cache.save()
+
+    groups, failures = group_by_fingerprint(projects, results)
+    for project, error in failures:
+        print("Failed to fingerprint {} ({}): {}".format(
+            project.name,
+            project.provider.name,
+            error), file=sys.stderr)
+
+    writer = _make_record_writer(args, ["group"])
+    try:
+        for fingerprint, group in groups:
+            if writer is not None:
+                for project in group:
+                    writer.write(project, fingerprint)
+                continue
+
+            print("{}:".format(fingerprint))
             for project in group:
-                print("  {} [{}] {}".format(project.provider.provider_name, project.id, project.clone_link("ssh")))
+                print("  {} {} [{}] {}".format(
+                    project.provider.provider_name,
+                    project.name,
+                    project.id,
+                    project.clone_link(args.clone_link_key)))
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        print("Total: {} groups of projects with identical content".format(len(groups)))
+
+def _show_fuzzy_dupes(args, projects):
+    pairs = find_similar([p.name for p in projects], threshold=args.threshold)
+
+    writer = _make_record_writer(args, ["group", "score"])
+    if writer is not None:
+        # Each pair is a group of its own, numbered from 1
+        with writer:
+            for group, (i, j, score) in enumerate(pairs, 1):
+                for project in [projects[i], projects[j]]:
+                    writer.write(project, group, round(score, 4))
+        return
+
+    for i, j, score in pairs:
+        print("{:.2f}:".format(score))
+        for project in [projects[i], projects[j]]:
+            print("  {} {} [{}] {}".format(
+                project.provider.provider_name,
+                project.name,
+                project.id,
+                project.clone_link("ssh")))
+
+    print("Total: {} pairs of projects with similar names".format(len(pairs)))
+
+def _do_forks(args, provider_map):
+    from repotool.forks import ForkCache, resolve_sources
+
+    if args.provider_names is not None:
+        providers = [provider_map[n] for n in set(args.provider_names)]
+    else:
+        providers = provider_map.values()
+
+    providers = sorted(providers, key=_PROVIDER_KEY_FUNC)
+
+    writer = _make_record_writer(args)
+    if writer is None:
+        _show_providers(providers)
+
+    projects = _get_projects(
+        providers,
+        include_archived=args.include_archived,
+        incremental=args.incremental,
+        max_workers=args.max_workers,
+        name_matcher=_make_name_matcher(args.project_filter_expr))
+    forks = [p for p in projects if p.is_fork]
+
+    cache = ForkCache(make_path(args.config_dir, "forks.json"))
+    failures = resolve_sources(forks, cache=cache, refresh=args.refresh, max_workers=args.max_workers)
+    cache.save()
+
+    for project, error in failures:
+        print("Failed to look up source of {} ({}): {}".format(
+            project.name,
+            project.provider.name,
+            error), file=sys.stderr)
+
+    if writer is not None:
+        with writer:
+            for project in forks:
+                writer.write(project)
+        return
+
+    # Forks of a project in different accounts on the same host share a
+    # single source, so they end up in the same tree
+    trees = {}
+    for project in forks:
+        trees.setdefault(project.source, []).append(project)
+
+    # Sources on different hosts may share a full name
+    for source in sorted(trees.keys(), key=lambda p: (p is None, None if p is None else (p.full_name, p.provider.provider_name, p.provider.api_url))):
+        if source is None:
+            print("(unknown source):")
+        else:
+            print("{} ({}):".format(source.full_name, source.provider.provider_name))
+        for project in sorted(trees[source], key=lambda p: (p.provider.name, p.full_name)):
+            print("  {} {} [{}] {}".format(
+                project.provider.name,
+                project.full_name,
+                project.id,
+                project.clone_link("ssh")))
+
+    print("Total: {} forks of {} projects".format(len(forks), len([s for s in trees if s is not None])))
+
+def _format_byte_count(byte_count):
+    """
+    >>> _format_byte_count(512)
+    '512 B'
+    >>> _format_byte_count(3 * 1024 * 1024)
+    '3.0 MB'
+    """
+    for unit in ["B", "KB", "MB"]:
+        if byte_count < 1024:
+            return "{} {}".format(byte_count, unit) if unit == "B" else "{:.1f} {}".format(byte_count, unit)
+        byte_count /= 1024.0
+    return "{:.1f} GB".format(byte_count)
+
+def _do_mirror(args, provider_map):
+    from repotool.mirror import CLONED, DEFAULT_MAX_PER_HOST, FETCHED, UNCHANGED, get_mirror_path, mirror_projects
+
+    if args.provider_names is not None:
+        providers = [provider_map[n] for n in set(args.provider_names)]
+    else:
+        providers = provider_map.values()
+
+    providers = sorted(providers, key=_PROVIDER_KEY_FUNC)
+
+    _show_providers(providers)
+
+    all_projects = _iter_projects(
+        providers,
+        include_archived=args.include_archived,
+        incremental=args.incremental,
+        max_workers=args.max_workers,
+        name_matcher=_make_name_matcher(args.project_filter_expr))
+    projects = [p for p in all_projects if p.scm == "git" and args.clone_link_key in p.clone_link_keys()]
+
+    start_time = time.time()
+    counts = { CLONED: 0, FETCHED: 0, UNCHANGED: 0 }
+    failure_count = 0
+    total_byte_count = 0
+    results = mirror_projects(
+        projects,
+        args.mirror_dir,
+        clone_link_key=args.clone_link_key,
+        max_workers=args.max_workers,
+        max_per_host=DEFAULT_MAX_PER_HOST if args.max_per_host is None else args.max_per_host)
+    for result in results:
+        project = result.project
+        if result.error is None:
+            counts[result.action] += 1
+            total_byte_count += result.byte_count
+            print("{} ({}) {} {}".format(
+                project.name,
+                project.provider.name,
+                result.action,
+                get_mirror_path(args.mirror_dir, project, args.clone_link_key)))
+        else:
+            failure_count += 1
+            print("Failed to mirror {} ({}): {}".format(project.name, project.provider.name, result.error), file=sys.stderr)
+
+    elapsed = max(time.time() - start_time, 0.001)
+    print("Total: {} projects: {} cloned, {} fetched, {} unchanged, {} failed".format(
+        len(projects),
+        counts[CLONED],
+        counts[FETCHED],
+        counts[UNCHANGED],
+        failure_count))
+    print("Transferred {} in {:.1f} s ({}/s, {:.1f} projects/s)".format(
+        _format_byte_count(total_byte_count),
+        elapsed,
+        _format_byte_count(int(total_byte_count / elapsed)),
+        len(projects) / elapsed))
+
+def _do_sync(args, provider_map):
+    from repotool.mirror import DEFAULT_MAX_PER_HOST
+    from repotool.sync import PUSHED, UNCHANGED, join_projects, sync_projects
+
+    source_provider = provider_map[args.source_name]
+    target_provider = provider_map[args.target_name]
+    providers = [source_provider, target_provider]
+
+    _show_providers(providers)
 
-    print("Total: {} groups of possibly duplicate projects".format(group_count))
+    with AsyncBackend(args.max_workers) as backend:
+        results = gather([
+            backend.wrap(source_provider).get_projects(
+                incremental=args.incremental,
+                name_matcher=_make_name_matcher(args.project_filter_expr)),
+            backend.wrap(target_provider).get_projects(incremental=args.incremental)
+        ])
+
+    for provider, (_, error) in zip(providers, results):
+        if error is not None:
+            _show_provider_error(provider, error)
+            return
+
+    (source_projects, _), (target_projects, _) = results
+    source_projects = [
+        p for p in sorted(source_projects, key=_PROJECT_KEY_FUNC)
+        if p.scm == "git" and args.clone_link_key in p.clone_link_keys()
+    ]
+    target_projects = [p for p in target_projects if p.scm == "git"]
+
+    pairs = join_projects(source_projects, target_projects)
+    missing_projects = [source for source, target in pairs if target is None]
+
+    if args.dry_run:
+        for project in missing_projects:
+            print("Project {} would be created on {}.".format(project.name, target_provider.name))
+        print("Dry run: {} projects would be synced, {} of them created.".format(len(pairs), len(missing_projects)))
+        return
+
+    with AsyncBackend(args.max_workers) as backend:
+        results = gather([
+            backend.wrap(target_provider).create_project(p.name, is_private=p.is_private)
+            for p in missing_projects
+        ])
+
+    created_projects = {}
+    for project, (created_project, error) in zip(missing_projects, results):
+        if error is None:
+            created_projects[project] = created_project
+            print("Project {} created on {}.".format(project.name, target_provider.name))
+        else:
+            print("Failed to create {} on {}: {}".format(project.name, target_provider.name, error), file=sys.stderr)
+
+    pairs = [
+        (source, target if target is not None else created_projects[source])
+        for source, target in pairs
+        if target is not None or source in created_projects
+    ]
+
+    start_time = time.time()
+    counts = { PUSHED: 0, UNCHANGED: 0 }
+    failure_count = len(missing_projects) - len(created_projects)
+    results = sync_projects(
+        pairs,
+        args.work_dir,
+        clone_link_key=args.clone_link_key,
+        max_workers=args.max_workers,
+        max_per_host=DEFAULT_MAX_PER_HOST if args.max_per_host is None else args.max_per_host)
+    for result in results:
+        project = result.source
+        if result.error is None:
+            counts[result.action] += 1
+            print("{} {}".format(project.name, result.action))
+        else:
+            failure_count += 1
+            print("Failed to sync {}: {}".format(project.name, result.error), file=sys.stderr)
+
+    print("Total: {} projects: {} created, {} pushed, {} unchanged, {} failed in {:.1f} s".format(
+        len(source_projects),
+        len(created_projects),
+        counts[PUSHED],
+        counts[UNCHANGED],
+        failure_count,
+        time.time() - start_time))
+
+def _do_serve(args, provider_map):
+    from repotool.daemon import DEFAULT_REFRESH_INTERVAL, Daemon, connect
+    from repotool.forks import ForkCache
+
+    socket_path = make_path(args.config_dir, _SOCKET_FILE_NAME)
+    client, status = connect(socket_path)
+
+    if args.status or args.stop or args.invalidate:
+        if client is None:
+            print("No daemon is running.", file=sys.stderr)
+            sys.exit(1)
+
+        if args.invalidate:
+            for provider_name in [None] if args.provider_names is None else sorted(set(args.provider_names)):
+                client.request("invalidate", provider=provider_name)
+            print("Invalidated {}.".format("all providers" if args.provider_names is None else ", ".join(sorted(set(args.provider_names)))))
+        elif args.stop:
+            client.request("stop")
+            print("Daemon {} stopped.".format(status["pid"]))
+        else:
+            table = Table()
+            table.add_row("PID", status["pid"])
+            for catalog_obj in status["catalogs"]:
+                table.add_row(
+                    "{}{}".format(catalog_obj["provider"], " (with archived)" if catalog_obj["include_archived"] else ""),
+                    "{} projects loaded {:.0f} s ago".format(catalog_obj["count"], catalog_obj["age"]))
+            table.show()
+        return
+
+    if client is not None:
+        print("Daemon {} is already running.".format(status["pid"]), file=sys.stderr)
+        sys.exit(1)
+
+    # Left behind by a daemon that did not exit cleanly
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    providers = sorted(provider_map.values(), key=_PROVIDER_KEY_FUNC)
+    for provider in providers:
+        # Revalidate every page on refresh: unchanged pages cost a
+        # conditional request and changes are picked up straight away
+        provider.set_page_cache(PageCache(make_path(args.config_dir, "cache", provider.name), refresh=True))
+
+    _show_providers(providers)
+    print("Serving on {}".format(socket_path))
+
+    daemon = Daemon(
+        providers,
+        socket_path,
+        refresh_interval=DEFAULT_REFRESH_INTERVAL if args.refresh_interval is None else args.refresh_interval,
+        config_stamp=get_config_stamp(make_path(args.config_dir, "config.yaml")),
+        fork_cache=ForkCache(make_path(args.config_dir, "forks.json")))
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+def _make_remote_provider_map(config_dir, config_path, provider_config_objs):
+    # Most commands run without a daemon, which then need not be loaded
+    socket_path = make_path(config_dir, _SOCKET_FILE_NAME)
+    if not os.path.exists(socket_path):
+        return None
+
+    from repotool.daemon import RemoteProvider, connect
+
+    client, status = connect(socket_path)
+    if client is None:
+        return None
+
+    if status["config_stamp"] != get_config_stamp(config_path):
+        print("Warning: daemon {} was started with an older configuration and is not used; restart it with \"repotool serve\"".format(status["pid"]), file=sys.stderr)
+        return None
+
+    provider_objs = { o["name"]: o for o in status["providers"] }
+    return client, _ProviderMap(provider_config_objs, lambda o: RemoteProvider(
+        client,
+        o["name"],
+        provider_objs[o["name"]]["provider_name"],
+        provider_objs[o["name"]]["api_url"],
+        provider_objs[o["name"]]["operations"]))
+
+def _parse_fields(s):
+    try:
+        return parse_fields(s)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError("{} (choose from {})".format(e, ", ".join(FIELDS.keys())))
+
+def _parse_threshold(s):
+    try:
+        threshold = float(s)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid float value: \"{}\"".format(s))
+
+    # Nothing is more similar than identical names, while a threshold of
+    # zero would report every pair of projects
+    if not 0 < threshold <= 1:
+        raise argparse.ArgumentTypeError("{} is not greater than 0 and at most 1".format(s))
+
+    return threshold
+
+def _add_output_arguments(parser):
+    parser.add_argument(
+        "--format",
+        dest="format",
+        default=TEXT_FORMAT,
+        choices=FORMATS,
+        help="Print human-readable text or a record per project as JSON lines, CSV or TSV")
+    parser.add_argument(
+        "--fields",
+        dest="fields",
+        type=_parse_fields,
+        default=None,
+        help="Comma-separated fields of each record (default: all of {})".format(",".join(FIELDS.keys())))
+
+def _add_mutation_arguments(parser, provider_names):
+    parser.add_argument(
+        "provider_name",
+        metavar="PROVIDERNAME",
+        nargs="?",
+        help="Name of project provider")
+    parser.add_argument(
+        "project_name",
+        metavar="PROJECTNAME",
+        nargs="?",
+        help="Project name")
+    parser.add_argument(
+        "--filter",
+        "-f",
+        dest="project_filter_expr",
+        default=None,
+        help="Apply to all projects whose names match this regular expression")
+    parser.add_argument(
+        "--provider",
+        "-p",
+        nargs="+",
+        dest="provider_names",
+        default=None,
+        choices=provider_names,
+        help="Providers to apply --filter to")
+    parser.add_argument(
+        "--dry-run",
+        "-n",
+        dest="dry_run",
+        action="store_true",
+        default=False,
+        help="Show affected projects without changing them")
 
 def _main():
     default_config_dir = make_path(os.path.expanduser("~/.repotool"))
     default_config_path = make_path(default_config_dir, "config.yaml")
     default_user = getpass.getuser()
 
-    config_obj = _read_config(default_config_path)
+    config_obj = read_config(
+        default_config_path,
+        make_path(default_config_dir, "config.cache"),
+        _make_sample_config)
 
-    provider_map = {}
-    for provider_config_obj in config_obj.get("providers", []):
-        name = provider_config_obj["name"]
-        type = provider_config_obj["type"]
-        cls = _PROVIDER_CLASSES[type]
-        provider_map[name] = cls.parse_config(default_config_dir, default_user, provider_config_obj)
+    provider_config_objs = config_obj.get("providers", [])
+    provider_names = sorted(o["name"] for o in provider_config_objs)
 
     parser = argparse.ArgumentParser(description="Repository tool")
+    parser.set_defaults(config_dir=default_config_dir)
     parser.add_argument("--version", action="version", version="{} version {}".format(__project_name__, __version__))
+    parser.add_argument(
+        "--workers",
+        "-j",
+        dest="max_workers",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help="Maximum number of providers to query concurrently")
+    parser.add_argument(
+        "--cache-ttl",
+        dest="cache_ttl",
+        type=int,
+        default=config_obj.get("cache-ttl", DEFAULT_CACHE_TTL),
+        help="Number of seconds for which cached pages are used without revalidation")
+    cache_group = parser.add_mutually_exclusive_group()
+    cache_group.add_argument(
+        "--refresh",
+        dest="refresh",
+        action="store_true",
+        default=False,
+        help="Revalidate all cached pages with the provider")
+    cache_group.add_argument(
+        "--offline",
+        dest="offline",
+        action="store_true",
+        default=False,
+        help="Use cached pages only and never contact providers")
+    parser.add_argument(
+        "--incremental",
+        "-i",
+        dest="incremental",
+        action="store_true",
+        default=False,
+        help="Only fetch projects changed since the last sync")
+    parser.add_argument(
+        "--stats",
+        dest="stats",
+        action="store_true",
+        default=False,
+        help="Show request and project construction statistics per provider at the end of the run")
+    parser.add_argument(
+        "--trace",
+        dest="trace_path",
+        metavar="FILE",
+        default=None,
+        help="Write an event for each request and project construction to FILE")
+    parser.add_argument(
+        "--trace-format",
+        dest="trace_format",
+        default="jsonl",
+        choices=TRACE_FORMATS,
+        help="Format of --trace file: JSON lines or Chrome trace events")
+    parser.add_argument(
+        "--no-daemon",
+        dest="use_daemon",
+        action="store_false",
+        default=True,
+        help="Query providers directly even if \"repotool serve\" is running")
 
     subparsers = parser.add_subparsers(help="subcommand help")
 
@@ -190,24 +1009,46 @@ def _main():
         nargs="+",
         dest="provider_names",
         default=None,
-        choices=sorted(provider_map.keys()))
+        choices=provider_names)
     list_parser.add_argument(
         "--include-archived",
         "-a",
         dest="include_archived",
         action="store_true",
         default=False)
+    list_parser.add_argument(
+        "--sort",
+        "-s",
+        dest="sort",
+        action="store_true",
+        default=False,
+        help="Sort projects by name once all providers have been listed")
+    _add_output_arguments(list_parser)
 
-    info_parser = subparsers.add_parser("info", help="Show information about project")
+    info_parser = subparsers.add_parser("info", help="Show information about projects")
     info_parser.set_defaults(func=_do_info)
     info_parser.add_argument(
         "provider_name",
         metavar="PROVIDERNAME",
         help="Name of project provider")
     info_parser.add_argument(
-        "project_name",
+        "project_names",
         metavar="PROJECTNAME",
-        help="Project name")
+        nargs="*",
+        help="Project names")
+    info_parser.add_argument(
+        "--filter",
+        "-f",
+        dest="project_filter_expr",
+        default=None,
+        help="Show all projects whose names match this regular expression")
+    info_parser.add_argument(
+        "--file",
+        dest="names_path",
+        metavar="FILE",
+        default=None,
+        help="Read project names from FILE, one per line, or from standard input if FILE is -")
+    _add_output_arguments(info_parser)
 
     create_parser = subparsers.add_parser("create", help="Create project")
     create_parser.set_defaults(func=_do_create)
@@ -220,33 +1061,237 @@ def _main():
         metavar="PROJECTNAME",
         help="Project name")
 
-    delete_parser = subparsers.add_parser("delete", help="Delete project")
+    delete_parser = subparsers.add_parser("delete", help="Delete project or projects matching filter")
     delete_parser.set_defaults(func=_do_delete)
-    delete_parser.add_argument(
-        "provider_name",
-        metavar="PROVIDERNAME",
-        help="Name of project provider")
-    delete_parser.add_argument(
-        "project_name",
-        metavar="PROJECTNAME",
-        help="Project name")
+    _add_mutation_arguments(delete_parser, provider_names)
 
-    archive_parser = subparsers.add_parser("archive", help="Archive project")
+    archive_parser = subparsers.add_parser("archive", help="Archive project or projects matching filter")
     archive_parser.set_defaults(func=_do_archive)
-    archive_parser.add_argument(
-        "provider_name",
-        metavar="PROVIDERNAME",
-        help="Name of project provider")
-    archive_parser.add_argument(
-        "project_name",
-        metavar="PROJECTNAME",
-        help="Project name")
+    _add_mutation_arguments(archive_parser, provider_names)
 
     dupes_parser = subparsers.add_parser("dupes", help="Show possible duplicate projects")
     dupes_parser.set_defaults(func=_do_dupes)
+    dupes_parser.add_argument(
+        "--content",
+        "-c",
+        dest="content",
+        action="store_true",
+        default=False,
+        help="Group projects by the commit their default branch points to instead of by name")
+    dupes_parser.add_argument(
+        "--fuzzy",
+        dest="fuzzy",
+        action="store_true",
+        default=False,
+        help="Report pairs of projects with similar names")
+    dupes_parser.add_argument(
+        "--threshold",
+        dest="threshold",
+        type=_parse_threshold,
+        default=DEFAULT_THRESHOLD,
+        help="Minimum name similarity between 0 and 1 reported by --fuzzy")
+    dupes_parser.add_argument(
+        "--clone-protocol",
+        dest="clone_link_key",
+        default="ssh",
+        choices=["https", "ssh"],
+        help="Clone link used to query repositories")
+    _add_output_arguments(dupes_parser)
+
+    forks_parser = subparsers.add_parser("forks", help="Show forks grouped by the project they were forked from")
+    forks_parser.set_defaults(func=_do_forks)
+    forks_parser.add_argument(
+        "--filter",
+        "-f",
+        dest="project_filter_expr",
+        default=None)
+    forks_parser.add_argument(
+        "--provider",
+        "-p",
+        nargs="+",
+        dest="provider_names",
+        default=None,
+        choices=provider_names)
+    forks_parser.add_argument(
+        "--include-archived",
+        "-a",
+        dest="include_archived",
+        action="store_true",
+        default=False)
+    _add_output_arguments(forks_parser)
+
+    mirror_parser = subparsers.add_parser("mirror", help="Clone or update local mirrors of projects")
+    mirror_parser.set_defaults(func=_do_mirror)
+    mirror_parser.add_argument(
+        "mirror_dir",
+        metavar="DIR",
+        help="Directory containing mirrors")
+    mirror_parser.add_argument(
+        "--filter",
+        "-f",
+        dest="project_filter_expr",
+        default=None)
+    mirror_parser.add_argument(
+        "--provider",
+        "-p",
+        nargs="+",
+        dest="provider_names",
+        default=None,
+        choices=provider_names)
+    mirror_parser.add_argument(
+        "--include-archived",
+        "-a",
+        dest="include_archived",
+        action="store_true",
+        default=False)
+    mirror_parser.add_argument(
+        "--clone-protocol",
+        dest="clone_link_key",
+        default="ssh",
+        choices=["https", "ssh"],
+        help="Clone link to mirror from")
+    mirror_parser.add_argument(
+        "--per-host",
+        dest="max_per_host",
+        type=int,
+        default=None,
+        help="Maximum number of concurrent clones and fetches per host")
+
+    sync_parser = subparsers.add_parser("sync", help="Replicate projects from one provider to another")
+    sync_parser.set_defaults(func=_do_sync)
+    sync_parser.add_argument(
+        "source_name",
+        metavar="SRC",
+        choices=provider_names,
+        help="Name of provider to copy projects from")
+    sync_parser.add_argument(
+        "target_name",
+        metavar="DST",
+        choices=provider_names,
+        help="Name of provider to copy projects to")
+    sync_parser.add_argument(
+        "--filter",
+        "-f",
+        dest="project_filter_expr",
+        default=None)
+    sync_parser.add_argument(
+        "--clone-protocol",
+        dest="clone_link_key",
+        default="ssh",
+        choices=["https", "ssh"],
+        help="Clone link used to fetch and push")
+    sync_parser.add_argument(
+        "--per-host",
+        dest="max_per_host",
+        type=int,
+        default=None,
+        help="Maximum number of concurrent fetches and pushes per host")
+    sync_parser.add_argument(
+        "--work-dir",
+        dest="work_dir",
+        default=make_path(default_config_dir, "mirrors"),
+        help="Directory containing mirrors of source projects")
+    sync_parser.add_argument(
+        "--dry-run",
+        "-n",
+        dest="dry_run",
+        action="store_true",
+        default=False,
+        help="Show projects that would be created without changing anything")
+
+    serve_parser = subparsers.add_parser("serve", help="Keep providers and project listings in memory for other commands to query")
+    serve_parser.set_defaults(func=_do_serve)
+    serve_parser.add_argument(
+        "--interval",
+        dest="refresh_interval",
+        type=int,
+        default=None,
+        help="Number of seconds between background refreshes of project listings")
+    serve_group = serve_parser.add_mutually_exclusive_group()
+    serve_group.add_argument(
+        "--status",
+        dest="status",
+        action="store_true",
+        default=False,
+        help="Show the listings held by the running daemon")
+    serve_group.add_argument(
+        "--stop",
+        dest="stop",
+        action="store_true",
+        default=False,
+        help="Stop the running daemon")
+    serve_group.add_argument(
+        "--invalidate",
+        dest="invalidate",
+        action="store_true",
+        default=False,
+        help="Make the running daemon discard and reload its listings")
+    serve_parser.add_argument(
+        "--provider",
+        "-p",
+        nargs="+",
+        dest="provider_names",
+        default=None,
+        choices=provider_names,
+        help="Providers to --invalidate")
 
     args = parser.parse_args()
-    args.func(args, provider_map)
+
+    if args.func in [_do_delete, _do_archive]:
+        if args.project_filter_expr is None:
+            if args.provider_name is None or args.project_name is None:
+                parser.error("PROVIDERNAME and PROJECTNAME are required unless --filter is given")
+        elif args.provider_names is None or args.provider_name is not None:
+            parser.error("--filter requires --provider and cannot be combined with PROVIDERNAME")
+
+    if args.func == _do_info and len(args.project_names) == 0 and args.project_filter_expr is None and args.names_path is None:
+        parser.error("PROJECTNAME, --filter or --file is required")
+
+    if args.func == _do_sync and args.source_name == args.target_name:
+        parser.error("SRC and DST must be different providers")
+
+    def _make_provider(provider_config_obj):
+        cls = _get_provider_class(provider_config_obj["type"])
+        provider = cls.parse_config(default_config_dir, default_user, provider_config_obj)
+        provider.set_page_cache(PageCache(
+            make_path(default_config_dir, "cache", provider.name),
+            ttl=args.cache_ttl,
+            refresh=args.refresh,
+            offline=args.offline))
+        return provider
+
+    # Commands are answered by the daemon when one is running with the
+    # current configuration
+    remote = None
+    if args.use_daemon and args.func != _do_serve:
+        remote = _make_remote_provider_map(default_config_dir, default_config_path, provider_config_objs)
+
+    if remote is not None:
+        client, provider_map = remote
+        if args.refresh:
+            client.request("invalidate")
+    else:
+        provider_map = _ProviderMap(provider_config_objs, _make_provider)
+
+    stats = None
+    if args.stats:
+        stats = Stats()
+        add_callback(stats.record)
+
+    trace_writer = None
+    if args.trace_path is not None:
+        trace_writer = TraceWriter(args.trace_path, format=args.trace_format)
+        add_callback(trace_writer.write)
+
+    try:
+        args.func(args, provider_map)
+    finally:
+        if trace_writer is not None:
+            remove_callback(trace_writer.write)
+            trace_writer.close()
+        if stats is not None:
+            remove_callback(stats.record)
+            stats.show()
 
 if __name__ == "__main__":
     _main()
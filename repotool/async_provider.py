@@ -0,0 +1,76 @@
+##################################################
+# Copyright (C) 2017, All rights reserved.
+##################################################
+
+from repotool.concurrency import DEFAULT_MAX_WORKERS, make_thread_pool
+
+# Look methods up on the worker so that a provider that does not support
+# an operation fails through its AsyncResult like any other error
+def _call_method(obj, method_name, args, kwargs):
+    return getattr(obj, method_name)(*args, **kwargs)
+
+class AsyncProvider(object):
+    def __init__(self, provider, pool):
+        self._provider = provider
+        self._pool = pool
+
+    @property
+    def provider(self): return self._provider
+
+    @property
+    def name(self): return self._provider.name
+
+    @property
+    def provider_name(self): return self._provider.provider_name
+
+    def get_project(self, project_name):
+        return self._submit("get_project", project_name)
+
+    def get_projects(self, include_archived=False, incremental=False, name_matcher=None, lazy=False):
+        return self._submit(
+            "get_projects",
+            include_archived=include_archived,
+            incremental=incremental,
+            name_matcher=name_matcher,
+            lazy=lazy)
+
+    def create_project(self, project_name, is_private=True):
+        return self._submit("create_project", project_name, is_private=is_private)
+
+    def delete_project(self, project, confirmation_token=False):
+        return self._submit("delete_project", project, confirmation_token=confirmation_token)
+
+    def archive_project(self, project, confirmation_token=False):
+        return self._submit("archive_project", project, confirmation_token=confirmation_token)
+
+    def _submit(self, method_name, *args, **kwargs):
+        return self._pool.apply_async(_call_method, (self._provider, method_name, args, kwargs))
+
+class AsyncBackend(object):
+    """
+    Runs provider calls on a shared pool of worker threads so that many
+    requests across providers can be in flight at once
+
+    Each AsyncProvider method returns an AsyncResult immediately; pass
+    these to concurrency.gather to wait for them
+    """
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS):
+        self._pool = make_thread_pool(max_workers)
+        self._providers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def wrap(self, provider):
+        async_provider = self._providers.get(provider)
+        if async_provider is None:
+            async_provider = AsyncProvider(provider, self._pool)
+            self._providers[provider] = async_provider
+        return async_provider
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
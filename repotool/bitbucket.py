@@ -4,21 +4,78 @@
 
 from __future__ import print_function
 import os
+import threading
+import urllib
+import urlparse
 import yaml
 
 from pyprelude.file_system import make_path
 from pyprelude.url import make_url, open_browser
 from requests_oauthlib import OAuth2Session
 
-from repotool.owner import Owner
-from repotool.project import Project
+from repotool.concurrency import DEFAULT_PAGE_WORKERS, Coalescer, imap_ordered
+from repotool.identity import intern_owner, intern_project
+from repotool.instrument import traced_request
+from repotool.jsonutil import decode_json
+from repotool.project import Project, make_projects
+from repotool.ratelimit import RateLimiter
+from repotool.session import SessionSettings
+from repotool.snapshot import DEFAULT_RECONCILE_INTERVAL, sync_project_objs
 
 _BITBUCKET_AUTH_URL = "https://bitbucket.org/site/oauth2/authorize"
 _BITBUCKET_TOKEN_URL = "https://bitbucket.org/site/oauth2/access_token"
 _BITBUCKET_API_URL = "https://api.bitbucket.org/2.0"
+_RATE_LIMIT_HEADER_PREFIX = "X-RateLimit-"
+_PAGE_LENGTH = 100
+
+# Partial response limited to the fields read by _make_project and the
+# paging fields used to fetch the remaining pages concurrently
+_PROJECT_FIELDS = ",".join([
+    "next",
+    "page",
+    "pagelen",
+    "size",
+    "values.description",
+    "values.full_name",
+    "values.is_private",
+    "values.links.clone",
+    "values.name",
+    "values.owner.type",
+    "values.owner.username",
+    "values.owner.uuid",
+    "values.parent.full_name",
+    "values.scm",
+    "values.updated_on",
+    "values.uuid"
+])
+
+def _get_page_count(projects_obj):
+    """
+    >>> _get_page_count({ "size": 250, "pagelen": 100 })
+    3
+    >>> _get_page_count({ "pagelen": 100 }) is None
+    True
+    """
+    size = projects_obj.get("size")
+    page_length = projects_obj.get("pagelen")
+    if size is None or not page_length:
+        return None
+
+    return (size + page_length - 1) // page_length
+
+def _make_page_url(url, page):
+    """
+    >>> _make_page_url("https://host/api?pagelen=100&page=1", 3)
+    'https://host/api?pagelen=100&page=3'
+    """
+    parts = list(urlparse.urlparse(url))
+    query = [(k, v) for k, v in urlparse.parse_qsl(parts[4]) if k != "page"]
+    parts[4] = urllib.urlencode(query + [("page", page)])
+    return urlparse.urlunparse(parts)
 
 def _make_project(provider, project_obj):
     clone_links = { x["name"]: x["href"] for x in project_obj["links"]["clone"] }
+    parent_obj = project_obj.get("parent")
     return Project(
         provider,
         None,
@@ -30,7 +87,12 @@ def _make_project(provider, project_obj):
         project_obj["scm"],
         project_obj["is_private"],
         False,
-        clone_links)
+        clone_links,
+        clone_link_templates=provider._clone_link_templates,
+        clone_path=project_obj["full_name"],
+        last_updated=project_obj.get("updated_on"),
+        is_fork=parent_obj is not None,
+        parent_full_name=None if parent_obj is None else parent_obj["full_name"])
 
 class Bitbucket(object):
     @staticmethod
@@ -49,88 +111,212 @@ class Bitbucket(object):
         user = obj.get("user", default_user)
         api_key = obj["api-key"]
         api_secret = obj["api-secret"]
-        return Bitbucket(name, config_dir, user, api_key, api_secret)
+        page_workers = obj.get("page-workers", DEFAULT_PAGE_WORKERS)
+        session_settings = SessionSettings.parse_config(obj)
+        reconcile_interval = obj.get("reconcile-interval", DEFAULT_RECONCILE_INTERVAL)
+        rate_limiter = RateLimiter.parse_config(_RATE_LIMIT_HEADER_PREFIX, obj)
+        api_url = obj.get("api-url", _BITBUCKET_API_URL)
+        return Bitbucket(
+            name,
+            config_dir,
+            user,
+            api_key,
+            api_secret,
+            page_workers=page_workers,
+            session_settings=session_settings,
+            reconcile_interval=reconcile_interval,
+            rate_limiter=rate_limiter,
+            api_url=api_url)
+
+    def __init__(self, name, config_dir, user, api_key, api_secret, page_workers=DEFAULT_PAGE_WORKERS, session_settings=None, reconcile_interval=DEFAULT_RECONCILE_INTERVAL, rate_limiter=None, api_url=_BITBUCKET_API_URL):
+        if session_settings is None:
+            session_settings = SessionSettings()
+
+        if rate_limiter is None:
+            rate_limiter = RateLimiter(_RATE_LIMIT_HEADER_PREFIX)
 
-    def __init__(self, name, config_dir, user, api_key, api_secret):
         self._name = name
         self._cached_token_path = make_path(config_dir, "bitbucket.token.yaml")
+        self._snapshot_dir = make_path(config_dir, "snapshots")
         self._user = user
         self._api_key = api_key
         self._api_secret = api_secret
+        self._page_workers = page_workers
+        self._reconcile_interval = reconcile_interval
+        self._clone_link_templates = {
+            "https": "https://" + user + "@bitbucket.org/{path}.git",
+            "ssh": "git@bitbucket.org:{path}.git"
+        }
+        self._rate_limiter = rate_limiter
+        self._api_url = api_url
+        self._session_settings = session_settings
+        self._timeout = session_settings.timeout
         self._client = None
-        self._owners = {}
+        self._client_lock = threading.Lock()
+        self._page_cache = None
+        self._project_lookups = Coalescer()
 
     @property
     def name(self): return self._name
 
+    @property
+    def api_url(self): return self._api_url
+
     @property
     def provider_name(self): return "Bitbucket"
 
+    @property
+    def rate_limit_budget(self): return self._rate_limiter.budget
+
+    def set_page_cache(self, page_cache):
+        self._page_cache = page_cache
+
     def get_project(self, project_name):
-        r = self._do_request("get", "repositories", self._user, project_name)
-        return _make_project(self, r.json())
+        def _get_project():
+            r = self._do_request("get", "repositories", self._user, project_name)
+            return _make_project(self, decode_json(r.content))
 
-    def get_projects(self, include_archived=False):
-        projects = []
-        url = make_url(_BITBUCKET_API_URL, "repositories", self._user)
-        while url is not None:
-            r = self._do_request_raw("get", url)
-            projects_obj = r.json()
-            projects.extend(map(lambda o: _make_project(self, o), projects_obj["values"]))
-            url = projects_obj.get("next")
+        # Concurrent lookups of the same project share a single request
+        return self._project_lookups.call(project_name.lower(), _get_project)
 
-        return projects
+    def get_projects(self, include_archived=False, incremental=False, name_matcher=None, lazy=False):
+        return list(self.iter_projects(include_archived=include_archived, incremental=incremental, name_matcher=name_matcher, lazy=lazy))
+
+    def iter_projects(self, include_archived=False, incremental=False, name_matcher=None, lazy=False):
+        return make_projects(self, self._iter_project_objs(incremental), _make_project, name_matcher=name_matcher, lazy=lazy)
+
+    def create_project(self, project_name, is_private=True):
+        url = make_url(self._api_url, "repositories", self._user, project_name)
+        self._do_oauth_dance()
+        r = traced_request(self._name, "post", url, lambda: self._rate_limiter.request(lambda: self._client.post(
+            url,
+            json={ "scm": "git", "is_private": is_private },
+            timeout=self._timeout)))
+        r.raise_for_status()
+        self._invalidate_page_cache()
+        return _make_project(self, r.json())
 
-    def delete_project(self, name_or_id, confirmation_token=False):
+    def delete_project(self, project, confirmation_token=False):
         if not confirmation_token:
             raise RuntimeError("Dangerous operation disallowed")
 
         if self != project.provider:
             raise RuntimeError("Project does not belong to this provider")
 
-        self._delete(_BITBUCKET_API_URL, "repositories", self._user, name_or_id)
+        self._delete(self._api_url, "repositories", self._user, project.name)
+
+    def get_source_obj(self, project):
+        # Listings name only the parent, which has to be fetched in full
+        if project.parent_full_name is None:
+            return None
+
+        r = self._do_request("get", "repositories", *project.parent_full_name.split("/"))
+        return decode_json(r.content)
+
+    def _iter_project_objs(self, incremental):
+        if incremental:
+            project_objs = sync_project_objs(
+                make_path(self._snapshot_dir, "{}.json".format(self._name)),
+                "uuid",
+                lambda: self._get_project_objs(self._make_projects_url()),
+                lambda since: self._get_project_objs(self._make_projects_url(q="updated_on > {}".format(since))),
+                reconcile_interval=self._reconcile_interval,
+                offline=self._page_cache is not None and self._page_cache.is_offline)
+            for project_obj in project_objs:
+                yield project_obj
+            return
+
+        for page_obj in self._iter_project_pages(self._make_projects_url()):
+            for project_obj in page_obj:
+                yield project_obj
+
+    def _get_project_objs(self, url):
+        return [o for page_obj in self._iter_project_pages(url) for o in page_obj]
+
+    def _make_projects_url(self, **kwargs):
+        return make_url(
+            self._api_url,
+            "repositories",
+            self._user,
+            [("pagelen", _PAGE_LENGTH), ("fields", _PROJECT_FIELDS), ("page", 1)],
+            **kwargs)
+
+    def _iter_project_pages(self, url):
+        projects_obj = decode_json(self._do_request_raw("get", url).content)
+        yield projects_obj["values"]
+
+        page_count = _get_page_count(projects_obj)
+        if page_count is not None and self._page_workers > 1:
+            page_urls = [_make_page_url(url, page) for page in range(2, page_count + 1)]
+            for r in imap_ordered(lambda u: self._do_request_raw("get", u), page_urls, max_workers=self._page_workers):
+                yield decode_json(r.content)["values"]
+            return
+
+        url = projects_obj.get("next")
+        while url is not None:
+            projects_obj = decode_json(self._do_request_raw("get", url).content)
+            yield projects_obj["values"]
+            url = projects_obj.get("next")
 
     def _delete(self, *args, **kwargs):
         url = make_url(*args, **kwargs)
         self._do_oauth_dance()
-        r = self._client.delete(url)
+        r = traced_request(self._name, "delete", url, lambda: self._rate_limiter.request(lambda: self._client.delete(url, timeout=self._timeout)))
         r.raise_for_status()
+        self._invalidate_page_cache()
 
     def _do_request(self, method, *args, **kwargs):
-        url = make_url(*[_BITBUCKET_API_URL] + list(args), **kwargs)
+        url = make_url(*[self._api_url] + list(args), **kwargs)
         return self._do_request_raw(method, url)
 
     def _do_request_raw(self, method, url):
+        return traced_request(self._name, method, url, lambda: self._get_response(method, url))
+
+    def _get_response(self, method, url):
+        if method == "get" and self._page_cache is not None:
+            return self._page_cache.get(url, lambda headers: self._send_request(method, url, headers))
+
+        return self._send_request(method, url)
+
+    def _send_request(self, method, url, headers=None):
         self._do_oauth_dance()
-        r = self._client.request(method, url)
+        r = self._rate_limiter.request(lambda: self._client.request(method, url, headers=headers, timeout=self._timeout))
         r.raise_for_status()
         return r
 
+    def _invalidate_page_cache(self):
+        if self._page_cache is not None:
+            self._page_cache.clear()
+
     def _do_oauth_dance(self):
-        if self._client is None:
-            def _update_token(token):
-                self._save_token(token)
-
-            token = self._load_token()
-            self._client = OAuth2Session(
-                self._api_key,
-                token=token,
-                auto_refresh_url=_BITBUCKET_TOKEN_URL,
-                auto_refresh_kwargs={ "client_id": self._api_key, "client_secret": self._api_secret },
-                token_updater=_update_token)
-
-            if token is None:
-                auth_url = self._client.authorization_url(_BITBUCKET_AUTH_URL)[0]
-                if not open_browser(auth_url):
-                    print("Please go here and authorize: {}".format(auth_url))
-
-                redirect_response = raw_input("Paste full redirect URL here: ")
-                token = self._client.fetch_token(
-                    _BITBUCKET_TOKEN_URL,
-                    authorization_response=redirect_response,
-                    username=self._api_key,
-                    password=self._api_secret)
-                self._save_token(token)
+        # Lookups on several threads may need the client at once, but the
+        # user must only be asked to authorize once
+        with self._client_lock:
+            if self._client is None:
+                def _update_token(token):
+                    self._save_token(token)
+
+                token = self._load_token()
+                self._client = OAuth2Session(
+                    self._api_key,
+                    token=token,
+                    auto_refresh_url=_BITBUCKET_TOKEN_URL,
+                    auto_refresh_kwargs={ "client_id": self._api_key, "client_secret": self._api_secret },
+                    token_updater=_update_token)
+                self._session_settings.mount(self._client)
+
+                if token is None:
+                    auth_url = self._client.authorization_url(_BITBUCKET_AUTH_URL)[0]
+                    if not open_browser(auth_url):
+                        print("Please go here and authorize: {}".format(auth_url))
+
+                    redirect_response = raw_input("Paste full redirect URL here: ")
+                    token = self._client.fetch_token(
+                        _BITBUCKET_TOKEN_URL,
+                        authorization_response=redirect_response,
+                        username=self._api_key,
+                        password=self._api_secret)
+                    self._save_token(token)
 
     def _load_token(self):
         if os.path.isfile(self._cached_token_path):
@@ -147,14 +333,7 @@ class Bitbucket(object):
             yaml.dump(token, f, default_flow_style=False)
 
     def _get_owner(self, owner_obj):
-        id = owner_obj["uuid"]
-        owner = self._owners.get(id)
-        if owner is not None:
-            return owner
-
-        owner = Owner(
-            owner_obj["type"].lower(),
-            id,
-            owner_obj["username"])
-        self._owners[id] = owner
-        return owner
+        return intern_owner(self._api_url, owner_obj["type"].lower(), owner_obj["uuid"], owner_obj["username"])
+
+    def _get_source(self, source_obj):
+        return intern_project(self._api_url, source_obj["uuid"], lambda: _make_project(self, source_obj))
@@ -0,0 +1,124 @@
+##################################################
+# Copyright (C) 2017, All rights reserved.
+##################################################
+
+import errno
+import hashlib
+import json
+import os
+import time
+
+from pyprelude.file_system import make_path
+
+from repotool.fileutil import write_file_atomically
+from repotool.jsonutil import load_json
+
+DEFAULT_CACHE_TTL = 300
+
+_CACHED_HEADERS = [
+    "Content-Type",
+    "ETag",
+    "Last-Modified",
+    "Link",
+    "X-Next-Page",
+    "X-Page",
+    "X-Per-Page",
+    "X-Total",
+    "X-Total-Pages"
+]
+
+def _make_response(url, entry):
+    # Providers have loaded requests by the time a page is served, so
+    # importing it here keeps it out of CLI startup
+    import requests
+    from requests.structures import CaseInsensitiveDict
+
+    r = requests.Response()
+    r.status_code = 200
+    r.url = url
+    r.headers = CaseInsensitiveDict(entry["headers"])
+    r.encoding = "utf-8"
+    r._content = entry["content"].encode("utf-8")
+    return r
+
+class PageCache(object):
+    def __init__(self, cache_dir, ttl=DEFAULT_CACHE_TTL, refresh=False, offline=False):
+        self._cache_dir = cache_dir
+        self._ttl = ttl
+        self._refresh = refresh
+        self._offline = offline
+
+    @property
+    def cache_dir(self): return self._cache_dir
+
+    @property
+    def is_offline(self): return self._offline
+
+    def get(self, url, fetch):
+        entry = self._load_entry(url)
+        if entry is not None:
+            if self._offline or (not self._refresh and time.time() - entry["timestamp"] < self._ttl):
+                r = _make_response(url, entry)
+                r.is_cache_hit = True
+                return r
+        elif self._offline:
+            raise RuntimeError("Page {} is not available offline".format(url))
+
+        headers = {}
+        if entry is not None:
+            etag = entry["headers"].get("ETag")
+            if etag is not None:
+                headers["If-None-Match"] = etag
+            last_modified = entry["headers"].get("Last-Modified")
+            if last_modified is not None:
+                headers["If-Modified-Since"] = last_modified
+
+        r = fetch(headers)
+        if r.status_code == 304 and entry is not None:
+            entry["timestamp"] = time.time()
+            self._save_entry(url, entry)
+            return _make_response(url, entry)
+
+        self._save_entry(url, {
+            "timestamp": time.time(),
+            "headers": { k: r.headers[k] for k in _CACHED_HEADERS if k in r.headers },
+            "content": r.text
+        })
+        return r
+
+    def clear(self):
+        # Remove entries one at a time, tolerating concurrent clears and
+        # keeping the directory for writers that are about to use it
+        if not os.path.isdir(self._cache_dir):
+            return
+
+        for file_name in os.listdir(self._cache_dir):
+            try:
+                os.remove(make_path(self._cache_dir, file_name))
+            except OSError:
+                pass
+
+    def _get_entry_path(self, url):
+        # Hash URLs so that tokens passed in query strings do not end up in file names
+        return make_path(self._cache_dir, "{}.json".format(hashlib.sha1(url).hexdigest()))
+
+    def _load_entry(self, url):
+        path = self._get_entry_path(url)
+        if not os.path.isfile(path):
+            return None
+
+        try:
+            with open(path, "rt") as f:
+                return load_json(f)
+        except IOError:
+            # Removed by a concurrent clear
+            return None
+
+    def _save_entry(self, url, entry):
+        try:
+            write_file_atomically(self._get_entry_path(url), lambda f: json.dump(entry, f))
+        except OSError as e:
+            # A concurrent clear removed the temporary file, and with it
+            # the page that the clear was meant to discard
+            if e.errno != errno.ENOENT:
+                raise
@@ -0,0 +1,293 @@
+##################################################
+# Copyright (C) 2017, All rights reserved.
+##################################################
+
+import Queue
+import threading
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_PAGE_WORKERS = 4
+DEFAULT_MAX_PENDING = 1000
+
+# Waiting on AsyncResult.get with a timeout keeps the main thread responsive
+# to Ctrl+C under Python 2.7, which blocks signals during an untimed wait
+_WAIT_TIMEOUT = 60 * 60 * 24
+_POLL_INTERVAL = 0.1
+_DONE = object()
+
+def make_thread_pool(worker_count):
+    # multiprocessing is slow to import, so it is only loaded once a
+    # command runs something concurrently
+    from multiprocessing.pool import ThreadPool
+    return ThreadPool(worker_count)
+
+def _capture(func):
+    def _wrapper(item):
+        try:
+            return func(item), None
+        except Exception as e:
+            return None, e
+
+    return _wrapper
+
+def _map(func, items, max_workers):
+    items = list(items)
+    worker_count = min(max_workers, len(items))
+    if worker_count <= 1:
+        return map(func, items)
+
+    pool = make_thread_pool(worker_count)
+    try:
+        return pool.map_async(func, items).get(_WAIT_TIMEOUT)
+    finally:
+        pool.terminate()
+        pool.join()
+
+def map_ordered(func, items, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Applies func to each item using up to max_workers threads and returns
+    the results in the same order as items, raising the first error
+
+    >>> map_ordered(lambda x: x * x, range(5), max_workers=3)
+    [0, 1, 4, 9, 16]
+    """
+    return _map(func, items, max_workers)
+
+def try_map(func, items, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Applies func to each item using up to max_workers threads and returns
+    a (result, error) pair per item in the same order as items
+
+    >>> try_map(lambda x: 10 // x, [1, 2, 0], max_workers=2)
+    [(10, None), (5, None), (None, ZeroDivisionError('integer division or modulo by zero',))]
+    """
+    return _map(_capture(func), items, max_workers)
+
+def gather(async_results):
+    """
+    Waits for each AsyncResult and returns a (result, error) pair per
+    result in the same order
+    """
+    results = []
+    for async_result in async_results:
+        try:
+            results.append((async_result.get(_WAIT_TIMEOUT), None))
+        except Exception as e:
+            results.append((None, e))
+
+    return results
+
+def imap_ordered(func, items, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Like map_ordered but yields each result as soon as it and all results
+    before it are available
+
+    >>> list(imap_ordered(lambda x: x * x, range(5), max_workers=3))
+    [0, 1, 4, 9, 16]
+    """
+    items = list(items)
+    worker_count = min(max_workers, len(items))
+    if worker_count <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    pool = make_thread_pool(worker_count)
+    try:
+        results = pool.imap(func, items)
+        for _ in items:
+            yield results.next(_WAIT_TIMEOUT)
+    finally:
+        pool.terminate()
+        pool.join()
+
+def _put(q, entry, stopped):
+    # Gives up once the consumer has stopped instead of blocking forever
+    # on a queue that nobody will drain
+    while not stopped.is_set():
+        try:
+            q.put(entry, timeout=_POLL_INTERVAL)
+            return True
+        except Queue.Full:
+            pass
+
+    return False
+
+def _stop_producers(pool, stopped):
+    # Producers may be blocked inside func, such as on pages that a
+    # provider fetches concurrently, where they cannot see stopped, so the
+    # pool is not joined: its daemon threads finish or are dropped at exit
+    stopped.set()
+    pool.terminate()
+
+def iter_concurrently(func, items, max_workers=DEFAULT_MAX_WORKERS, max_pending=DEFAULT_MAX_PENDING):
+    """
+    Iterates over func(item) for each item using up to max_workers threads
+    and yields (item, value, error) triples in arrival order, where error is
+    the exception raised by func(item) or while iterating over its result
+
+    At most max_pending values are buffered ahead of the consumer
+
+    >>> sorted(iter_concurrently(lambda x: range(x), [1, 2], max_workers=2))
+    [(1, 0, None), (2, 0, None), (2, 1, None)]
+    """
+    items = list(items)
+    worker_count = min(max_workers, len(items))
+    if worker_count == 0:
+        return
+
+    q = Queue.Queue(max_pending)
+    stopped = threading.Event()
+
+    def _produce(item):
+        try:
+            for value in func(item):
+                if not _put(q, (item, value, None), stopped):
+                    return
+        except Exception as e:
+            _put(q, (item, None, e), stopped)
+        _put(q, _DONE, stopped)
+
+    pool = make_thread_pool(worker_count)
+    try:
+        pool.map_async(_produce, items)
+        done_count = 0
+        while done_count < len(items):
+            entry = q.get(True, _WAIT_TIMEOUT)
+            if entry is _DONE:
+                done_count += 1
+            else:
+                yield entry
+    finally:
+        _stop_producers(pool, stopped)
+
+def iter_concurrently_in_order(func, items, max_workers=DEFAULT_MAX_WORKERS, max_pending=DEFAULT_MAX_PENDING):
+    """
+    Like iter_concurrently but yields the triples of each item together
+    and in the order of items, buffering up to max_pending values of each
+    later item while the values of earlier ones are consumed
+
+    >>> list(iter_concurrently_in_order(lambda x: range(x), [2, 1], max_workers=2))
+    [(2, 0, None), (2, 1, None), (1, 0, None)]
+    """
+    items = list(items)
+    worker_count = min(max_workers, len(items))
+    if worker_count == 0:
+        return
+
+    queues = [Queue.Queue(max_pending) for _ in items]
+    stopped = threading.Event()
+
+    def _produce(i):
+        item, q = items[i], queues[i]
+        try:
+            for value in func(item):
+                if not _put(q, (item, value, None), stopped):
+                    return
+        except Exception as e:
+            _put(q, (item, None, e), stopped)
+        _put(q, _DONE, stopped)
+
+    # Items are started in order, so the item being consumed is always
+    # running even when every other worker is blocked on a full queue
+    pool = make_thread_pool(worker_count)
+    try:
+        pool.map_async(_produce, range(len(items)), chunksize=1)
+        for q in queues:
+            while True:
+                entry = q.get(True, _WAIT_TIMEOUT)
+                if entry is _DONE:
+                    break
+                yield entry
+    finally:
+        _stop_producers(pool, stopped)
+
+def iter_pipelined(first, second, items, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Applies first to each item and then second to the item and the result
+    of first, using a pool of up to max_workers threads for each stage so
+    that the second stage for earlier items overlaps the first stage for
+    later ones, and yields (item, result, error) triples in completion
+    order
+
+    >>> sorted(iter_pipelined(lambda x: x + 1, lambda x, y: x * y, [1, 2, 0], max_workers=2))
+    [(0, 0, None), (1, 2, None), (2, 6, None)]
+    """
+    items = list(items)
+    worker_count = min(max_workers, len(items))
+    if worker_count == 0:
+        return
+
+    q = Queue.Queue()
+
+    def _run_second(item, value):
+        try:
+            q.put((item, second(item, value), None))
+        except Exception as e:
+            q.put((item, None, e))
+
+    def _run_first(item):
+        try:
+            value = first(item)
+        except Exception as e:
+            q.put((item, None, e))
+            return
+
+        second_pool.apply_async(_run_second, (item, value))
+
+    first_pool = make_thread_pool(worker_count)
+    second_pool = make_thread_pool(worker_count)
+    try:
+        first_pool.map_async(_run_first, items)
+        for _ in items:
+            yield q.get(True, _WAIT_TIMEOUT)
+    finally:
+        for pool in [first_pool, second_pool]:
+            pool.terminate()
+            pool.join()
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class Coalescer(object):
+    """
+    Merges concurrent calls that share a key: callers that arrive while a
+    call for their key is in flight wait for it and share its result or
+    error instead of making the call again
+
+    >>> coalescer = Coalescer()
+    >>> coalescer.call("key", lambda: 42)
+    42
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def call(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not is_leader:
+            call.done.wait(_WAIT_TIMEOUT)
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
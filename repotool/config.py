@@ -0,0 +1,64 @@
+##################################################
+# Copyright (C) 2017, All rights reserved.
+##################################################
+
+import marshal
+import os
+
+from repotool.fileutil import write_file_atomically
+
+def get_config_stamp(path):
+    st = os.stat(path)
+    return [st.st_mtime, st.st_size]
+
+def _load_cached_config(cache_path, stamp):
+    try:
+        with open(cache_path, "rb") as f:
+            entry = marshal.load(f)
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+
+    if not isinstance(entry, dict) or entry.get("stamp") != stamp:
+        return None
+
+    return entry.get("config")
+
+def _save_cached_config(cache_path, stamp, config_obj):
+    try:
+        data = marshal.dumps({ "stamp": stamp, "config": config_obj })
+    except ValueError:
+        # The configuration holds values that marshal cannot represent,
+        # such as YAML timestamps, so it is parsed every time instead
+        return
+
+    write_file_atomically(cache_path, lambda f: f.write(data), mode="wb")
+
+def read_config(config_path, cache_path, make_default_config):
+    """
+    Returns the configuration in the YAML file at config_path, writing the
+    object returned by make_default_config to it first if it is missing
+
+    The parsed configuration is cached at cache_path in a form that loads
+    without importing the YAML parser and is used for as long as the
+    modification time and size of config_path are unchanged
+    """
+    if os.path.isfile(config_path):
+        stamp = get_config_stamp(config_path)
+        config_obj = _load_cached_config(cache_path, stamp)
+        if config_obj is not None:
+            return config_obj
+
+    # The YAML parser is slow to import, so it is only loaded on a cache miss
+    import yaml
+
+    if not os.path.isfile(config_path):
+        config_obj = make_default_config()
+        with open(config_path, "wt") as f:
+            f.write(yaml.dump(config_obj))
+        return config_obj
+
+    with open(config_path, "rt") as f:
+        config_obj = yaml.load(f)
+
+    _save_cached_config(cache_path, stamp, config_obj)
+    return config_obj
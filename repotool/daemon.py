@@ -0,0 +1,421 @@
+##################################################
+# Copyright (C) 2017, All rights reserved.
+##################################################
+
+from __future__ import print_function
+import SocketServer
+import errno
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+from repotool.concurrency import Coalescer
+from repotool.forks import resolve_sources
+from repotool.identity import clear_namespace, intern_owner, intern_project
+from repotool.jsonutil import decode_json
+from repotool.project import Project, make_projects
+from repotool.ratelimit import RateLimitBudget
+
+DEFAULT_REFRESH_INTERVAL = 300
+
+_RECV_SIZE = 1024 * 1024
+_OPERATIONS = ["create", "delete", "archive"]
+
+def _owner_to_obj(owner):
+    return None if owner is None else [owner.type, owner.id, owner.user_name]
+
+def project_to_obj(project):
+    """
+    Returns a JSON-serializable object holding every attribute of project
+    and of the project it was forked from
+    """
+    source = project.source
+    return {
+        "id": project.id,
+        "name": project.name,
+        "full_name": project.full_name,
+        "description": project.description,
+        "scm": project.scm,
+        "private": project.is_private,
+        "archived": project.is_archived,
+        "fork": project.is_fork,
+        "last_updated": project.last_updated,
+        "clone_links": { k: project.clone_link(k) for k in project.clone_link_keys() },
+        "owner": _owner_to_obj(project.owner),
+        "source": None if source is None else project_to_obj(source)
+    }
+
+def _make_project(provider, project_obj):
+    owner_obj = project_obj["owner"]
+    source_obj = project_obj["source"]
+    return Project(
+        provider,
+        None if source_obj is None else provider._get_source(source_obj),
+        None if owner_obj is None else provider._get_owner(owner_obj),
+        project_obj["id"],
+        project_obj["name"],
+        project_obj["full_name"],
+        project_obj["description"],
+        project_obj["scm"],
+        project_obj["private"],
+        project_obj["archived"],
+        project_obj["clone_links"],
+        last_updated=project_obj["last_updated"],
+        is_fork=project_obj["fork"])
+
+def get_operations(provider):
+    return [op for op in _OPERATIONS if hasattr(provider, "{}_project".format(op))]
+
+class DaemonClient(object):
+    """
+    Sends requests to the daemon listening on socket_path, one connection
+    per request
+    """
+    def __init__(self, socket_path):
+        self._socket_path = socket_path
+
+    def request(self, method, **params):
+        params["method"] = method
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            s.connect(self._socket_path)
+            s.sendall(json.dumps(params) + "\n")
+            chunks = []
+            while True:
+                data = s.recv(_RECV_SIZE)
+                if not data:
+                    break
+                chunks.append(data)
+        finally:
+            s.close()
+
+        response = decode_json("".join(chunks))
+        error = response.get("error")
+        if error is not None:
+            raise RuntimeError(error)
+
+        return response["result"]
+
+def connect(socket_path):
+    """
+    Returns a DaemonClient and the status of the daemon listening on
+    socket_path, or (None, None) if none is
+    """
+    if not os.path.exists(socket_path):
+        return None, None
+
+    client = DaemonClient(socket_path)
+    try:
+        return client, client.request("status")
+    except socket.error as e:
+        if e.errno in [errno.ECONNREFUSED, errno.ENOENT]:
+            return None, None
+        raise
+
+class RemoteProvider(object):
+    """
+    Stands in for a provider served by the daemon, answering each call
+    from the daemon's warm providers and catalog
+    """
+    def __init__(self, client, name, provider_name, api_url, operations):
+        self._client = client
+        self._name = name
+        self._provider_name = provider_name
+        self._api_url = api_url
+
+        # Bulk operations check for these methods to decide which
+        # providers support them
+        if "archive" in operations:
+            self.archive_project = self._archive_project
+
+    @property
+    def name(self): return self._name
+
+    @property
+    def provider_name(self): return self._provider_name
+
+    @property
+    def api_url(self): return self._api_url
+
+    @property
+    def rate_limit_budget(self):
+        return RateLimitBudget(*self._client.request("rate_limit_budget", provider=self._name))
+
+    def set_page_cache(self, page_cache):
+        pass
+
+    def get_project(self, project_name):
+        project_obj = self._client.request("get_project", provider=self._name, project_name=project_name)
+        return _make_project(self, project_obj)
+
+    def get_projects(self, include_archived=False, incremental=False, name_matcher=None, lazy=False):
+        return list(self.iter_projects(include_archived=include_archived, incremental=incremental, name_matcher=name_matcher, lazy=lazy))
+
+    def iter_projects(self, include_archived=False, incremental=False, name_matcher=None, lazy=False):
+        # The daemon keeps its catalog current, so incremental listings
+        # are answered from it like any other
+        project_objs = self._client.request("get_projects", provider=self._name, include_archived=include_archived)
+        return make_projects(self, project_objs, _make_project, name_matcher=name_matcher, lazy=lazy)
+
+    def create_project(self, project_name, is_private=True):
+        project_obj = self._client.request("create_project", provider=self._name, project_name=project_name, is_private=is_private)
+        return _make_project(self, project_obj)
+
+    def delete_project(self, project, confirmation_token=False):
+        if not confirmation_token:
+            raise RuntimeError("Dangerous operation disallowed")
+
+        if self != project.provider:
+            raise RuntimeError("Project does not belong to this provider")
+
+        self._client.request("delete_project", provider=self._name, project_name=project.name)
+
+    def _archive_project(self, project, confirmation_token=False):
+        if not confirmation_token:
+            raise RuntimeError("Dangerous operation disallowed")
+
+        if self != project.provider:
+            raise RuntimeError("Project does not belong to this provider")
+
+        self._client.request("archive_project", provider=self._name, project_name=project.name)
+
+    def _get_owner(self, owner_obj):
+        type, id, user_name = owner_obj
+        return intern_owner(self._api_url, type, id, user_name)
+
+    def _get_source(self, source_obj):
+        return intern_project(self._api_url, source_obj["id"], lambda: _make_project(self, source_obj))
+
+class _Handler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = decode_json(self.rfile.readline())
+            content = "{{\"result\": {}}}".format(self.server.daemon.handle(request))
+        except Exception as e:
+            content = json.dumps({ "error": str(e) or type(e).__name__ })
+        self.wfile.write(content)
+        self.wfile.write("\n")
+
+class _UnixStreamServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+class Daemon(object):
+    """
+    Serves providers and an in-memory catalog of their projects over a
+    Unix socket
+
+    Listings are encoded once when they are loaded and refreshed in the
+    background every refresh_interval seconds; mutations made through the
+    daemon, and invalidate requests, discard the affected provider's
+    listings and projects and reload its listings straight away
+
+    The sources of forks missing from listings are looked up as listings
+    are loaded and kept in fork_cache
+    """
+    def __init__(self, providers, socket_path, refresh_interval=DEFAULT_REFRESH_INTERVAL, config_stamp=None, fork_cache=None):
+        self._providers = { p.name: p for p in providers }
+        self._socket_path = socket_path
+        self._refresh_interval = refresh_interval
+        self._config_stamp = config_stamp
+        self._fork_cache = fork_cache
+        self._lock = threading.Lock()
+        self._catalogs = {}
+        self._catalog_keys = set((name, False) for name in self._providers)
+        self._projects = {}
+        self._generations = { name: 0 for name in self._providers }
+        self._loads = Coalescer()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._server = None
+
+    def serve_forever(self):
+        # Only the owner may connect, since the daemon acts with their tokens
+        old_umask = os.umask(0o177)
+        try:
+            self._server = _UnixStreamServer(self._socket_path, _Handler)
+        finally:
+            os.umask(old_umask)
+        self._server.daemon = self
+
+        refresh_thread = threading.Thread(target=self._refresh_catalogs)
+        refresh_thread.daemon = True
+        refresh_thread.start()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            os.remove(self._socket_path)
+            self._stopped.set()
+            self._wake.set()
+            refresh_thread.join()
+
+    def stop(self):
+        # Shutting down waits for serve_forever to return, so it must not
+        # block the handler thread that asked for it
+        threading.Thread(target=self._server.shutdown).start()
+
+    def handle(self, request):
+        """
+        Returns the JSON text of the result of request
+        """
+        method = request["method"]
+        if method == "status":
+            return json.dumps(self._get_status())
+
+        if method == "stop":
+            self.stop()
+            return "null"
+
+        if method == "invalidate":
+            provider_name = request.get("provider")
+            self.invalidate(None if provider_name is None else self._get_provider(provider_name).name)
+            return "null"
+
+        provider = self._get_provider(request["provider"])
+        if method == "get_projects":
+            return self._get_catalog(provider.name, request.get("include_archived", False))
+
+        if method == "get_project":
+            return json.dumps(project_to_obj(self._get_project(provider, request["project_name"])))
+
+        if method == "rate_limit_budget":
+            return json.dumps(list(provider.rate_limit_budget))
+
+        if method == "create_project":
+            try:
+                project = provider.create_project(request["project_name"], is_private=request.get("is_private", True))
+            finally:
+                self.invalidate(provider.name)
+            return json.dumps(project_to_obj(project))
+
+        if method in ["delete_project", "archive_project"]:
+            project = self._get_project(provider, request["project_name"])
+            try:
+                getattr(provider, method)(project, confirmation_token=True)
+            finally:
+                self.invalidate(provider.name)
+            return "null"
+
+        raise RuntimeError("Unsupported request \"{}\"".format(method))
+
+    def invalidate(self, provider_name=None):
+        """
+        Discards the listings and projects of the named provider, or of
+        every provider, and reloads the listings in the background
+        """
+        names = list(self._providers) if provider_name is None else [provider_name]
+        with self._lock:
+            for name in names:
+                self._generations[name] += 1
+            self._catalogs = { k: v for k, v in self._catalogs.items() if provider_name is not None and k[0] != provider_name }
+            self._projects = { k: v for k, v in self._projects.items() if provider_name is not None and k[0] != provider_name }
+        self._clear_namespaces(names)
+        self._wake.set()
+
+    def _clear_namespaces(self, provider_names):
+        # Sources are kept by identity for as long as the daemon runs, so
+        # they are built again from the listings that replace them
+        for namespace in set(self._providers[name].api_url for name in provider_names):
+            clear_namespace(namespace)
+
+    def _get_status(self):
+        with self._lock:
+            catalogs = [
+                { "provider": name, "include_archived": include_archived, "age": time.time() - loaded, "count": count }
+                for (name, include_archived), (_, count, loaded) in sorted(self._catalogs.items())
+            ]
+
+        return {
+            "pid": os.getpid(),
+            "config_stamp": self._config_stamp,
+            "providers": [
+                { "name": p.name, "provider_name": p.provider_name, "api_url": p.api_url, "operations": get_operations(p) }
+                for _, p in sorted(self._providers.items())
+            ],
+            "catalogs": catalogs
+        }
+
+    def _get_provider(self, provider_name):
+        provider = self._providers.get(provider_name)
+        if provider is None:
+            raise RuntimeError("Unknown provider \"{}\"".format(provider_name))
+        return provider
+
+    def _get_project(self, provider, project_name):
+        key = (provider.name, project_name.lower())
+        with self._lock:
+            project = self._projects.get(key)
+            generation = self._generations[provider.name]
+        if project is not None:
+            return project
+
+        project = provider.get_project(project_name)
+        with self._lock:
+            if self._generations[provider.name] == generation:
+                self._projects[key] = project
+        return project
+
+    def _get_catalog(self, provider_name, include_archived):
+        key = (provider_name, include_archived)
+        with self._lock:
+            self._catalog_keys.add(key)
+            catalog = self._catalogs.get(key)
+        if catalog is not None:
+            content, _, _ = catalog
+            return content
+
+        content, _, _ = self._load_catalog(key)
+        return content
+
+    def _load_catalog(self, key):
+        with self._lock:
+            generation = self._generations[key[0]]
+
+        # Requests made after an invalidation must not share a load that
+        # started before it
+        return self._loads.call(key + (generation,), lambda: self._do_load_catalog(key, generation))
+
+    def _do_load_catalog(self, key, generation):
+        provider_name, include_archived = key
+        projects = self._providers[provider_name].get_projects(include_archived=include_archived)
+        for project, error in resolve_sources(projects, cache=self._fork_cache):
+            print("Failed to look up source of {} ({}): {}".format(project.name, provider_name, error), file=sys.stderr)
+        if self._fork_cache is not None:
+            self._fork_cache.save()
+
+        catalog = json.dumps([project_to_obj(p) for p in projects]), len(projects), time.time()
+
+        # Keep listings that a mutation may have made stale for the
+        # requests already waiting on them, but not for later ones
+        with self._lock:
+            if self._generations[provider_name] == generation:
+                self._catalogs[key] = catalog
+        return catalog
+
+    def _refresh_catalogs(self):
+        # Reloads every listing that has been asked for each interval and,
+        # when woken by an invalidation, only the listings it discarded
+        is_full = True
+        while not self._stopped.is_set():
+            self._wake.clear()
+            with self._lock:
+                keys = [k for k in sorted(self._catalog_keys) if is_full or k not in self._catalogs]
+            if is_full:
+                self._clear_namespaces(self._providers.keys())
+
+            for key in keys:
+                if self._stopped.is_set():
+                    return
+                try:
+                    self._load_catalog(key)
+                except Exception as e:
+                    print("Failed to refresh projects from {}: {}".format(key[0], e), file=sys.stderr)
+
+            if is_full:
+                with self._lock:
+                    self._projects = {}
+
+            is_full = not self._wake.wait(self._refresh_interval)
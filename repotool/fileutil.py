@@ -0,0 +1,39 @@
+##################################################
+# Copyright (C) 2017, All rights reserved.
+##################################################
+
+import os
+import tempfile
+
+def write_file_atomically(path, write_func, mode="wt"):
+    """
+    Creates the directory containing path if necessary and calls
+    write_func with a temporary file in it that then replaces path, so
+    that readers never see a partly written file
+
+    >>> import shutil
+    >>> temp_dir = tempfile.mkdtemp()
+    >>> path = os.path.join(temp_dir, "sub", "file.txt")
+    >>> write_file_atomically(path, lambda f: f.write("content"))
+    >>> open(path).read(), os.listdir(os.path.dirname(path))
+    ('content', ['file.txt'])
+    >>> shutil.rmtree(temp_dir)
+    """
+    parent_dir = os.path.dirname(path)
+    if not os.path.isdir(parent_dir):
+        try:
+            os.makedirs(parent_dir)
+        except OSError:
+            # Created by a concurrent writer
+            if not os.path.isdir(parent_dir):
+                raise
+
+    fd, temp_path = tempfile.mkstemp(dir=parent_dir)
+    try:
+        with os.fdopen(fd, mode) as f:
+            write_func(f)
+        os.rename(temp_path, path)
+    except Exception:
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+        raise
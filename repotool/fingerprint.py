@@ -0,0 +1,145 @@
+##################################################
+# Copyright (C) 2017, All rights reserved.
+##################################################
+
+import json
+import os
+import threading
+
+from pyprelude.process import execute
+
+from repotool.concurrency import DEFAULT_MAX_WORKERS, try_map
+from repotool.fileutil import write_file_atomically
+
+# Fail instead of prompting for credentials when a remote needs them
+GIT_ENV = dict(os.environ, GIT_TERMINAL_PROMPT="0")
+
+def get_fingerprint(url):
+    """
+    Returns the commit that HEAD resolves to in the repository at url,
+    which may also be a local path, or None if the repository is empty
+
+    >>> import shutil, tempfile
+    >>> from repotool.tests.local_git import commit_to_bare_repo, make_bare_repo
+    >>> temp_dir = tempfile.mkdtemp()
+    >>> commit = commit_to_bare_repo(os.path.join(temp_dir, "repo.git"), "content")
+    >>> get_fingerprint(os.path.join(temp_dir, "repo.git")) == commit
+    True
+    >>> make_bare_repo(os.path.join(temp_dir, "empty.git"))
+    >>> get_fingerprint(os.path.join(temp_dir, "empty.git")) is None
+    True
+    >>> shutil.rmtree(temp_dir)
+    """
+    status, output, error = execute("git", "ls-remote", url, "HEAD", can_fail=True, env=GIT_ENV)
+    if status != 0:
+        raise RuntimeError("git ls-remote failed for {}: {}".format(url, error.strip()))
+
+    for line in output.splitlines():
+        commit, ref = line.split("\t", 1)
+        if ref == "HEAD":
+            return commit
+
+    return None
+
+def get_remote_refs(url):
+    """
+    Returns a dict mapping each ref in the repository at url to the object
+    it points to, leaving out HEAD and peeled tags
+    """
+    status, output, error = execute("git", "ls-remote", url, can_fail=True, env=GIT_ENV)
+    if status != 0:
+        raise RuntimeError("git ls-remote failed for {}: {}".format(url, error.strip()))
+
+    refs = {}
+    for line in output.splitlines():
+        commit, ref = line.split("\t", 1)
+        if ref != "HEAD" and not ref.endswith("^{}"):
+            refs[ref] = commit
+
+    return refs
+
+class FingerprintCache(object):
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        if os.path.isfile(path):
+            # Fingerprints are resolved again when the cache cannot be read
+            try:
+                with open(path, "rt") as f:
+                    self._entries = json.load(f)
+            except (IOError, ValueError):
+                pass
+
+    def get(self, url, version):
+        with self._lock:
+            entry = self._entries.get(url)
+        if entry is None or entry["version"] != version:
+            return None
+
+        return entry["fingerprint"]
+
+    def set(self, url, version, fingerprint):
+        with self._lock:
+            self._entries[url] = { "version": version, "fingerprint": fingerprint }
+
+    def save(self):
+        with self._lock:
+            write_file_atomically(self._path, lambda f: json.dump(self._entries, f))
+
+def get_fingerprints(projects, clone_link_key="ssh", cache=None, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Resolves the fingerprint of each project concurrently and returns a
+    (fingerprint, error) pair per project
+
+    A cached fingerprint is reused while the project's last_updated value
+    is unchanged; projects that do not report one are always resolved
+    """
+    def _get_fingerprint(project):
+        url = project.clone_link(clone_link_key)
+        version = project.last_updated
+        if cache is not None and version is not None:
+            fingerprint = cache.get(url, version)
+            if fingerprint is not None:
+                return fingerprint
+
+        fingerprint = get_fingerprint(url)
+        if cache is not None and version is not None and fingerprint is not None:
+            cache.set(url, version, fingerprint)
+        return fingerprint
+
+    return try_map(_get_fingerprint, projects, max_workers=max_workers)
+
+def group_by_fingerprint(projects, results):
+    """
+    Returns a (fingerprint, projects) pair, sorted by fingerprint, for each
+    fingerprint shared by more than one of projects, given the (fingerprint,
+    error) pair of each project returned by get_fingerprints, together with
+    the (project, error) pair of each project that failed
+
+    >>> import shutil, tempfile
+    >>> from pyprelude.process import execute
+    >>> from repotool.project import Project
+    >>> from repotool.tests.local_git import commit_to_bare_repo
+    >>> temp_dir = tempfile.mkdtemp()
+    >>> paths = [os.path.join(temp_dir, n) for n in ["repo.git", "copy.git", "other.git", "missing.git"]]
+    >>> commit = commit_to_bare_repo(paths[0], "content")
+    >>> _ = execute("git", "clone", "--bare", "--quiet", paths[0], paths[1])
+    >>> _ = commit_to_bare_repo(paths[2], "other content")
+    >>> projects = [Project(None, None, None, i, os.path.basename(p), None, None, "git", False, False, { "ssh": p }) for i, p in enumerate(paths)]
+    >>> groups, failures = group_by_fingerprint(projects, get_fingerprints(projects, max_workers=2))
+    >>> [(f == commit, [p.name for p in g]) for f, g in groups]
+    [(True, ['repo.git', 'copy.git'])]
+    >>> [p.name for p, _ in failures]
+    ['missing.git']
+    >>> shutil.rmtree(temp_dir)
+    """
+    groups = {}
+    failures = []
+    for project, (fingerprint, error) in zip(projects, results):
+        if error is not None:
+            failures.append((project, error))
+        elif fingerprint is not None:
+            groups.setdefault(fingerprint, []).append(project)
+
+    return [(f, groups[f]) for f in sorted(groups.keys()) if len(groups[f]) > 1], failures
@@ -0,0 +1,78 @@
+##################################################
+# Copyright (C) 2017, All rights reserved.
+##################################################
+
+import json
+import os
+import threading
+
+from repotool.concurrency import DEFAULT_MAX_WORKERS, Coalescer, try_map
+from repotool.fileutil import write_file_atomically
+
+def _make_key(provider, project):
+    # Providers on the same host share entries, as they share identities
+    return "{} {}".format(provider.api_url, project.id)
+
+class ForkCache(object):
+    """
+    Keeps the provider's own object for the source of each fork that has
+    been looked up, since forks do not change what they were forked from
+    """
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        if os.path.isfile(path):
+            # Sources are looked up again when the cache cannot be read,
+            # such as when a previous run was interrupted while saving it
+            try:
+                with open(path, "rt") as f:
+                    self._entries = json.load(f)
+            except (IOError, ValueError):
+                pass
+
+    def get(self, provider, project):
+        with self._lock:
+            return self._entries.get(_make_key(provider, project))
+
+    def set(self, provider, project, source_obj):
+        with self._lock:
+            self._entries[_make_key(provider, project)] = source_obj
+
+    def save(self):
+        with self._lock:
+            write_file_atomically(self._path, lambda f: json.dump(self._entries, f))
+
+def resolve_sources(projects, cache=None, refresh=False, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Sets the source of each fork in projects whose listing did not include
+    it, looking up the forks missing from cache concurrently, and returns
+    a (project, error) pair for each fork that could not be looked up
+
+    Forks of providers that cannot look up sources are left unchanged;
+    refresh looks up every fork again
+    """
+    forks = [
+        p for p in projects
+        if p.is_fork and p.source is None and hasattr(p.provider, "get_source_obj")
+    ]
+
+    lookups = Coalescer()
+
+    def _get_source_obj(provider, project):
+        source_obj = None if cache is None or refresh else cache.get(provider, project)
+        if source_obj is None:
+            source_obj = provider.get_source_obj(project)
+            if cache is not None and source_obj is not None:
+                cache.set(provider, project, source_obj)
+        return source_obj
+
+    def _resolve_source(project):
+        provider = project.provider
+        # Providers configured for the same account list the same forks
+        source_obj = lookups.call(_make_key(provider, project), lambda: _get_source_obj(provider, project))
+        if source_obj is not None:
+            project.set_source(provider._get_source(source_obj))
+
+    results = try_map(_resolve_source, forks, max_workers=max_workers)
+    return [(project, error) for project, (_, error) in zip(forks, results) if error is not None]
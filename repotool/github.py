@@ -2,15 +2,111 @@
 # Copyright (C) 2017, All rights reserved.
 ##################################################
 
-import requests
+import re
 import urllib
 
+from pyprelude.file_system import make_path
 from pyprelude.url import make_url
 
-from repotool.owner import Owner
-from repotool.project import Project
+from repotool.concurrency import DEFAULT_PAGE_WORKERS, Coalescer, imap_ordered
+from repotool.identity import intern_owner, intern_project
+from repotool.instrument import traced_request
+from repotool.jsonutil import decode_json
+from repotool.project import Project, make_projects
+from repotool.ratelimit import RateLimiter
+from repotool.session import SessionSettings
+from repotool.snapshot import DEFAULT_RECONCILE_INTERVAL, sync_project_objs
 
 _GITHUB_API_URL = "https://api.github.com"
+_GITHUB_GRAPHQL_URL = "https://api.github.com/graphql"
+_RATE_LIMIT_HEADER_PREFIX = "X-RateLimit-"
+_CLONE_LINK_TEMPLATES = {
+    "https": "https://github.com/{path}",
+    "ssh": "git@github.com:{path}.git"
+}
+_PAGE_PARAM_REGEX = re.compile("([?&]page=)(\\d+)")
+_GRAPHQL_PAGE_SIZE = 100
+
+# Requests only the fields read by _make_project, together with each
+# owner and the parent of each fork, so that a page of 100 projects
+# takes a single round trip. repositoryOwner resolves organizations as
+# well as users, like the users/{user}/repos REST endpoint
+_GRAPHQL_PROJECTS_QUERY = """
+query($login: String!, $pageSize: Int!, $cursor: String, $orderField: RepositoryOrderField!, $orderDirection: OrderDirection!) {
+  repositoryOwner(login: $login) {
+    repositories(first: $pageSize, after: $cursor, ownerAffiliations: OWNER, orderBy: { field: $orderField, direction: $orderDirection }) {
+      pageInfo { hasNextPage endCursor }
+      nodes { ...ProjectFields parent { ...ProjectFields } }
+    }
+  }
+}
+fragment ProjectFields on Repository {
+  databaseId name nameWithOwner description isPrivate isArchived isFork url sshUrl pushedAt updatedAt
+  owner { __typename login ... on User { databaseId } ... on Organization { databaseId } }
+}
+"""
+
+def _get_page_count(r):
+    last_link = r.links.get("last")
+    if last_link is None:
+        return None
+
+    m = _PAGE_PARAM_REGEX.search(last_link["url"])
+    return None if m is None else int(m.group(2))
+
+def _make_page_url(last_url, page):
+    return _PAGE_PARAM_REGEX.sub(lambda m: "{}{}".format(m.group(1), page), last_url)
+
+def _convert_graphql_project_obj(node):
+    """
+    Converts a repository node returned by the GraphQL API into the shape
+    returned by the REST API
+
+    The REST API gives the root of a fork's network as its source, while
+    GraphQL only gives its parent, which is the source unless it is a fork
+    itself
+
+    >>> def make_node(id, full_name, is_fork, parent=None):
+    ...     return {
+    ...         "databaseId": id, "name": full_name.split("/")[1], "nameWithOwner": full_name,
+    ...         "description": None, "isPrivate": False, "isArchived": False, "isFork": is_fork,
+    ...         "url": "https://github.com/" + full_name, "sshUrl": "git@github.com:{}.git".format(full_name),
+    ...         "pushedAt": None, "updatedAt": None,
+    ...         "owner": { "__typename": "User", "login": full_name.split("/")[0], "databaseId": 2 },
+    ...         "parent": parent }
+    >>> o = _convert_graphql_project_obj(make_node(1, "user/repo", False))
+    >>> o["full_name"], o["owner"]["id"], o["owner"]["type"], o["source"]
+    ('user/repo', 2, 'User', None)
+    >>> o = _convert_graphql_project_obj(make_node(1, "user/repo", True, make_node(3, "org/repo", False)))
+    >>> o["parent"]["full_name"], o["source"]["full_name"]
+    ('org/repo', 'org/repo')
+    >>> o = _convert_graphql_project_obj(make_node(1, "user/repo", True, make_node(3, "other/repo", True)))
+    >>> o["parent"]["full_name"], o["source"]
+    ('other/repo', None)
+    """
+    owner_node = node["owner"]
+    parent_node = node.get("parent")
+    parent_obj = None if parent_node is None else _convert_graphql_project_obj(parent_node)
+    return {
+        "id": node["databaseId"],
+        "name": node["name"],
+        "full_name": node["nameWithOwner"],
+        "description": node["description"],
+        "private": node["isPrivate"],
+        "archived": node["isArchived"],
+        "fork": node["isFork"],
+        "html_url": node["url"],
+        "ssh_url": node["sshUrl"],
+        "pushed_at": node["pushedAt"],
+        "updated_at": node["updatedAt"],
+        "owner": {
+            "id": owner_node["databaseId"],
+            "type": owner_node["__typename"],
+            "login": owner_node["login"]
+        },
+        "parent": parent_obj,
+        "source": None if parent_obj is None or parent_obj["fork"] else parent_obj
+    }
 
 def _make_project(provider, project_obj):
     clone_links = {
@@ -19,7 +115,7 @@ def _make_project(provider, project_obj):
     }
 
     source_obj = project_obj.get("source")
-    source = None if source_obj is None else _make_project(provider, source_obj)
+    source = None if source_obj is None else provider._get_source(source_obj)
 
     return Project(
         provider,
@@ -32,7 +128,11 @@ def _make_project(provider, project_obj):
         "git",
         project_obj["private"],
         project_obj["archived"],
-        clone_links)
+        clone_links,
+        clone_link_templates=_CLONE_LINK_TEMPLATES,
+        clone_path=project_obj["full_name"],
+        last_updated=project_obj.get("pushed_at"),
+        is_fork=project_obj.get("fork"))
 
 class GitHub(object):
     @staticmethod
@@ -49,36 +149,87 @@ class GitHub(object):
         name = obj["name"]
         user = obj.get("user", default_user)
         api_token = obj["api-token"]
-        return GitHub(name, config_dir, user, api_token)
+        page_workers = obj.get("page-workers", DEFAULT_PAGE_WORKERS)
+        session_settings = SessionSettings.parse_config(obj)
+        reconcile_interval = obj.get("reconcile-interval", DEFAULT_RECONCILE_INTERVAL)
+        rate_limiter = RateLimiter.parse_config(_RATE_LIMIT_HEADER_PREFIX, obj)
+        use_graphql = obj.get("graphql", False)
+        api_url = obj.get("api-url", _GITHUB_API_URL)
+        graphql_url = obj.get("graphql-url", _GITHUB_GRAPHQL_URL)
+        return GitHub(
+            name,
+            config_dir,
+            user,
+            api_token,
+            page_workers=page_workers,
+            session_settings=session_settings,
+            reconcile_interval=reconcile_interval,
+            rate_limiter=rate_limiter,
+            use_graphql=use_graphql,
+            api_url=api_url,
+            graphql_url=graphql_url)
+
+    def __init__(self, name, config_dir, user, api_token, page_workers=DEFAULT_PAGE_WORKERS, session_settings=None, reconcile_interval=DEFAULT_RECONCILE_INTERVAL, rate_limiter=None, use_graphql=False, api_url=_GITHUB_API_URL, graphql_url=_GITHUB_GRAPHQL_URL):
+        if session_settings is None:
+            session_settings = SessionSettings()
+
+        if rate_limiter is None:
+            rate_limiter = RateLimiter(_RATE_LIMIT_HEADER_PREFIX)
 
-    def __init__(self, name, config_dir, user, api_token):
         self._name = name
+        self._snapshot_dir = make_path(config_dir, "snapshots")
         self._user = user
         self._api_token = api_token
-        self._owners = {}
+        self._page_workers = page_workers
+        self._reconcile_interval = reconcile_interval
+        self._rate_limiter = rate_limiter
+        self._use_graphql = use_graphql
+        self._api_url = api_url
+        self._graphql_url = graphql_url
+        self._timeout = session_settings.timeout
+        self._session = session_settings.make_session()
+        self._session.auth = (user, api_token)
+        self._page_cache = None
+        self._project_lookups = Coalescer()
 
     @property
     def name(self): return self._name
 
+    @property
+    def api_url(self): return self._api_url
+
     @property
     def provider_name(self): return "GitHub"
 
+    @property
+    def rate_limit_budget(self): return self._rate_limiter.budget
+
+    def set_page_cache(self, page_cache):
+        self._page_cache = page_cache
+
     def get_project(self, project_name):
-        r = self._do_request("get", "repos", self._user, project_name)
-        return _make_project(self, r.json())
+        def _get_project():
+            r = self._do_request("get", "repos", self._user, project_name)
+            return _make_project(self, decode_json(r.content))
 
-    def get_projects(self, include_archived=False):
-        projects = []
+        # Concurrent lookups of the same project share a single request
+        return self._project_lookups.call(project_name.lower(), _get_project)
 
-        url = make_url(_GITHUB_API_URL, "users", self._user, "repos")
-        while True:
-            r = self._do_request_raw("get", url)
-            projects.extend(map(lambda o: _make_project(self, o), r.json()))
-            next_link = r.links.get("next")
-            if next_link is None: break
-            url = next_link["url"]
+    def get_projects(self, include_archived=False, incremental=False, name_matcher=None, lazy=False):
+        return list(self.iter_projects(include_archived=include_archived, incremental=incremental, name_matcher=name_matcher, lazy=lazy))
 
-        return projects
+    def iter_projects(self, include_archived=False, incremental=False, name_matcher=None, lazy=False):
+        return make_projects(self, self._iter_project_objs(incremental), _make_project, name_matcher=name_matcher, lazy=lazy)
+
+    def create_project(self, project_name, is_private=True):
+        url = make_url(self._api_url, "user", "repos")
+        r = traced_request(self._name, "post", url, lambda: self._rate_limiter.request(lambda: self._session.post(
+            url,
+            json={ "name": project_name, "private": is_private },
+            timeout=self._timeout)))
+        r.raise_for_status()
+        self._invalidate_page_cache()
+        return _make_project(self, r.json())
 
     def delete_project(self, project, confirmation_token=False):
         if not confirmation_token:
@@ -88,25 +239,174 @@ class GitHub(object):
             raise RuntimeError("Project does not belong to this provider")
 
         self._do_request("delete", "repos", self._user, project.name)
+        self._invalidate_page_cache()
+
+    def archive_project(self, project, confirmation_token=False):
+        if not confirmation_token:
+            raise RuntimeError("Dangerous operation disallowed")
+
+        if self != project.provider:
+            raise RuntimeError("Project does not belong to this provider")
+
+        url = make_url(self._api_url, "repos", self._user, project.name)
+        r = traced_request(self._name, "patch", url, lambda: self._rate_limiter.request(lambda: self._session.patch(
+            url,
+            json={ "archived": True },
+            timeout=self._timeout)))
+        r.raise_for_status()
+        self._invalidate_page_cache()
+
+    def get_source_obj(self, project):
+        # Listings only say whether a project is a fork, while the project
+        # itself names the root of its fork network
+        r = self._do_request("get", "repos", *project.full_name.split("/"))
+        return decode_json(r.content).get("source")
+
+    def _iter_project_objs(self, incremental):
+        if incremental:
+            project_objs = sync_project_objs(
+                make_path(self._snapshot_dir, "{}.json".format(self._name)),
+                "id",
+                self._get_project_objs,
+                self._get_changed_project_objs,
+                reconcile_interval=self._reconcile_interval,
+                offline=self._page_cache is not None and self._page_cache.is_offline)
+            for project_obj in project_objs:
+                yield project_obj
+            return
+
+        if self._use_graphql:
+            for project_obj in self._iter_graphql_project_objs():
+                yield project_obj
+            return
+
+        for page_obj in self._iter_project_pages():
+            for project_obj in page_obj:
+                yield project_obj
+
+    def _get_project_objs(self):
+        if self._use_graphql:
+            return list(self._iter_graphql_project_objs())
+
+        return [o for page_obj in self._iter_project_pages() for o in page_obj]
+
+    def _iter_project_pages(self):
+        url = make_url(self._api_url, "users", self._user, "repos")
+        r = self._do_request_raw("get", url)
+        yield decode_json(r.content)
+
+        page_count = _get_page_count(r)
+        if page_count is not None and self._page_workers > 1:
+            last_url = r.links["last"]["url"]
+            page_urls = [_make_page_url(last_url, page) for page in range(2, page_count + 1)]
+            for r in imap_ordered(lambda u: self._do_request_raw("get", u), page_urls, max_workers=self._page_workers):
+                yield decode_json(r.content)
+            return
+
+        while True:
+            next_link = r.links.get("next")
+            if next_link is None: break
+            r = self._do_request_raw("get", next_link["url"])
+            yield decode_json(r.content)
+
+    def _get_changed_project_objs(self, since):
+        if self._use_graphql:
+            project_objs = []
+            for o in self._iter_graphql_project_objs(order_field="UPDATED_AT", order_direction="DESC"):
+                if o["updated_at"] < since:
+                    break
+                project_objs.append(o)
+            return project_objs
+
+        project_objs = []
+
+        url = make_url(self._api_url, "users", self._user, "repos", sort="updated", direction="desc")
+        while url is not None:
+            r = self._do_request_raw("get", url)
+            for o in decode_json(r.content):
+                if o["updated_at"] < since:
+                    return project_objs
+                project_objs.append(o)
+
+            next_link = r.links.get("next")
+            url = None if next_link is None else next_link["url"]
+
+        return project_objs
+
+    def _iter_graphql_project_objs(self, order_field="NAME", order_direction="ASC"):
+        cursor = None
+        while True:
+            page_obj = self._do_graphql_request(_GRAPHQL_PROJECTS_QUERY, {
+                "login": self._user,
+                "pageSize": _GRAPHQL_PAGE_SIZE,
+                "cursor": cursor,
+                "orderField": order_field,
+                "orderDirection": order_direction
+            })
+            owner_obj = page_obj["repositoryOwner"]
+            if owner_obj is None:
+                raise RuntimeError("GitHub user or organization \"{}\" not found".format(self._user))
+
+            repositories_obj = owner_obj["repositories"]
+            for node in repositories_obj["nodes"]:
+                yield _convert_graphql_project_obj(node)
+
+            page_info = repositories_obj["pageInfo"]
+            if not page_info["hasNextPage"]:
+                break
+            cursor = page_info["endCursor"]
+
+    def _do_graphql_request(self, query, variables):
+        def _fetch(headers):
+            r = self._rate_limiter.request(lambda: self._session.post(
+                self._graphql_url,
+                json={ "query": query, "variables": variables },
+                timeout=self._timeout))
+            r.raise_for_status()
+            return r
+
+        # GraphQL queries are POSTs to a single URL, so pages are cached
+        # under a URL made from the query variables instead
+        def _get_response():
+            if self._page_cache is not None:
+                return self._page_cache.get(make_url(self._graphql_url, sorted(variables.items())), _fetch)
+
+            return _fetch(None)
+
+        # Queries read pages even though they are sent as POSTs
+        r = traced_request(self._name, "post", self._graphql_url, _get_response, is_page_read=True)
+
+        obj = decode_json(r.content)
+        errors = obj.get("errors")
+        if errors:
+            raise RuntimeError("GraphQL query failed: {}".format("; ".join(e["message"] for e in errors)))
+
+        return obj["data"]
 
     def _do_request(self, method, *args, **kwargs):
-        url = make_url(*[_GITHUB_API_URL] + list(args), **kwargs)
+        url = make_url(*[self._api_url] + list(args), **kwargs)
         return self._do_request_raw(method, url)
 
     def _do_request_raw(self, method, url):
-        r = requests.request(method, url, auth=(self._user, self._api_token))
+        return traced_request(self._name, method, url, lambda: self._get_response(method, url))
+
+    def _get_response(self, method, url):
+        if method == "get" and self._page_cache is not None:
+            return self._page_cache.get(url, lambda headers: self._send_request(method, url, headers))
+
+        return self._send_request(method, url)
+
+    def _send_request(self, method, url, headers=None):
+        r = self._rate_limiter.request(lambda: self._session.request(method, url, headers=headers, timeout=self._timeout))
         r.raise_for_status()
         return r
 
+    def _invalidate_page_cache(self):
+        if self._page_cache is not None:
+            self._page_cache.clear()
+
     def _get_owner(self, owner_obj):
-        id = owner_obj["id"]
-        owner = self._owners.get(id)
-        if owner is not None:
-            return owner
-
-        owner = Owner(
-            owner_obj["type"].lower(),
-            id,
-            owner_obj["login"])
-        self._owners[id] = owner
-        return owner
+        return intern_owner(self._api_url, owner_obj["type"].lower(), owner_obj["id"], owner_obj["login"])
+
+    def _get_source(self, source_obj):
+        return intern_project(self._api_url, source_obj["id"], lambda: _make_project(self, source_obj))
@@ -2,15 +2,26 @@
 # Copyright (C) 2017, All rights reserved.
 ##################################################
 
-import requests
 import urllib
 
+from pyprelude.file_system import make_path
 from pyprelude.url import make_url
 
-from repotool.owner import Owner
-from repotool.project import Project
+from repotool.concurrency import DEFAULT_PAGE_WORKERS, Coalescer, imap_ordered
+from repotool.identity import intern_owner, intern_project
+from repotool.instrument import traced_request
+from repotool.jsonutil import decode_json
+from repotool.project import Project, make_projects
+from repotool.ratelimit import RateLimiter
+from repotool.session import SessionSettings
+from repotool.snapshot import DEFAULT_RECONCILE_INTERVAL, sync_project_objs
 
 _GITLAB_API_URL = "https://gitlab.com/api/v4"
+_RATE_LIMIT_HEADER_PREFIX = "RateLimit-"
+_CLONE_LINK_TEMPLATES = {
+    "https": "https://gitlab.com/{path}.git",
+    "ssh": "git@gitlab.com:{path}.git"
+}
 
 def _make_project(provider, project_obj):
     clone_links = {
@@ -22,7 +33,7 @@ def _make_project(provider, project_obj):
     owner = None if owner_obj is None else provider._get_owner(owner_obj)
 
     source_obj = project_obj.get("forked_from_project")
-    source = None if source_obj is None else _make_project(provider, source_obj)
+    source = None if source_obj is None else provider._get_source(source_obj)
 
     visibility_str = project_obj.get("visibility")
     is_private = False if visibility_str is None else visibility_str == "private"
@@ -38,7 +49,10 @@ def _make_project(provider, project_obj):
         "git",
         is_private,
         project_obj.get("archived", False),
-        clone_links)
+        clone_links,
+        clone_link_templates=_CLONE_LINK_TEMPLATES,
+        clone_path=project_obj.get("path_with_namespace"),
+        last_updated=project_obj.get("last_activity_at"))
 
 class GitLab(object):
     @staticmethod
@@ -55,48 +69,81 @@ class GitLab(object):
         name = obj["name"]
         user = obj.get("user", default_user)
         api_token = obj["api-token"]
-        return GitLab(name, config_dir, user, api_token)
+        page_workers = obj.get("page-workers", DEFAULT_PAGE_WORKERS)
+        session_settings = SessionSettings.parse_config(obj)
+        reconcile_interval = obj.get("reconcile-interval", DEFAULT_RECONCILE_INTERVAL)
+        rate_limiter = RateLimiter.parse_config(_RATE_LIMIT_HEADER_PREFIX, obj)
+        api_url = obj.get("api-url", _GITLAB_API_URL)
+        return GitLab(
+            name,
+            config_dir,
+            user,
+            api_token,
+            page_workers=page_workers,
+            session_settings=session_settings,
+            reconcile_interval=reconcile_interval,
+            rate_limiter=rate_limiter,
+            api_url=api_url)
+
+    def __init__(self, name, config_dir, user, api_token, page_workers=DEFAULT_PAGE_WORKERS, session_settings=None, reconcile_interval=DEFAULT_RECONCILE_INTERVAL, rate_limiter=None, api_url=_GITLAB_API_URL):
+        if session_settings is None:
+            session_settings = SessionSettings()
+
+        if rate_limiter is None:
+            rate_limiter = RateLimiter(_RATE_LIMIT_HEADER_PREFIX)
 
-    def __init__(self, name, config_dir, user, api_token):
         self._name = name
+        self._snapshot_dir = make_path(config_dir, "snapshots")
         self._user = user
         self._api_token = api_token
-        self._owners = {}
+        self._page_workers = page_workers
+        self._reconcile_interval = reconcile_interval
+        self._rate_limiter = rate_limiter
+        self._api_url = api_url
+        self._timeout = session_settings.timeout
+        self._session = session_settings.make_session()
+        self._page_cache = None
+        self._project_lookups = Coalescer()
 
     @property
     def name(self): return self._name
 
+    @property
+    def api_url(self): return self._api_url
+
     @property
     def provider_name(self): return "GitLab"
 
-    def get_project(self, project_name):
-        r = self._do_request("get", "projects", self._encode_project_name(project_name), private_token=self._api_token)
-        return _make_project(self, r.json())
+    @property
+    def rate_limit_budget(self): return self._rate_limiter.budget
 
-    def get_projects(self, include_archived=False):
-        query = {
-            "private_token": self._api_token,
-            "per_page": 300
-        }
+    def set_page_cache(self, page_cache):
+        self._page_cache = page_cache
 
-        if include_archived:
-            query["archived"] = True
+    def get_project(self, project_name):
+        def _get_project():
+            r = self._do_request("get", "projects", self._encode_project_name(project_name), private_token=self._api_token)
+            return _make_project(self, decode_json(r.content))
 
-        projects = []
-        while True:
-            r = self._do_request("get", "users", self._user, "projects", query)
-            projects.extend(map(lambda o: _make_project(self, o), r.json()))
-            page_id = r.headers.get("X-Next-Page")
-            if page_id is None or len(page_id) == 0: break
-            query["page"] = page_id
+        # Concurrent lookups of the same project share a single request
+        return self._project_lookups.call(project_name.lower(), _get_project)
 
-        return projects
+    def get_projects(self, include_archived=False, incremental=False, name_matcher=None, lazy=False):
+        return list(self.iter_projects(include_archived=include_archived, incremental=incremental, name_matcher=name_matcher, lazy=lazy))
+
+    def iter_projects(self, include_archived=False, incremental=False, name_matcher=None, lazy=False):
+        return make_projects(self, self._iter_project_objs(include_archived, incremental), _make_project, name_matcher=name_matcher, lazy=lazy)
 
     def create_project(self, project_name, is_private=True):
         visibility = "private" if is_private else "public"
-        url = make_url(_GITLAB_API_URL, "projects", private_token=self._api_token)
-        r = requests.post(url, data={ "name": project_name, "visibility": visibility })
+        url = make_url(self._api_url, "projects", private_token=self._api_token)
+        r = traced_request(self._name, "post", url, lambda: self._rate_limiter.request(lambda: self._session.post(
+            url,
+            data={ "name": project_name, "visibility": visibility },
+            timeout=self._timeout)))
         r.raise_for_status()
+        self._invalidate_page_cache()
+        return _make_project(self, r.json())
 
     def delete_project(self, project, confirmation_token=False):
         if not confirmation_token:
@@ -105,9 +152,13 @@ class GitLab(object):
         if self != project.provider:
             raise RuntimeError("Project does not belong to this provider")
 
-        url = make_url(_GITLAB_API_URL, "projects", self._encode_project_name(project.name))
-        r = requests.delete(url, data={ "private_token": self._api_token })
+        url = make_url(self._api_url, "projects", self._encode_project_name(project.name))
+        r = traced_request(self._name, "delete", url, lambda: self._rate_limiter.request(lambda: self._session.delete(
+            url,
+            data={ "private_token": self._api_token },
+            timeout=self._timeout)))
         r.raise_for_status()
+        self._invalidate_page_cache()
 
     def archive_project(self, project, confirmation_token=False):
         if not confirmation_token:
@@ -116,31 +167,99 @@ class GitLab(object):
         if self != project.provider:
             raise RuntimeError("Project does not belong to this provider")
 
-        url = make_url(_GITLAB_API_URL, "projects", self._encode_project_name(project.name), "archive")
-        r = requests.post(url, data={ "private_token": self._api_token })
+        url = make_url(self._api_url, "projects", self._encode_project_name(project.name), "archive")
+        r = traced_request(self._name, "post", url, lambda: self._rate_limiter.request(lambda: self._session.post(
+            url,
+            data={ "private_token": self._api_token },
+            timeout=self._timeout)))
         r.raise_for_status()
+        self._invalidate_page_cache()
+
+    def _iter_project_objs(self, include_archived, incremental):
+        query = {
+            "private_token": self._api_token,
+            "per_page": 300
+        }
+
+        if include_archived:
+            query["archived"] = True
+
+        if incremental:
+            def _get_changed_project_objs(since):
+                changed_query = dict(query)
+                changed_query["last_activity_after"] = since
+                return self._get_project_objs(changed_query)
+
+            snapshot_file_name = "{}.archived.json".format(self._name) if include_archived else "{}.json".format(self._name)
+            project_objs = sync_project_objs(
+                make_path(self._snapshot_dir, snapshot_file_name),
+                "id",
+                lambda: self._get_project_objs(query),
+                _get_changed_project_objs,
+                reconcile_interval=self._reconcile_interval,
+                offline=self._page_cache is not None and self._page_cache.is_offline)
+            for project_obj in project_objs:
+                yield project_obj
+            return
+
+        for page_obj in self._iter_project_pages(query):
+            for project_obj in page_obj:
+                yield project_obj
+
+    def _get_project_objs(self, query):
+        return [o for page_obj in self._iter_project_pages(query) for o in page_obj]
+
+    def _iter_project_pages(self, query):
+        r = self._do_request("get", "users", self._user, "projects", query)
+        yield decode_json(r.content)
+
+        # GitLab omits X-Total-Pages for very large result sets
+        page_count_str = r.headers.get("X-Total-Pages")
+        if page_count_str and self._page_workers > 1:
+            def _get_page(page):
+                page_query = dict(query)
+                page_query["page"] = page
+                return self._do_request("get", "users", self._user, "projects", page_query)
+
+            for r in imap_ordered(_get_page, range(2, int(page_count_str) + 1), max_workers=self._page_workers):
+                yield decode_json(r.content)
+            return
+
+        page_query = dict(query)
+        while True:
+            page_id = r.headers.get("X-Next-Page")
+            if page_id is None or len(page_id) == 0: break
+            page_query["page"] = page_id
+            r = self._do_request("get", "users", self._user, "projects", page_query)
+            yield decode_json(r.content)
 
     def _encode_project_name(self, project_name):
         return urllib.quote_plus("{}/{}".format(self._user, project_name))
 
     def _do_request(self, method, *args, **kwargs):
-        url = make_url(*[_GITLAB_API_URL] + list(args), **kwargs)
+        url = make_url(*[self._api_url] + list(args), **kwargs)
         return self._do_request_raw(method, url)
 
     def _do_request_raw(self, method, url):
-        r = requests.request(method, url)
+        return traced_request(self._name, method, url, lambda: self._get_response(method, url))
+
+    def _get_response(self, method, url):
+        if method == "get" and self._page_cache is not None:
+            return self._page_cache.get(url, lambda headers: self._send_request(method, url, headers))
+
+        return self._send_request(method, url)
+
+    def _send_request(self, method, url, headers=None):
+        r = self._rate_limiter.request(lambda: self._session.request(method, url, headers=headers, timeout=self._timeout))
         r.raise_for_status()
         return r
 
+    def _invalidate_page_cache(self):
+        if self._page_cache is not None:
+            self._page_cache.clear()
+
     def _get_owner(self, owner_obj):
-        id = owner_obj["id"]
-        owner = self._owners.get(id)
-        if owner is not None:
-            return owner
-
-        owner = Owner(
-            "user",
-            id,
-            owner_obj["username"])
-        self._owners[id] = owner
-        return owner
+        return intern_owner(self._api_url, "user", owner_obj["id"], owner_obj["username"])
+
+    def _get_source(self, source_obj):
+        return intern_project(self._api_url, source_obj["id"], lambda: _make_project(self, source_obj))
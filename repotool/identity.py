@@ -0,0 +1,56 @@
+##################################################
+# Copyright (C) 2017, All rights reserved.
+##################################################
+
+from repotool.owner import Owner
+
+# Owners and projects are keyed by a namespace, the API URL of the
+# providers that return them, so that providers configured for different
+# accounts on the same host share one instance per owner and project
+_OWNERS = {}
+_PROJECTS = {}
+
+def intern_owner(namespace, type, id, user_name):
+    """
+    Returns the owner with id in namespace, building it on first use
+
+    >>> a = intern_owner("https://host", "user", 1, "user")
+    >>> a is intern_owner("https://host", "user", 1, "user")
+    True
+    >>> a is intern_owner("https://other", "user", 1, "user")
+    False
+    """
+    key = (namespace, id)
+    owner = _OWNERS.get(key)
+    if owner is not None:
+        return owner
+
+    # Keep the first owner built if lookups on other threads raced this one
+    return _OWNERS.setdefault(key, Owner(type, id, user_name))
+
+def intern_project(namespace, id, make_project):
+    """
+    Returns the project with id in namespace, calling make_project to
+    build it on first use
+    """
+    key = (namespace, id)
+    project = _PROJECTS.get(key)
+    if project is not None:
+        return project
+
+    # Keep the first project built if lookups on other threads raced this one
+    return _PROJECTS.setdefault(key, make_project())
+
+def clear_namespace(namespace):
+    """
+    Forgets the owners and projects in namespace, so that they are built
+    again from the next objects looked up
+
+    >>> a = intern_owner("https://cleared", "user", 1, "user")
+    >>> clear_namespace("https://cleared")
+    >>> a is intern_owner("https://cleared", "user", 1, "user")
+    False
+    """
+    for registry in [_OWNERS, _PROJECTS]:
+        for key in [k for k in registry.keys() if k[0] == namespace]:
+            registry.pop(key, None)
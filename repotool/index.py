@@ -0,0 +1,121 @@
+##################################################
+# Copyright (C) 2017, All rights reserved.
+##################################################
+
+import bisect
+import re
+
+_METACHARS = frozenset(".^$*+?{}[]\\|()")
+_QUANTIFIERS = frozenset("*?{")
+
+def literal_prefix(pattern):
+    """
+    Returns the literal text that every name matched by re.match(pattern)
+    must start with
+
+    >>> literal_prefix("repo-.*")
+    'repo-'
+    >>> literal_prefix("^repo")
+    'repo'
+    >>> literal_prefix("repos?")
+    'repo'
+    >>> literal_prefix("repo|other")
+    ''
+    >>> literal_prefix("(?i)repo")
+    ''
+    >>> literal_prefix("Repo(?i)")
+    ''
+    """
+    # Python 2.7 applies inline flags such as (?i) wherever they appear,
+    # and other groups may be optional, so give up on any of them
+    if "|" in pattern or "(?" in pattern:
+        return ""
+
+    if pattern.startswith("^"):
+        pattern = pattern[1 : ]
+
+    i = 0
+    while i < len(pattern) and pattern[i] not in _METACHARS:
+        i += 1
+
+    # A quantifier applies to the character immediately before it
+    if i < len(pattern) and pattern[i] in _QUANTIFIERS:
+        i -= 1
+
+    return pattern[ : max(i, 0)]
+
+def make_name_matcher(filter_expr):
+    """
+    >>> matcher = make_name_matcher("repo[0-9]")
+    >>> matcher("repo1"), matcher("repo-1"), matcher("other1")
+    (True, False, False)
+    >>> make_name_matcher("Repo(?i)")("repo1")
+    True
+    """
+    regex = re.compile(filter_expr)
+    prefix = literal_prefix(filter_expr)
+    return lambda name: name.startswith(prefix) and regex.match(name) is not None
+
+class ProjectIndex(object):
+    """
+    Indexes a catalog of projects by provider and name, by full name and by
+    id, and by sorted name so that filters with a literal prefix only visit
+    the names that start with it
+
+    Names are looked up ignoring case, as providers do. The full name and
+    id indexes are built on first use, since reading those attributes
+    builds each project from its view
+
+    >>> from collections import namedtuple
+    >>> P = namedtuple("P", ["provider", "name", "full_name", "id"])
+    >>> github = namedtuple("Provider", ["name"])("github")
+    >>> index = ProjectIndex([P(github, "repo2", "user/repo2", 2), P(github, "Repo1", "user/Repo1", 1), P(github, "other", "user/other", 3)])
+    >>> index.get("github", "repo1").id, index.get("gitlab", "repo1")
+    (1, None)
+    >>> [p.name for p in index.filter("repo")], [p.name for p in index.filter("(?i)repo")]
+    (['repo2'], ['Repo1', 'repo2'])
+    >>> index.get_by_id("github", 3).name, [p.id for p in index.find_by_full_name("user/repo2")]
+    ('other', [2])
+    """
+    def __init__(self, projects):
+        self._projects = sorted(projects, key=lambda p: p.name)
+        self._names = [p.name for p in self._projects]
+        self._by_name = {}
+        for project in self._projects:
+            self._by_name.setdefault((project.provider.name, project.name.lower()), project)
+        self._by_full_name = None
+        self._by_id = None
+
+    def __len__(self):
+        return len(self._projects)
+
+    def __iter__(self):
+        return iter(self._projects)
+
+    def get(self, provider_name, project_name):
+        return self._by_name.get((provider_name, project_name.lower()))
+
+    def get_by_id(self, provider_name, id):
+        if self._by_id is None:
+            self._by_id = { (p.provider.name, p.id): p for p in self._projects }
+        return self._by_id.get((provider_name, id))
+
+    def find_by_full_name(self, full_name):
+        if self._by_full_name is None:
+            self._by_full_name = {}
+            for project in self._projects:
+                self._by_full_name.setdefault(project.full_name, []).append(project)
+        return list(self._by_full_name.get(full_name, []))
+
+    def iter_prefix(self, prefix):
+        i = bisect.bisect_left(self._names, prefix)
+        while i < len(self._names) and self._names[i].startswith(prefix):
+            yield self._projects[i]
+            i += 1
+
+    def filter(self, filter_expr):
+        if filter_expr is None:
+            return iter(self._projects)
+
+        regex = re.compile(filter_expr)
+        return (p for p in self.iter_prefix(literal_prefix(filter_expr)) if regex.match(p.name) is not None)
@@ -0,0 +1,235 @@
+##################################################
+# Copyright (C) 2017, All rights reserved.
+##################################################
+
+from __future__ import print_function
+import json
+import re
+import sys
+import threading
+import time
+import urlparse
+
+from collections import namedtuple
+
+from repotool.table import Table
+
+TRACE_FORMATS = ["chrome", "jsonl"]
+
+_NUMERIC_SEGMENT_REGEX = re.compile("^[0-9]+$")
+
+RequestEvent = namedtuple("RequestEvent", [
+    "provider_name",
+    "method",
+    "url_template",
+    "status",
+    "start",
+    "duration",
+    "byte_count",
+    "is_cache_hit",
+    "is_page_read",
+    "thread_id"
+])
+
+BuildEvent = namedtuple("BuildEvent", [
+    "provider_name",
+    "start",
+    "duration",
+    "project_count",
+    "thread_id"
+])
+
+_callbacks = []
+_lock = threading.Lock()
+
+def add_callback(callback):
+    """
+    Registers callback to be called with each RequestEvent and BuildEvent,
+    on whichever thread produced the event
+    """
+    global _callbacks
+    with _lock:
+        _callbacks = _callbacks + [callback]
+
+def remove_callback(callback):
+    global _callbacks
+    with _lock:
+        _callbacks = [c for c in _callbacks if c != callback]
+
+def is_enabled():
+    return len(_callbacks) > 0
+
+def emit(event):
+    for callback in _callbacks:
+        callback(event)
+
+def make_url_template(url):
+    """
+    Returns url without query values or numeric path segments, so that
+    requests for different pages and projects share a template and
+    tokens passed in query strings are not recorded
+
+    >>> make_url_template("https://gitlab.com/api/v4/projects/123?private_token=secret&page=2")
+    'https://gitlab.com/api/v4/projects/{id}?page=&private_token='
+    """
+    parts = urlparse.urlparse(url)
+    path = "/".join("{id}" if _NUMERIC_SEGMENT_REGEX.match(s) else s for s in parts.path.split("/"))
+    query = "&".join("{}=".format(k) for k in sorted(set(k for k, _ in urlparse.parse_qsl(parts.query, keep_blank_values=True))))
+    return urlparse.urlunparse((parts.scheme, parts.netloc, path, "", query, ""))
+
+def traced_request(provider_name, method, url, send, is_page_read=None):
+    """
+    Returns send(), which performs a request and returns its response,
+    and reports a RequestEvent for it to the registered callbacks
+
+    Responses served by the page cache without contacting the provider
+    are reported as cache hits; requests read pages unless is_page_read
+    says otherwise, which defaults to whether method is GET
+    """
+    if not is_enabled():
+        return send()
+
+    start = time.time()
+    r = None
+    try:
+        r = send()
+        return r
+    except Exception as e:
+        r = getattr(e, "response", None)
+        raise
+    finally:
+        emit(RequestEvent(
+            provider_name,
+            method.upper(),
+            make_url_template(url),
+            None if r is None else r.status_code,
+            start,
+            time.time() - start,
+            0 if r is None else len(r.content),
+            getattr(r, "is_cache_hit", False),
+            method.upper() == "GET" if is_page_read is None else is_page_read,
+            threading.current_thread().ident))
+
+def _format_ms(value):
+    return "-" if value is None else "{:.1f} ms".format(value)
+
+def percentile(values, p):
+    """
+    Returns the p-th percentile of values by the nearest-rank method
+
+    >>> percentile([4, 1, 3, 2], 50), percentile([4, 1, 3, 2], 95), percentile([], 50)
+    (2, 4, None)
+    """
+    if len(values) == 0:
+        return None
+
+    ordered = sorted(values)
+    rank = max(int(-(-p * len(ordered) // 100)), 1)
+    return ordered[rank - 1]
+
+class Stats(object):
+    """
+    Collects events for a per-provider summary of requests and project
+    construction
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._request_events = []
+        self._build_events = []
+
+    def record(self, event):
+        with self._lock:
+            if isinstance(event, RequestEvent):
+                self._request_events.append(event)
+            else:
+                self._build_events.append(event)
+
+    def make_tables(self):
+        with self._lock:
+            request_events = list(self._request_events)
+            build_events = list(self._build_events)
+
+        tables = []
+        for provider_name in sorted(set(e.provider_name for e in request_events + build_events)):
+            events = [e for e in request_events if e.provider_name == provider_name]
+            sent_events = [e for e in events if not e.is_cache_hit]
+            latencies = [e.duration * 1000 for e in sent_events]
+            builds = [e for e in build_events if e.provider_name == provider_name]
+
+            table = Table()
+            table.add_row("Requests", len(sent_events))
+            table.add_row("Pages read", len([e for e in events if e.is_page_read and e.status in [200, 304]]))
+            table.add_row("Cache hits", len(events) - len(sent_events))
+            table.add_row("Errors", len([e for e in events if e.status is None or e.status >= 400]))
+            table.add_row("Bytes", sum(e.byte_count for e in events))
+            table.add_row("Latency p50", _format_ms(percentile(latencies, 50)))
+            table.add_row("Latency p95", _format_ms(percentile(latencies, 95)))
+            table.add_row("Projects built", sum(e.project_count for e in builds))
+            table.add_row("Build time", _format_ms(sum(e.duration for e in builds) * 1000))
+            tables.append((provider_name, table))
+
+        return tables
+
+    def show(self, file=None):
+        file = sys.stderr if file is None else file
+        print("\nSTATISTICS\n", file=file)
+        for provider_name, table in self.make_tables():
+            print("{}:".format(provider_name), file=file)
+            table.show(indent=1, file=file)
+
+class TraceWriter(object):
+    """
+    Writes each event to a file as a line of JSON or, in the chrome
+    format, as a complete event that chrome://tracing and Perfetto load
+    """
+    def __init__(self, path, format="jsonl"):
+        self._format = format
+        self._lock = threading.Lock()
+        self._f = open(path, "wt")
+        if format == "chrome":
+            self._f.write("[\n")
+        self._first = True
+
+    def write(self, event):
+        if self._format == "chrome":
+            line = json.dumps(self._make_chrome_event(event))
+        else:
+            obj = event._asdict()
+            obj["type"] = "request" if isinstance(event, RequestEvent) else "build"
+            line = json.dumps(obj)
+
+        with self._lock:
+            if self._format == "chrome" and not self._first:
+                self._f.write(",\n")
+            self._f.write(line)
+            if self._format != "chrome":
+                self._f.write("\n")
+            self._first = False
+
+    def close(self):
+        with self._lock:
+            if self._format == "chrome":
+                self._f.write("\n]\n")
+            self._f.close()
+
+    def _make_chrome_event(self, event):
+        if isinstance(event, RequestEvent):
+            name = "{} {}".format(event.method, event.url_template)
+            category = "request"
+            args = { "status": event.status, "bytes": event.byte_count, "cache_hit": event.is_cache_hit }
+        else:
+            name = "build projects"
+            category = "build"
+            args = { "projects": event.project_count }
+
+        args["provider"] = event.provider_name
+        return {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": int(event.start * 1000000),
+            "dur": int(event.duration * 1000000),
+            "pid": 1,
+            "tid": event.thread_id,
+            "args": args
+        }
@@ -0,0 +1,19 @@
+##################################################
+# Copyright (C) 2017, All rights reserved.
+##################################################
+
+# Unlike the intern builtin, this also accepts the unicode strings
+# returned by the JSON decoder under Python 2.7
+_STRINGS = {}
+
+def intern_string(s):
+    """
+    >>> intern_string(u"git") is intern_string(u"".join([u"g", u"it"]))
+    True
+    >>> intern_string(None) is None
+    True
+    """
+    if s is None:
+        return None
+
+    return _STRINGS.setdefault(s, s)
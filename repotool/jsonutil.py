@@ -0,0 +1,23 @@
+##################################################
+# Copyright (C) 2017, All rights reserved.
+##################################################
+
+# Decode with the fastest available JSON library; all of them return the
+# same objects as the standard library for the documents providers send
+try:
+    import ujson as _json
+except ImportError:
+    try:
+        import simplejson as _json
+    except ImportError:
+        import json as _json
+
+def decode_json(s):
+    """
+    >>> decode_json('{"name": "repo", "id": 1}') == { "name": "repo", "id": 1 }
+    True
+    """
+    return _json.loads(s)
+
+def load_json(f):
+    return _json.loads(f.read())
@@ -0,0 +1,191 @@
+##################################################
+# Copyright (C) 2017, All rights reserved.
+##################################################
+
+import os
+import re
+import shutil
+import threading
+import urlparse
+
+from collections import namedtuple
+from pyprelude.file_system import make_path
+from pysimplevcs.git import Git
+from pysimplevcs.git_util import git_clone
+
+from repotool.concurrency import DEFAULT_MAX_WORKERS, imap_ordered
+from repotool.fingerprint import GIT_ENV, get_remote_refs
+
+DEFAULT_MAX_PER_HOST = 4
+
+CLONED = "cloned"
+FETCHED = "fetched"
+UNCHANGED = "unchanged"
+
+_GIT_ARGS = ["-c", "core.askPass=true"]
+
+_SCP_LIKE_URL_REGEX = re.compile("^(?:[^@/]+@)?(?P<host>[^:/]+):(?P<path>.*)$")
+
+MirrorResult = namedtuple("MirrorResult", ["project", "action", "byte_count", "error"])
+
+def split_url(url):
+    """
+    Returns the host and repository path of a Git URL; local repositories
+    have an empty host
+
+    >>> split_url("git@github.com:user/repo.git")
+    ('github.com', 'user/repo.git')
+    >>> split_url("https://user@bitbucket.org/user/repo.git")
+    ('bitbucket.org', 'user/repo.git')
+    >>> split_url("file:///srv/git/repo.git")
+    ('', 'srv/git/repo.git')
+    """
+    if "://" in url:
+        parts = urlparse.urlparse(url)
+        return parts.hostname or "", parts.path.lstrip("/")
+
+    m = _SCP_LIKE_URL_REGEX.match(url)
+    if m is not None:
+        return m.group("host"), m.group("path").lstrip("/")
+
+    return "", url.lstrip("/")
+
+def get_mirror_path(mirror_dir, project, clone_link_key="ssh"):
+    _, path = split_url(project.clone_link(clone_link_key))
+    if not path.endswith(".git"):
+        path += ".git"
+
+    return make_path(mirror_dir, project.provider.name, *path.split("/"))
+
+def _get_object_size(path):
+    size = 0
+    path = make_path(path, "objects")
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            file_path = make_path(dir_path, file_name)
+            if not os.path.islink(file_path):
+                size += os.path.getsize(file_path)
+    return size
+
+def _get_local_refs(git):
+    output = git.for_each_ref("--format=%(objectname) %(refname)")
+    refs = {}
+    for line in output.splitlines():
+        commit, ref = line.split(" ", 1)
+        refs[ref] = commit
+    return refs
+
+def _clone(url, path):
+    # Clone next to the final location so that an interrupted clone is
+    # never mistaken for a mirror on the next run
+    partial_path = path + ".partial"
+    if os.path.isdir(partial_path):
+        shutil.rmtree(partial_path)
+
+    parent_dir = os.path.dirname(path)
+    if not os.path.isdir(parent_dir):
+        try:
+            os.makedirs(parent_dir)
+        except OSError:
+            if not os.path.isdir(parent_dir):
+                raise
+
+    git_clone("--mirror", "--quiet", url, partial_path, env=GIT_ENV)
+    os.rename(partial_path, path)
+
+def _update(url, path):
+    git = Git(path, _GIT_ARGS)
+    if get_remote_refs(url) == _get_local_refs(git):
+        return False
+
+    status, _, error = git.fetch("--prune", "--quiet", url, "+refs/*:refs/*", can_fail=True)
+    if status != 0:
+        raise RuntimeError("git fetch failed for {}: {}".format(url, error.strip()))
+
+    return True
+
+def push_mirror(path, url, refspecs):
+    """
+    Force-pushes refspecs from the mirror at path to the repository at url,
+    deleting refs matched by refspecs that the mirror no longer has
+    """
+    git = Git(path, _GIT_ARGS)
+    status, _, error = git.push("--prune", "--quiet", url, *refspecs, can_fail=True)
+    if status != 0:
+        raise RuntimeError("git push failed for {}: {}".format(url, error.strip()))
+
+class HostSemaphores(object):
+    """
+    Hands out one semaphore per host so that at most max_per_host
+    operations run against any one server
+    """
+    def __init__(self, max_per_host=DEFAULT_MAX_PER_HOST):
+        self._max_per_host = max_per_host
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        host, _ = split_url(url)
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.Semaphore(self._max_per_host)
+                self._semaphores[host] = semaphore
+            return semaphore
+
+def update_mirror(url, path):
+    """
+    Clones the repository at url into a bare mirror at path, or fetches
+    into the existing mirror if its refs differ from the remote's, and
+    returns the action taken and the number of object bytes added
+
+    >>> import tempfile
+    >>> from pyprelude.process import execute
+    >>> from repotool.tests.local_git import commit_to_bare_repo
+    >>> temp_dir = tempfile.mkdtemp()
+    >>> remote_path = make_path(temp_dir, "remote.git")
+    >>> url = "file://" + remote_path
+    >>> path = make_path(temp_dir, "mirror", "remote.git")
+    >>> _ = commit_to_bare_repo(remote_path, "first")
+    >>> action, byte_count = update_mirror(url, path); action, byte_count > 0
+    ('cloned', True)
+    >>> update_mirror(url, path)
+    ('unchanged', 0)
+    >>> commit = commit_to_bare_repo(remote_path, "second")
+    >>> action, byte_count = update_mirror(url, path); action, byte_count > 0
+    ('fetched', True)
+    >>> execute("git", "--git-dir", path, "rev-parse", "master").strip() == commit
+    True
+    >>> shutil.rmtree(temp_dir)
+    """
+    if not os.path.isdir(path):
+        _clone(url, path)
+        return CLONED, _get_object_size(path)
+
+    old_size = _get_object_size(path)
+    if not _update(url, path):
+        return UNCHANGED, 0
+
+    return FETCHED, max(_get_object_size(path) - old_size, 0)
+
+def mirror_projects(projects, mirror_dir, clone_link_key="ssh", max_workers=DEFAULT_MAX_WORKERS, max_per_host=DEFAULT_MAX_PER_HOST):
+    """
+    Updates the mirror of each project under mirror_dir and yields a
+    MirrorResult per project in the same order as projects
+
+    Mirrors whose refs already match the remote's are left untouched; at
+    most max_per_host clones and fetches run against any one host
+    """
+    host_semaphores = HostSemaphores(max_per_host)
+
+    def _mirror_project(project):
+        url = project.clone_link(clone_link_key)
+        path = get_mirror_path(mirror_dir, project, clone_link_key)
+        try:
+            with host_semaphores.get(url):
+                action, byte_count = update_mirror(url, path)
+            return MirrorResult(project, action, byte_count, None)
+        except Exception as e:
+            return MirrorResult(project, None, 0, e)
+
+    return imap_ordered(_mirror_project, projects, max_workers=max_workers)
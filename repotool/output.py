@@ -0,0 +1,197 @@
+##################################################
+# Copyright (C) 2017, All rights reserved.
+##################################################
+
+import csv
+import io
+import json
+import os
+import sys
+
+from collections import OrderedDict
+
+TEXT_FORMAT = "text"
+FORMATS = ["csv", "jsonl", TEXT_FORMAT, "tsv"]
+
+_BUFFER_SIZE = 64 * 1024
+
+def _get_clone_link(key):
+    return lambda p: p.clone_link(key) if key in p.clone_link_keys() else None
+
+def _get_owner_attr(name):
+    return lambda p: None if p.owner is None else getattr(p.owner, name)
+
+def _get_source_attr(name):
+    return lambda p: None if p.source is None else getattr(p.source, name)
+
+FIELDS = OrderedDict([
+    ("provider", lambda p: p.provider.name),
+    ("provider_type", lambda p: p.provider.provider_name),
+    ("owner", _get_owner_attr("user_name")),
+    ("owner_type", _get_owner_attr("type")),
+    ("owner_id", _get_owner_attr("id")),
+    ("id", lambda p: p.id),
+    ("name", lambda p: p.name),
+    ("full_name", lambda p: p.full_name),
+    ("description", lambda p: p.description),
+    ("scm", lambda p: p.scm),
+    ("private", lambda p: p.is_private),
+    ("archived", lambda p: p.is_archived),
+    ("fork", lambda p: p.is_fork),
+    ("https", _get_clone_link("https")),
+    ("ssh", _get_clone_link("ssh")),
+    ("last_updated", lambda p: p.last_updated),
+    ("source", _get_source_attr("full_name")),
+    ("source_id", _get_source_attr("id"))
+])
+
+def parse_fields(s):
+    """
+    Returns the field names in a comma-separated list
+
+    >>> parse_fields("name, id,ssh")
+    ['name', 'id', 'ssh']
+    >>> parse_fields("name,size")
+    Traceback (most recent call last):
+    ...
+    ValueError: Unknown field "size"
+    """
+    fields = [f.strip() for f in s.split(",") if len(f.strip()) > 0]
+    for field in fields:
+        if field not in FIELDS:
+            raise ValueError("Unknown field \"{}\"".format(field))
+    return fields
+
+def _format_delimited_value(value):
+    """
+    >>> [_format_delimited_value(v) for v in [None, True, 12, u"caf\\xe9"]]
+    ['', 'true', '12', 'caf\\xc3\\xa9']
+    """
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return str(value)
+
+class _Record(dict):
+    """
+    Dictionary whose keys iterate in field order, which the C encoder of
+    the json module follows without the overhead of an OrderedDict
+
+    >>> json.dumps(_Record(["b", "a"], [1, 2]))
+    '{"b": 1, "a": 2}'
+    """
+    __slots__ = ("_names",)
+
+    def __init__(self, names, values):
+        dict.__init__(self, zip(names, values))
+        self._names = names
+
+    def __iter__(self):
+        return iter(self._names)
+
+class _JsonLinesWriter(object):
+    def __init__(self, f, names):
+        self._f = f
+        self._names = names
+        self._encode = json.JSONEncoder().encode
+
+    def write(self, values):
+        self._f.write(self._encode(_Record(self._names, values)))
+        self._f.write("\n")
+
+class _DelimitedWriter(object):
+    def __init__(self, f, names, delimiter):
+        self._writer = csv.writer(f, delimiter=delimiter, lineterminator="\n")
+        self._writer.writerow(names)
+
+    def write(self, values):
+        self._writer.writerow([_format_delimited_value(v) for v in values])
+
+class _BatchedFile(object):
+    """
+    Collects writes and passes them on to file in batches of about size
+    bytes, leaving file open when closed
+
+    >>> import StringIO
+    >>> file = StringIO.StringIO()
+    >>> f = _BatchedFile(file, 4)
+    >>> f.write("ab"); file.getvalue()
+    ''
+    >>> f.write("cd"); file.getvalue()
+    'abcd'
+    >>> f.write("e"); f.close(); file.getvalue(), file.closed
+    ('abcde', False)
+    """
+    def __init__(self, file, size):
+        self._file = file
+        self._size = size
+        self._chunks = []
+        self._length = 0
+
+    def write(self, s):
+        self._chunks.append(s)
+        self._length += len(s)
+        if self._length >= self._size:
+            self.flush()
+
+    def flush(self):
+        if len(self._chunks) > 0:
+            self._file.write("".join(self._chunks))
+            self._chunks = []
+            self._length = 0
+
+    def close(self):
+        self.flush()
+        self._file.flush()
+
+def _open_buffered(file):
+    try:
+        fd = file.fileno()
+    except (AttributeError, io.UnsupportedOperation, ValueError):
+        # File-like objects such as StringIO have no descriptor to write to
+        return _BatchedFile(file, _BUFFER_SIZE)
+
+    # Write to a duplicate of the descriptor so that records are not
+    # flushed line by line when file is a terminal
+    file.flush()
+    return os.fdopen(os.dup(fd), "wb", _BUFFER_SIZE)
+
+class RecordWriter(object):
+    """
+    Writes a record of the given fields per project as JSON lines or as
+    CSV or TSV with a header row, through a single buffer onto file
+
+    Each record starts with the values of extra_fields, such as the group
+    a duplicate project belongs to, which are passed to write
+    """
+    def __init__(self, format, fields=None, extra_fields=(), file=None):
+        if format not in ["csv", "jsonl", "tsv"]:
+            raise ValueError("Unsupported format \"{}\"".format(format))
+
+        file = sys.stdout if file is None else file
+        fields = list(FIELDS.keys()) if fields is None else fields
+        names = list(extra_fields) + fields
+
+        self._f = _open_buffered(file)
+        self._getters = [FIELDS[f] for f in fields]
+        if format == "jsonl":
+            self._writer = _JsonLinesWriter(self._f, names)
+        elif format == "csv":
+            self._writer = _DelimitedWriter(self._f, names, ",")
+        else:
+            self._writer = _DelimitedWriter(self._f, names, "\t")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, project, *extra_values):
+        self._writer.write(list(extra_values) + [g(project) for g in self._getters])
+
+    def close(self):
+        self._f.close()
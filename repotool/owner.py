@@ -2,13 +2,16 @@
 # Copyright (C) 2017, All rights reserved.
 ##################################################
 
+from repotool.interning import intern_string
 from repotool.table import Table
 
 class Owner(object):
+    __slots__ = ("_type", "_id", "_user_name")
+
     def __init__(self, type, id, user_name):
-        self._type = type
+        self._type = intern_string(type)
         self._id = id
-        self._user_name = user_name
+        self._user_name = intern_string(user_name)
 
     def __repr__(self):
         return "{} ({}:{})".format(self._user_name, self._id, self._type)
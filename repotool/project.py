@@ -2,27 +2,152 @@
 # Copyright (C) 2017, All rights reserved.
 ##################################################
 
+import threading
+import time
+
+from repotool.instrument import BuildEvent, emit, is_enabled
+from repotool.interning import intern_string
 from repotool.table import Table
 
+def _matches_templates(clone_links, clone_link_templates, clone_path):
+    if clone_path is None or len(clone_links) != len(clone_link_templates):
+        return False
+
+    for key, link in clone_links.items():
+        template = clone_link_templates.get(key)
+        if template is None or template.format(path=clone_path) != link:
+            return False
+
+    return True
+
+def make_projects(provider, project_objs, make_project, name_matcher=None, lazy=False):
+    """
+    Yields a project for each project object whose name is accepted by
+    name_matcher, which runs before anything is built from the object
+
+    Views that build their Project on demand are yielded instead of
+    projects if lazy is True
+    """
+    if lazy or not is_enabled():
+        for project_obj in project_objs:
+            if name_matcher is None or name_matcher(project_obj["name"]):
+                yield ProjectView(provider, project_obj, make_project) if lazy else make_project(provider, project_obj)
+        return
+
+    # Time only the construction of projects, not the requests made while
+    # iterating over project_objs or the work done by the consumer
+    start = time.time()
+    duration = 0
+    project_count = 0
+    for project_obj in project_objs:
+        if name_matcher is None or name_matcher(project_obj["name"]):
+            t = time.time()
+            project = make_project(provider, project_obj)
+            duration += time.time() - t
+            project_count += 1
+            yield project
+
+    emit(BuildEvent(provider.name, start, duration, project_count, threading.current_thread().ident))
+
+class ProjectView(object):
+    """
+    Stands in for the Project built from a provider's project object
+
+    The name is read straight from the object; the Project is built on
+    first access to any other attribute, after which the object is
+    released
+    """
+    __slots__ = ("_provider", "_project_obj", "_make_project", "_project")
+
+    def __init__(self, provider, project_obj, make_project):
+        self._provider = provider
+        self._project_obj = project_obj
+        self._make_project = make_project
+        self._project = None
+
+    def __repr__(self):
+        return repr(self._get_project())
+
+    def __getattr__(self, name):
+        return getattr(self._get_project(), name)
+
+    @property
+    def provider(self): return self._provider
+
+    @property
+    def name(self):
+        project_obj = self._project_obj
+        return self._project.name if project_obj is None else project_obj["name"]
+
+    def _get_project(self):
+        # The Project is set before the object is released, so a thread
+        # that finds no object can use the Project built by another
+        project = self._project
+        if project is None:
+            project_obj = self._project_obj
+            if project_obj is None:
+                return self._project
+
+            start = time.time()
+            project = self._make_project(self._provider, project_obj)
+            if is_enabled():
+                emit(BuildEvent(self._provider.name, start, time.time() - start, 1, threading.current_thread().ident))
+            self._project = project
+            self._project_obj = None
+        return project
+
 class Project(object):
-    def __init__(self, provider, source, owner, id, name, full_name, description, scm, is_private, is_archived, clone_links):
+    __slots__ = (
+        "_provider",
+        "_source",
+        "_owner",
+        "_id",
+        "_name",
+        "_full_name",
+        "_description",
+        "_scm",
+        "_is_private",
+        "_is_archived",
+        "_clone_links",
+        "_clone_path",
+        "_last_updated",
+        "_is_fork",
+        "_parent_full_name"
+    )
+
+    def __init__(self, provider, source, owner, id, name, full_name, description, scm, is_private, is_archived, clone_links, clone_link_templates=None, clone_path=None, last_updated=None, is_fork=None, parent_full_name=None):
         self._source = source
+        # Listings may report that a project is a fork without saying
+        # what it was forked from
+        self._is_fork = source is not None if is_fork is None else is_fork
+        # Some listings name only the project a fork was directly forked
+        # from, which is kept so that its source can be looked up
+        self._parent_full_name = parent_full_name
         self._provider = provider
         self._owner = owner
         self._id = id
         self._name = name
         self._full_name = full_name
         self._description = description
-        self._scm = scm
+        self._scm = intern_string(scm)
         self._is_private = is_private
         self._is_archived = is_archived
-        self._clone_links = clone_links
+        self._last_updated = last_updated
+
+        # Share the provider's templates instead of keeping a dict of
+        # clone links per project whenever the links follow them
+        if clone_link_templates is not None and _matches_templates(clone_links, clone_link_templates, clone_path):
+            self._clone_links = clone_link_templates
+            self._clone_path = clone_path
+        else:
+            self._clone_links = clone_links
+            self._clone_path = None
 
     def __repr__(self):
         return "{} ({}) {} ({})".format(
             self._name,
             self._id,
-            self._clone_links.get("ssh", "(unknown URL)"),
+            self.clone_link("ssh") if "ssh" in self._clone_links else "(unknown URL)",
             self._owner)
 
     @property
@@ -55,7 +180,26 @@ class Project(object):
     @property
     def is_archived(self): return self._is_archived
 
-    def clone_link(self, key): return self._clone_links[key]
+    @property
+    def last_updated(self): return self._last_updated
+
+    @property
+    def is_fork(self): return self._is_fork
+
+    @property
+    def parent_full_name(self): return self._parent_full_name
+
+    def set_source(self, source):
+        """
+        Sets the project that this fork was forked from once it has been
+        looked up
+        """
+        self._source = source
+        self._is_fork = True
+
+    def clone_link(self, key):
+        link = self._clone_links[key]
+        return link if self._clone_path is None else link.format(path=self._clone_path)
 
     def clone_link_keys(self): return self._clone_links.keys()
 
@@ -69,7 +213,7 @@ class Project(object):
         table.add_row("SCM", self._scm)
         table.add_row("Private", self._is_private)
         table.add_row("Archived", self._is_archived)
-        clone_link_str = ", ".join(["{}: {}".format(k, self._clone_links[k]) for k in self._clone_links])
+        clone_link_str = ", ".join(["{}: {}".format(k, self.clone_link(k)) for k in self._clone_links])
         table.add_row("Clone links", clone_link_str)
         table.add_row("Provider", self._provider.provider_name)
         if self._source:
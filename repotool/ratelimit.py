@@ -0,0 +1,136 @@
+##################################################
+# Copyright (C) 2017, All rights reserved.
+##################################################
+
+import threading
+import time
+
+from collections import namedtuple
+
+DEFAULT_RESERVE = 10
+DEFAULT_LOW_WATER = 100
+DEFAULT_MAX_RETRIES = 5
+
+# Used when a provider reports a limit without saying when it resets
+_DEFAULT_RETRY_DELAY = 60
+_POLL_INTERVAL = 1
+
+RateLimitBudget = namedtuple("RateLimitBudget", ["limit", "remaining", "reset"])
+
+def _get_int_header(r, name):
+    value = r.headers.get(name)
+    if value is None:
+        return None
+
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+class RateLimiter(object):
+    @staticmethod
+    def parse_config(header_prefix, obj):
+        return RateLimiter(
+            header_prefix,
+            reserve=obj.get("rate-limit-reserve", DEFAULT_RESERVE),
+            low_water=obj.get("rate-limit-low-water", DEFAULT_LOW_WATER))
+
+    def __init__(self, header_prefix, reserve=DEFAULT_RESERVE, low_water=DEFAULT_LOW_WATER, max_retries=DEFAULT_MAX_RETRIES):
+        self._header_prefix = header_prefix
+        self._reserve = reserve
+        self._low_water = low_water
+        self._max_retries = max_retries
+        self._condition = threading.Condition()
+        self._limit = None
+        self._remaining = None
+        self._reset = None
+        self._blocked_until = 0
+        self._next_slot = 0
+        self._in_flight = 0
+
+    @property
+    def budget(self):
+        with self._condition:
+            return RateLimitBudget(self._limit, self._remaining, self._reset)
+
+    def request(self, send):
+        retry_count = 0
+        while True:
+            self._acquire()
+            try:
+                r = send()
+            finally:
+                self._release()
+
+            delay = self._update(r)
+            if delay is None or retry_count >= self._max_retries:
+                return r
+
+            retry_count += 1
+            with self._condition:
+                self._blocked_until = max(self._blocked_until, time.time() + delay)
+                self._condition.notify_all()
+
+    def _is_low(self):
+        return self._remaining is not None and self._remaining < self._low_water
+
+    def _get_wait(self, now):
+        wait = max(self._blocked_until, self._next_slot) - now
+        if self._remaining is not None and self._remaining <= self._reserve and self._reset is not None:
+            wait = max(wait, self._reset - now)
+        return wait
+
+    def _acquire(self):
+        with self._condition:
+            while True:
+                now = time.time()
+                wait = self._get_wait(now)
+                # Only one request at a time once the budget runs low
+                if wait <= 0 and (not self._is_low() or self._in_flight == 0):
+                    break
+                self._condition.wait(min(wait, _POLL_INTERVAL) if wait > 0 else _POLL_INTERVAL)
+
+            if self._is_low() and self._reset is not None:
+                # Spread the remaining budget evenly until the window resets
+                self._next_slot = now + max(self._reset - now, 0) / float(max(self._remaining, 1))
+
+            if self._remaining is not None:
+                self._remaining -= 1
+
+            self._in_flight += 1
+
+    def _release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def _update(self, r):
+        now = time.time()
+        limit = _get_int_header(r, self._header_prefix + "Limit")
+        remaining = _get_int_header(r, self._header_prefix + "Remaining")
+        reset = _get_int_header(r, self._header_prefix + "Reset")
+
+        with self._condition:
+            if limit is not None:
+                self._limit = limit
+            if remaining is not None:
+                self._remaining = remaining
+            if reset is not None:
+                self._reset = reset
+            elif self._reset is not None and self._reset <= now:
+                self._reset = None
+
+        retry_after = _get_int_header(r, "Retry-After")
+        if r.status_code == 429:
+            if retry_after is not None:
+                return retry_after
+            return _DEFAULT_RETRY_DELAY if reset is None else max(reset - now, 0)
+
+        if r.status_code == 403:
+            # GitHub reports both primary and secondary limits as 403
+            if retry_after is not None:
+                return retry_after
+            if remaining == 0:
+                return _DEFAULT_RETRY_DELAY if reset is None else max(reset - now, 0)
+
+        return None
@@ -0,0 +1,75 @@
+##################################################
+# Copyright (C) 2017, All rights reserved.
+##################################################
+
+import random
+import requests
+
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 60
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+
+_RETRY_STATUSES = (500, 502, 503, 504)
+
+class _JitteredRetry(Retry):
+    def get_backoff_time(self):
+        # "Full jitter": spread concurrent retries over the whole backoff window
+        backoff = super(_JitteredRetry, self).get_backoff_time()
+        return random.uniform(0, backoff)
+
+class SessionSettings(object):
+    @staticmethod
+    def parse_config(obj):
+        return SessionSettings(
+            pool_size=obj.get("pool-size", DEFAULT_POOL_SIZE),
+            connect_timeout=obj.get("connect-timeout", DEFAULT_CONNECT_TIMEOUT),
+            read_timeout=obj.get("read-timeout", DEFAULT_READ_TIMEOUT),
+            retries=obj.get("retries", DEFAULT_RETRIES),
+            backoff_factor=obj.get("backoff-factor", DEFAULT_BACKOFF_FACTOR))
+
+    def __init__(
+        self,
+        pool_size=DEFAULT_POOL_SIZE,
+        connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+        read_timeout=DEFAULT_READ_TIMEOUT,
+        retries=DEFAULT_RETRIES,
+        backoff_factor=DEFAULT_BACKOFF_FACTOR):
+        self._pool_size = pool_size
+        self._connect_timeout = connect_timeout
+        self._read_timeout = read_timeout
+        self._retries = retries
+        self._backoff_factor = backoff_factor
+
+    @property
+    def pool_size(self): return self._pool_size
+
+    @property
+    def timeout(self): return (self._connect_timeout, self._read_timeout)
+
+    @property
+    def retries(self): return self._retries
+
+    def mount(self, session):
+        # Retry's default method whitelist restricts read and status retries
+        # to idempotent methods, so POSTs are only retried when the
+        # connection could not be established in the first place
+        retry = _JitteredRetry(
+            total=self._retries,
+            backoff_factor=self._backoff_factor,
+            status_forcelist=_RETRY_STATUSES,
+            raise_on_status=False)
+        adapter = HTTPAdapter(
+            pool_connections=self._pool_size,
+            pool_maxsize=self._pool_size,
+            max_retries=retry)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def make_session(self):
+        return self.mount(requests.Session())
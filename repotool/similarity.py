@@ -0,0 +1,92 @@
+##################################################
+# Copyright (C) 2017, All rights reserved.
+##################################################
+
+import math
+import re
+
+DEFAULT_THRESHOLD = 0.8
+
+_NON_ALPHANUMERIC_REGEX = re.compile("[^a-z0-9]")
+
+def normalize_name(name):
+    """
+    >>> normalize_name("My_Lib-old")
+    'mylibold'
+    """
+    return _NON_ALPHANUMERIC_REGEX.sub("", name.lower())
+
+def make_ngrams(s, n=3):
+    """
+    >>> sorted(make_ngrams("lib"))
+    ['^li', 'ib$', 'lib']
+    """
+    padded = "^" + s + "$"
+    return frozenset(padded[i : i + n] for i in range(max(len(padded) - n + 1, 1)))
+
+def jaccard(a, b):
+    return len(a & b) / float(len(a | b))
+
+def find_similar(names, threshold=DEFAULT_THRESHOLD):
+    """
+    Returns (i, j, score) for each pair of names whose normalized trigram
+    sets have a Jaccard similarity of at least threshold
+
+    Only pairs sharing one of the rarest trigrams in their prefixes are
+    compared (prefix filtering), which gives the same result as comparing
+    every pair in close to linear time
+
+    >>> names = ["my-lib", "mylib", "My_Lib", "mylibs", "other"]
+    >>> [(names[i], names[j], round(s, 2)) for i, j, s in find_similar(names, 0.5)]
+    [('my-lib', 'mylib', 1.0), ('my-lib', 'My_Lib', 1.0), ('mylib', 'My_Lib', 1.0), ('my-lib', 'mylibs', 0.57), ('mylib', 'mylibs', 0.57), ('My_Lib', 'mylibs', 0.57)]
+    """
+    # Score each distinct normalized name once
+    groups = {}
+    for i, name in enumerate(names):
+        normalized = normalize_name(name)
+        if len(normalized) > 0:
+            groups.setdefault(normalized, []).append(i)
+
+    keys = sorted(groups.keys())
+    gram_sets = [make_ngrams(k) for k in keys]
+
+    frequencies = {}
+    for grams in gram_sets:
+        for gram in grams:
+            frequencies[gram] = frequencies.get(gram, 0) + 1
+
+    order = sorted(range(len(keys)), key=lambda k: (len(gram_sets[k]), keys[k]))
+    index = {}
+    pairs = []
+    for k in order:
+        grams = gram_sets[k]
+        size = len(grams)
+        prefix_len = size - int(math.ceil(threshold * size)) + 1
+        prefix = sorted(grams, key=lambda g: (frequencies[g], g))[ : prefix_len]
+
+        candidates = set()
+        for gram in prefix:
+            for other in index.get(gram, []):
+                if len(gram_sets[other]) >= threshold * size:
+                    candidates.add(other)
+            index.setdefault(gram, []).append(k)
+
+        for other in candidates:
+            score = jaccard(grams, gram_sets[other])
+            if score >= threshold:
+                pairs.append((other, k, score))
+
+    results = []
+    for k in range(len(keys)):
+        group = groups[keys[k]]
+        for x in range(len(group)):
+            for y in range(x + 1, len(group)):
+                results.append((group[x], group[y], 1.0))
+
+    for a, b, score in pairs:
+        for i in groups[keys[a]]:
+            for j in groups[keys[b]]:
+                results.append((min(i, j), max(i, j), score))
+
+    results.sort(key=lambda r: (-r[2], r[0], r[1]))
+    return results
@@ -0,0 +1,90 @@
+##################################################
+# Copyright (C) 2017, All rights reserved.
+##################################################
+
+import json
+import os
+import time
+
+from repotool.fileutil import write_file_atomically
+from repotool.jsonutil import load_json
+
+DEFAULT_RECONCILE_INTERVAL = 60 * 60 * 24
+
+# Allow for clock skew between this machine and the provider
+_SINCE_MARGIN = 5 * 60
+
+def format_timestamp(t):
+    """
+    >>> format_timestamp(1500000000)
+    '2017-07-14T02:40:00Z'
+    """
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(t))
+
+class Snapshot(object):
+    @staticmethod
+    def load(path, key):
+        if not os.path.isfile(path):
+            return None
+
+        with open(path, "rt") as f:
+            obj = load_json(f)
+
+        return Snapshot(
+            path,
+            key,
+            obj["projects"],
+            obj["synced_at"],
+            obj["reconciled_at"])
+
+    def __init__(self, path, key, project_objs, synced_at, reconciled_at):
+        self._path = path
+        self._key = key
+        self._project_objs = { o[key]: o for o in project_objs }
+        self._synced_at = synced_at
+        self._reconciled_at = reconciled_at
+
+    @property
+    def project_objs(self): return self._project_objs.values()
+
+    @property
+    def synced_at(self): return self._synced_at
+
+    @property
+    def reconciled_at(self): return self._reconciled_at
+
+    def update(self, project_objs, synced_at):
+        for o in project_objs:
+            self._project_objs[o[self._key]] = o
+        self._synced_at = synced_at
+
+    def save(self):
+        write_file_atomically(self._path, lambda f: json.dump({
+            "synced_at": self._synced_at,
+            "reconciled_at": self._reconciled_at,
+            "projects": self.project_objs
+        }, f))
+
+def sync_project_objs(path, key, get_all_project_objs, get_changed_project_objs, reconcile_interval=DEFAULT_RECONCILE_INTERVAL, offline=False):
+    """
+    Brings the snapshot at path up to date and returns its project objects
+
+    get_changed_project_objs is passed the time of the previous sync,
+    formatted by format_timestamp, and returns the project objects
+    created or updated since then. Deleted projects are only dropped when
+    the snapshot is reconciled by get_all_project_objs, which happens
+    once every reconcile_interval seconds.
+    """
+    snapshot = Snapshot.load(path, key)
+    if offline and snapshot is not None:
+        return snapshot.project_objs
+
+    now = time.time()
+    if snapshot is None or now - snapshot.reconciled_at >= reconcile_interval:
+        snapshot = Snapshot(path, key, get_all_project_objs(), now, now)
+    else:
+        since = format_timestamp(snapshot.synced_at - _SINCE_MARGIN)
+        snapshot.update(get_changed_project_objs(since), now)
+
+    snapshot.save()
+    return snapshot.project_objs
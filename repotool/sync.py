@@ -0,0 +1,73 @@
+##################################################
+# Copyright (C) 2017, All rights reserved.
+##################################################
+
+from collections import namedtuple
+
+from repotool.concurrency import DEFAULT_MAX_WORKERS, iter_pipelined
+from repotool.fingerprint import get_remote_refs
+from repotool.mirror import DEFAULT_MAX_PER_HOST, UNCHANGED, HostSemaphores, get_mirror_path, push_mirror, update_mirror
+
+PUSHED = "pushed"
+
+_SYNCED_REF_PREFIXES = ("refs/heads/", "refs/tags/")
+_SYNCED_REFSPECS = ["+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*"]
+
+SyncResult = namedtuple("SyncResult", ["source", "target", "action", "error"])
+
+def join_projects(source_projects, target_projects):
+    """
+    Pairs each source project with the target project of the same name,
+    ignoring case, or with None if the target has no such project
+
+    >>> from collections import namedtuple
+    >>> P = namedtuple("P", ["name", "id"])
+    >>> join_projects([P("a", 1), P("B", 2)], [P("b", 3), P("c", 4)])
+    [(P(name='a', id=1), None), (P(name='B', id=2), P(name='b', id=3))]
+    """
+    targets = { p.name.lower(): p for p in target_projects }
+    return [(p, targets.get(p.name.lower())) for p in source_projects]
+
+def _get_synced_refs(url):
+    return { ref: commit for ref, commit in get_remote_refs(url).items() if ref.startswith(_SYNCED_REF_PREFIXES) }
+
+def sync_projects(pairs, work_dir, clone_link_key="ssh", max_workers=DEFAULT_MAX_WORKERS, max_per_host=DEFAULT_MAX_PER_HOST):
+    """
+    Replicates the branches and tags of each (source, target) project pair
+    and yields a SyncResult per pair in completion order
+
+    Sources are fetched into mirrors under work_dir, which are then pushed
+    to their targets; pushes overlap the fetches of later pairs. Pairs whose
+    branches and tags already match are skipped without fetching
+    """
+    host_semaphores = HostSemaphores(max_per_host)
+
+    def _fetch(pair):
+        source, target = pair
+        source_url = source.clone_link(clone_link_key)
+        target_url = target.clone_link(clone_link_key)
+
+        with host_semaphores.get(source_url):
+            source_refs = _get_synced_refs(source_url)
+        with host_semaphores.get(target_url):
+            target_refs = _get_synced_refs(target_url)
+        if source_refs == target_refs:
+            return None
+
+        path = get_mirror_path(work_dir, source, clone_link_key)
+        with host_semaphores.get(source_url):
+            update_mirror(source_url, path)
+        return path
+
+    def _push(pair, path):
+        if path is None:
+            return UNCHANGED
+
+        _, target = pair
+        target_url = target.clone_link(clone_link_key)
+        with host_semaphores.get(target_url):
+            push_mirror(path, target_url, _SYNCED_REFSPECS)
+        return PUSHED
+
+    for (source, target), action, error in iter_pipelined(_fetch, _push, pairs, max_workers=max_workers):
+        yield SyncResult(source, target, action, error)
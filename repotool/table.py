@@ -2,6 +2,8 @@
 # Copyright (C) 2017, All rights reserved.
 ##################################################
 
+from __future__ import print_function
+
 class Table(object):
     def __init__(self):
         self._max_header_len = 0
@@ -14,7 +16,7 @@ class Table(object):
 
         self._rows.append((header, content))
 
-    def show(self, indent=0, column_sep=": "):
+    def show(self, indent=0, column_sep=": ", file=None):
         indent_str = "  " * indent
         for header, content in self._rows:
-            print("{}{}{}{}".format(indent_str, header.ljust(self._max_header_len), column_sep, content))
+            print("{}{}{}{}".format(indent_str, header.ljust(self._max_header_len), column_sep, content), file=file)
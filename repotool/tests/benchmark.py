@@ -0,0 +1,345 @@
+##################################################
+# Copyright (C) 2017, All rights reserved.
+##################################################
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import yaml
+
+from collections import namedtuple
+from pyprelude.file_system import make_path
+
+from repotool import __version__
+from repotool.tests.mock_server import MockServer, make_project_name
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_TOLERANCE = 0.2
+
+_PROVIDER_NAMES = ["bitbucket", "github", "gitlab"]
+
+# Runs repotool in a child process and records its peak resident set
+# size, so that each operation is measured from a cold start. Linux
+# carries ru_maxrss over from the forking parent, so the high-water mark
+# of the child's own address space is preferred where available
+_CHILD_SCRIPT = """
+import resource, runpy, sys
+rss_path = sys.argv.pop(1)
+try:
+    runpy.run_module("repotool", run_name="__main__", alter_sys=True)
+finally:
+    rss = None
+    try:
+        with open("/proc/self/status", "rt") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    rss = "kb " + line.split()[1]
+    except IOError:
+        pass
+    if rss is None:
+        rss = "maxrss " + str(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    with open(rss_path, "wt") as f:
+        f.write(rss)
+"""
+
+_Operation = namedtuple("_Operation", ["name", "make_commands", "make_item_count", "stdin"])
+
+_CONFIRMATION = "YES\nREALLY\n"
+
+# Bulk operations apply to the 1% of projects whose names end in "00"
+# or "50" so that the archive and delete runs do not overlap
+_OPERATIONS = [
+    _Operation(
+        "list",
+        lambda size: [["list"]],
+        lambda size: size * len(_PROVIDER_NAMES),
+        None),
+    _Operation(
+        "info",
+        lambda size: [["info", n, make_project_name(size // 2)] for n in _PROVIDER_NAMES],
+        lambda size: len(_PROVIDER_NAMES),
+        None),
+    _Operation(
+        "info-batch",
+        lambda size: [["info", "github"] + [make_project_name(i) for i in range(0, size, max(size // 100, 1))]],
+        lambda size: min(size, 100),
+        None),
+    _Operation(
+        "dupes",
+        lambda size: [["dupes"]],
+        lambda size: size * len(_PROVIDER_NAMES),
+        None),
+    _Operation(
+        "archive",
+        lambda size: [["archive", "--filter", "repo[0-9]*00$", "--provider", "github", "gitlab"]],
+        lambda size: 2 * ((size + 99) // 100),
+        _CONFIRMATION),
+    _Operation(
+        "delete",
+        lambda size: [["delete", "--filter", "repo[0-9]*50$", "--provider"] + _PROVIDER_NAMES],
+        lambda size: len(_PROVIDER_NAMES) * ((size + 49) // 100),
+        _CONFIRMATION)
+]
+
+_OPERATION_NAMES = [o.name for o in _OPERATIONS]
+
+BenchmarkResult = namedtuple("BenchmarkResult", [
+    "operation",
+    "size",
+    "seconds",
+    "item_count",
+    "request_counts",
+    "peak_rss_kb"
+])
+
+def _get_peak_rss_kb(s):
+    unit, value = s.split()
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    if unit == "maxrss" and sys.platform == "darwin":
+        return int(value) // 1024
+    return int(value)
+
+def _make_child_env(home_dir):
+    env = dict(os.environ)
+    env["HOME"] = home_dir
+    # The mock server speaks plain HTTP, which OAuth clients refuse by default
+    env["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
+    repo_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    python_path = env.get("PYTHONPATH")
+    env["PYTHONPATH"] = repo_dir if python_path is None else os.pathsep.join([repo_dir, python_path])
+    return env
+
+def _write_config(config_dir, server, use_graphql):
+    os.makedirs(config_dir)
+    with open(make_path(config_dir, "config.yaml"), "wt") as f:
+        yaml.dump({ "providers": server.make_provider_config_objs(graphql=use_graphql) }, f, default_flow_style=False)
+
+    # Skip the interactive OAuth authorization
+    with open(make_path(config_dir, "bitbucket.token.yaml"), "wt") as f:
+        yaml.dump({
+            "access_token": "access-token",
+            "token_type": "Bearer",
+            "expires_in": 3600,
+            "expires_at": time.time() + 24 * 3600
+        }, f, default_flow_style=False)
+
+def _run_command(command, env, stdin, rss_path):
+    p = subprocess.Popen(
+        [sys.executable, "-c", _CHILD_SCRIPT, rss_path] + command,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=env)
+    _, error = p.communicate(stdin)
+    if p.returncode != 0:
+        raise RuntimeError("Command \"repotool {}\" failed with exit code {}: {}".format(
+            " ".join(command),
+            p.returncode,
+            error.strip()))
+
+    with open(rss_path, "rt") as f:
+        return _get_peak_rss_kb(f.read())
+
+def run_operation(server, operation, size, home_dir):
+    """
+    Runs each command of operation against server with an empty page
+    cache and returns a BenchmarkResult
+    """
+    config_dir = make_path(home_dir, ".repotool")
+    env = _make_child_env(home_dir)
+    rss_path = make_path(home_dir, "rss")
+
+    seconds = 0
+    peak_rss_kb = 0
+    server.reset_counts()
+    for command in operation.make_commands(size):
+        shutil.rmtree(make_path(config_dir, "cache"), ignore_errors=True)
+        start = time.time()
+        rss_kb = _run_command(command, env, operation.stdin, rss_path)
+        seconds += time.time() - start
+        peak_rss_kb = max(peak_rss_kb, rss_kb)
+
+    return BenchmarkResult(
+        operation.name,
+        size,
+        seconds,
+        operation.make_item_count(size),
+        server.get_request_counts(),
+        peak_rss_kb)
+
+def run_benchmarks(sizes, operation_names, latency=0, max_page_size=None, rate_limit=None, rate_limit_window=60, use_graphql=False):
+    """
+    Starts a mock server for each size and yields a BenchmarkResult for
+    each operation in operation_names
+    """
+    operations = [o for o in _OPERATIONS if o.name in operation_names]
+    for size in sizes:
+        home_dir = tempfile.mkdtemp(prefix="repotool-benchmark-")
+        try:
+            with MockServer(
+                    repo_count=size,
+                    latency=latency,
+                    max_page_size=max_page_size,
+                    rate_limit=rate_limit,
+                    rate_limit_window=rate_limit_window) as server:
+                _write_config(make_path(home_dir, ".repotool"), server, use_graphql)
+                for operation in operations:
+                    yield run_operation(server, operation, size, home_dir)
+        finally:
+            shutil.rmtree(home_dir, ignore_errors=True)
+
+def _make_record(result, args):
+    return {
+        "version": __version__,
+        "timestamp": int(time.time()),
+        "operation": result.operation,
+        "size": result.size,
+        "seconds": round(result.seconds, 3),
+        "items": result.item_count,
+        "throughput": round(result.item_count / result.seconds, 1) if result.seconds > 0 else None,
+        "requests": sum(result.request_counts.values()),
+        "request_counts": result.request_counts,
+        "peak_rss_kb": result.peak_rss_kb,
+        "latency": args.latency,
+        "max_page_size": args.max_page_size,
+        "rate_limit": args.rate_limit,
+        "graphql": args.use_graphql
+    }
+
+def _show_record(record):
+    print("{:<10} {:>7} repos: {:8.2f} s {:>10} items/s {:>7} requests {:8.1f} MB peak".format(
+        record["operation"],
+        record["size"],
+        record["seconds"],
+        "-" if record["throughput"] is None else "{:.0f}".format(record["throughput"]),
+        record["requests"],
+        record["peak_rss_kb"] / 1024.0))
+
+def _load_baseline(path):
+    baseline = {}
+    with open(path, "rt") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                baseline[(record["operation"], record["size"])] = record
+    return baseline
+
+def find_regressions(record, baseline_record, tolerance=DEFAULT_TOLERANCE):
+    """
+    Returns a message for each metric of record that is worse than in
+    baseline_record by more than tolerance
+
+    >>> find_regressions(
+    ...     { "seconds": 1.5, "requests": 10, "peak_rss_kb": 1000 },
+    ...     { "seconds": 1.0, "requests": 10, "peak_rss_kb": 900 })
+    ['seconds: 1.0 -> 1.5 (+50%)']
+    """
+    messages = []
+    for key in ["seconds", "requests", "peak_rss_kb"]:
+        old_value = baseline_record.get(key)
+        new_value = record.get(key)
+        if old_value and new_value is not None and new_value > old_value * (1 + tolerance):
+            messages.append("{}: {} -> {} (+{:.0f}%)".format(key, old_value, new_value, (new_value - old_value) * 100.0 / old_value))
+    return messages
+
+def _main():
+    parser = argparse.ArgumentParser(description="Time repotool operations against a local mock of the provider APIs")
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=int,
+        default=DEFAULT_SIZES,
+        help="Numbers of projects served by each provider")
+    parser.add_argument(
+        "--operations",
+        nargs="+",
+        default=_OPERATION_NAMES,
+        choices=_OPERATION_NAMES,
+        help="Operations to time")
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0,
+        help="Seconds by which the mock server delays each response")
+    parser.add_argument(
+        "--max-page-size",
+        dest="max_page_size",
+        type=int,
+        default=None,
+        help="Largest page the mock server returns instead of each API's own limit")
+    parser.add_argument(
+        "--rate-limit",
+        dest="rate_limit",
+        type=int,
+        default=None,
+        help="Requests allowed per provider in each rate limit window")
+    parser.add_argument(
+        "--rate-limit-window",
+        dest="rate_limit_window",
+        type=int,
+        default=60,
+        help="Length of rate limit window in seconds")
+    parser.add_argument(
+        "--graphql",
+        dest="use_graphql",
+        action="store_true",
+        default=False,
+        help="List GitHub projects with the GraphQL API")
+    parser.add_argument(
+        "--output",
+        "-o",
+        dest="output_path",
+        default=None,
+        help="Append a line of JSON per result to this file")
+    parser.add_argument(
+        "--baseline",
+        dest="baseline_path",
+        default=None,
+        help="Compare results with the last matching result in this file and fail on regressions")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Fraction by which a metric may exceed its baseline")
+    args = parser.parse_args()
+
+    baseline = {} if args.baseline_path is None else _load_baseline(args.baseline_path)
+
+    output_file = None if args.output_path is None else open(args.output_path, "at")
+    regression_count = 0
+    try:
+        for result in run_benchmarks(
+                args.sizes,
+                args.operations,
+                latency=args.latency,
+                max_page_size=args.max_page_size,
+                rate_limit=args.rate_limit,
+                rate_limit_window=args.rate_limit_window,
+                use_graphql=args.use_graphql):
+            record = _make_record(result, args)
+            _show_record(record)
+            if output_file is not None:
+                output_file.write(json.dumps(record, sort_keys=True) + "\n")
+                output_file.flush()
+
+            baseline_record = baseline.get((record["operation"], record["size"]))
+            if baseline_record is not None:
+                for message in find_regressions(record, baseline_record, tolerance=args.tolerance):
+                    regression_count += 1
+                    print("  Regression: {}".format(message), file=sys.stderr)
+    finally:
+        if output_file is not None:
+            output_file.close()
+
+    if regression_count > 0:
+        print("{} regressions".format(regression_count), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    _main()
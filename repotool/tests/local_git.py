@@ -0,0 +1,45 @@
+##################################################
+# Copyright (C) 2017, All rights reserved.
+##################################################
+
+import os
+import shutil
+import tempfile
+
+from pyprelude.file_system import make_path
+from pyprelude.process import execute
+
+_GIT_ARGS = ["-c", "user.name=repotool", "-c", "user.email=repotool@localhost"]
+
+def make_bare_repo(path):
+    """
+    Creates an empty bare repository at path whose HEAD is master
+    """
+    execute("git", "init", "--bare", "--quiet", path)
+    execute("git", "--git-dir", path, "symbolic-ref", "HEAD", "refs/heads/master")
+
+def commit_to_bare_repo(path, content):
+    """
+    Commits a file holding content to master in the bare repository at
+    path, creating the repository first if necessary, and returns the
+    new commit
+    """
+    if not os.path.isdir(path):
+        make_bare_repo(path)
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        execute("git", "init", "--quiet", work_dir)
+        execute("git", "-C", work_dir, "fetch", "--quiet", path, "+refs/heads/*:refs/remotes/origin/*")
+        status, _, _ = execute("git", "-C", work_dir, "checkout", "--quiet", "-B", "master", "origin/master", can_fail=True)
+        if status != 0:
+            execute("git", "-C", work_dir, "checkout", "--quiet", "-B", "master")
+
+        with open(make_path(work_dir, "content.txt"), "wt") as f:
+            f.write(content)
+        execute("git", "-C", work_dir, "add", "content.txt")
+        execute(["git", "-C", work_dir] + _GIT_ARGS + ["commit", "--quiet", "-m", content])
+        execute("git", "-C", work_dir, "push", "--quiet", path, "master:master")
+        return execute("git", "-C", work_dir, "rev-parse", "HEAD").strip()
+    finally:
+        shutil.rmtree(work_dir)
@@ -0,0 +1,588 @@
+##################################################
+# Copyright (C) 2017, All rights reserved.
+##################################################
+
+import BaseHTTPServer
+import SocketServer
+import json
+import socket
+import threading
+import time
+import urllib
+import urlparse
+
+from repotool.instrument import percentile
+
+_GITHUB_PREFIX = "/github"
+_GITLAB_PREFIX = "/gitlab/api/v4"
+_BITBUCKET_PREFIX = "/bitbucket/2.0"
+
+_GITHUB = "github"
+_GITLAB = "gitlab"
+_BITBUCKET = "bitbucket"
+_PROVIDER_TYPES = [_GITHUB, _GITLAB, _BITBUCKET]
+
+# Default and maximum page sizes of the real APIs
+_PAGE_SIZES = {
+    _GITHUB: (30, 100),
+    _GITLAB: (20, 100),
+    _BITBUCKET: (10, 100)
+}
+
+# GitLab stops reporting totals for result sets larger than this
+DEFAULT_GITLAB_TOTAL_LIMIT = 10000
+
+_BASE_TIMESTAMP = 1483228800
+_UPSTREAM_OWNER = "upstream"
+
+def _format_timestamp(timestamp):
+    """
+    >>> _format_timestamp(_BASE_TIMESTAMP)
+    '2017-01-01T00:00:00Z'
+    """
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(timestamp))
+
+def make_project_name(index):
+    """
+    Returns the name of the index-th project served by MockServer
+
+    >>> make_project_name(42)
+    'repo000042'
+    """
+    return "repo{:06d}".format(index)
+
+class _Repository(object):
+    __slots__ = ["id", "name", "is_private", "is_archived", "is_fork", "updated"]
+
+    def __init__(self, id, name, is_private, is_fork, updated):
+        self.id = id
+        self.name = name
+        self.is_private = is_private
+        self.is_archived = False
+        self.is_fork = is_fork
+        self.updated = updated
+
+class _ProviderState(object):
+    def __init__(self, provider_type, user, repo_count, fork_every):
+        self.provider_type = provider_type
+        self.user = user
+        self.lock = threading.Lock()
+        self.repos = []
+        self.repos_by_name = {}
+        self.next_id = 1
+        self.request_count = 0
+        self.latencies = []
+        self.window_start = 0
+        self.window_count = 0
+        for i in range(repo_count):
+            self.add(make_project_name(i), i % 2 == 0, fork_every > 0 and i % fork_every == fork_every - 1, _BASE_TIMESTAMP + i * 60)
+
+    def add(self, name, is_private, is_fork, updated):
+        repo = _Repository(self.next_id, name, is_private, is_fork, updated)
+        self.next_id += 1
+        self.repos.append(repo)
+        self.repos_by_name[name.lower()] = repo
+        return repo
+
+    def remove(self, repo):
+        self.repos.remove(repo)
+        del self.repos_by_name[repo.name.lower()]
+
+    def get(self, name):
+        return self.repos_by_name.get(name.lower())
+
+class _Response(object):
+    def __init__(self, status, obj=None, headers=None):
+        self.status = status
+        self.obj = obj
+        self.headers = [] if headers is None else headers
+
+def _get_page_params(query, page_param, page_size_param, provider_type, max_page_size):
+    default_page_size, real_max_page_size = _PAGE_SIZES[provider_type]
+    limit = real_max_page_size if max_page_size is None else max_page_size
+    page = max(int(query.get(page_param, 1)), 1)
+    page_size = min(max(int(query.get(page_size_param, default_page_size)), 1), limit)
+    return page, page_size
+
+def _make_page_link(base_url, path, query, page_param, page):
+    items = [(k, v) for k, v in sorted(query.items()) if k != page_param]
+    return "{}{}?{}".format(base_url, path, urllib.urlencode(items + [(page_param, page)]))
+
+class MockServer(object):
+    """
+    Serves the parts of the GitHub, GitLab and Bitbucket APIs used by
+    repotool from a local HTTP server, for benchmarks that must not touch
+    the real services
+
+    Each provider lists repo_count projects named by make_project_name,
+    every fork_every-th of which is a fork, with the page sizes and paging
+    headers of the real API. Every request is delayed by latency seconds
+    and, if rate_limit is set, each provider allows only rate_limit
+    requests per rate_limit_window seconds and reports its budget in the
+    provider's rate limit headers
+    """
+    def __init__(self, repo_count=1000, user="user", latency=0, max_page_size=None, rate_limit=None, rate_limit_window=60, fork_every=0, gitlab_total_limit=DEFAULT_GITLAB_TOTAL_LIMIT):
+        self._user = user
+        self._latency = latency
+        self._max_page_size = max_page_size
+        self._rate_limit = rate_limit
+        self._rate_limit_window = rate_limit_window
+        self._gitlab_total_limit = gitlab_total_limit
+        self._states = { t: _ProviderState(t, user, repo_count, fork_every) for t in _PROVIDER_TYPES }
+        self._server = None
+        self._thread = None
+        self._url = None
+
+    @property
+    def url(self): return self._url
+
+    @property
+    def github_url(self): return self._url + _GITHUB_PREFIX
+
+    @property
+    def github_graphql_url(self): return self._url + _GITHUB_PREFIX + "/graphql"
+
+    @property
+    def gitlab_url(self): return self._url + _GITLAB_PREFIX
+
+    @property
+    def bitbucket_url(self): return self._url + _BITBUCKET_PREFIX
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        server = _HTTPServer(("127.0.0.1", 0), _RequestHandler)
+        server.mock = self
+        self._server = server
+        self._url = "http://127.0.0.1:{}".format(server.server_address[1])
+        self._thread = threading.Thread(target=server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def make_provider_config_objs(self, graphql=False):
+        """
+        Returns repotool provider configurations named after the provider
+        types that point at this server
+        """
+        return [
+            {
+                "name": _GITHUB,
+                "type": _GITHUB,
+                "user": self._user,
+                "api-token": "api-token",
+                "api-url": self.github_url,
+                "graphql-url": self.github_graphql_url,
+                "graphql": graphql
+            },
+            {
+                "name": _GITLAB,
+                "type": _GITLAB,
+                "user": self._user,
+                "api-token": "api-token",
+                "api-url": self.gitlab_url
+            },
+            {
+                "name": _BITBUCKET,
+                "type": _BITBUCKET,
+                "user": self._user,
+                "api-key": "api-key",
+                "api-secret": "api-secret",
+                "api-url": self.bitbucket_url
+            }
+        ]
+
+    def get_request_counts(self):
+        return { t: s.request_count for t, s in self._states.items() }
+
+    def get_latency_percentiles(self, p):
+        """
+        Returns the p-th percentile of the time spent handling requests
+        by each provider, in seconds and excluding the simulated latency
+        """
+        return { t: percentile(s.latencies, p) for t, s in self._states.items() }
+
+    def reset_counts(self):
+        for state in self._states.values():
+            with state.lock:
+                state.request_count = 0
+                state.latencies = []
+
+    def handle(self, method, path, query, body):
+        for prefix, provider_type, handler in [
+                (_GITHUB_PREFIX, _GITHUB, self._handle_github),
+                (_GITLAB_PREFIX, _GITLAB, self._handle_gitlab),
+                (_BITBUCKET_PREFIX, _BITBUCKET, self._handle_bitbucket)]:
+            if path.startswith(prefix + "/"):
+                state = self._states[provider_type]
+                if self._latency > 0:
+                    time.sleep(self._latency)
+
+                start = time.time()
+                with state.lock:
+                    state.request_count += 1
+                    rate_limit_headers, retry_after = self._consume_rate_limit(state)
+                    if retry_after is not None:
+                        r = self._make_rate_limited_response(provider_type, rate_limit_headers, retry_after)
+                    else:
+                        r = handler(state, method, path[len(prefix):], query, body)
+                        r.headers.extend(rate_limit_headers)
+                    state.latencies.append(time.time() - start)
+                return r
+
+        return _Response(404, { "message": "Not Found" })
+
+    def _consume_rate_limit(self, state):
+        # Returns the rate limit headers of the response and, once the
+        # budget is exhausted, the number of seconds until it resets
+        if self._rate_limit is None:
+            return [], None
+
+        now = time.time()
+        if now - state.window_start >= self._rate_limit_window:
+            state.window_start = now
+            state.window_count = 0
+
+        state.window_count += 1
+        remaining = max(self._rate_limit - state.window_count, 0)
+        reset = int(state.window_start + self._rate_limit_window) + 1
+        header_prefix = "RateLimit-" if state.provider_type == _GITLAB else "X-RateLimit-"
+        headers = [
+            (header_prefix + "Limit", str(self._rate_limit)),
+            (header_prefix + "Remaining", str(remaining)),
+            (header_prefix + "Reset", str(reset))
+        ]
+        if state.window_count <= self._rate_limit:
+            return headers, None
+
+        return headers, max(int(reset - now), 1)
+
+    def _make_rate_limited_response(self, provider_type, headers, retry_after):
+        # GitHub reports exhausted budgets as 403, the others as 429
+        if provider_type == _GITHUB:
+            return _Response(403, { "message": "API rate limit exceeded" }, headers)
+
+        return _Response(429, { "message": "Too Many Requests" }, headers + [("Retry-After", str(retry_after))])
+
+    def _make_github_obj(self, state, repo, include_source):
+        full_name = "{}/{}".format(state.user, repo.name)
+        obj = {
+            "id": repo.id,
+            "name": repo.name,
+            "full_name": full_name,
+            "description": "Description of {}".format(repo.name),
+            "private": repo.is_private,
+            "archived": repo.is_archived,
+            "fork": repo.is_fork,
+            "html_url": "https://github.com/{}".format(full_name),
+            "ssh_url": "git@github.com:{}.git".format(full_name),
+            "pushed_at": _format_timestamp(repo.updated),
+            "updated_at": _format_timestamp(repo.updated),
+            "owner": { "id": 1, "type": "User", "login": state.user }
+        }
+        if include_source and repo.is_fork:
+            upstream_name = "{}/{}".format(_UPSTREAM_OWNER, repo.name)
+            obj["source"] = obj["parent"] = {
+                "id": 1000000000 + repo.id,
+                "name": repo.name,
+                "full_name": upstream_name,
+                "description": None,
+                "private": False,
+                "archived": False,
+                "fork": False,
+                "html_url": "https://github.com/{}".format(upstream_name),
+                "ssh_url": "git@github.com:{}.git".format(upstream_name),
+                "pushed_at": None,
+                "updated_at": None,
+                "owner": { "id": 2, "type": "Organization", "login": _UPSTREAM_OWNER }
+            }
+        return obj
+
+    def _make_github_graphql_node(self, state, repo):
+        obj = self._make_github_obj(state, repo, True)
+
+        def _convert(o):
+            owner_obj = o["owner"]
+            return {
+                "databaseId": o["id"],
+                "name": o["name"],
+                "nameWithOwner": o["full_name"],
+                "description": o["description"],
+                "isPrivate": o["private"],
+                "isArchived": o["archived"],
+                "isFork": o["fork"],
+                "url": o["html_url"],
+                "sshUrl": o["ssh_url"],
+                "pushedAt": o["pushed_at"],
+                "updatedAt": o["updated_at"],
+                "owner": { "__typename": owner_obj["type"], "login": owner_obj["login"], "databaseId": owner_obj["id"] }
+            }
+
+        node = _convert(obj)
+        source_obj = obj.get("source")
+        node["parent"] = None if source_obj is None else _convert(source_obj)
+        return node
+
+    def _handle_github(self, state, method, path, query, body):
+        segments = path.strip("/").split("/")
+        if method == "GET" and segments == ["users", state.user, "repos"]:
+            repos = state.repos
+            if query.get("sort") == "updated":
+                repos = sorted(repos, key=lambda r: r.updated, reverse=query.get("direction", "desc") == "desc")
+
+            page, page_size = _get_page_params(query, "page", "per_page", _GITHUB, self._max_page_size)
+            page_count = max((len(repos) + page_size - 1) // page_size, 1)
+            base_url = self.github_url
+            links = []
+            if page < page_count:
+                links.append("<{}>; rel=\"next\"".format(_make_page_link(base_url, path, query, "page", page + 1)))
+            links.append("<{}>; rel=\"last\"".format(_make_page_link(base_url, path, query, "page", page_count)))
+            page_repos = repos[(page - 1) * page_size:page * page_size]
+            return _Response(200, [self._make_github_obj(state, r, False) for r in page_repos], [("Link", ", ".join(links))])
+
+        if method == "POST" and segments == ["graphql"]:
+            return self._handle_github_graphql(state, json.loads(body))
+
+        if method == "POST" and segments == ["user", "repos"]:
+            obj = json.loads(body)
+            if state.get(obj["name"]) is not None:
+                return _Response(422, { "message": "Repository creation failed." })
+            repo = state.add(obj["name"], obj.get("private", False), False, time.time())
+            return _Response(201, self._make_github_obj(state, repo, True))
+
+        if len(segments) == 3 and segments[:2] == ["repos", state.user]:
+            repo = state.get(segments[2])
+            if repo is None:
+                return _Response(404, { "message": "Not Found" })
+            if method == "GET":
+                return _Response(200, self._make_github_obj(state, repo, True))
+            if method == "DELETE":
+                state.remove(repo)
+                return _Response(204)
+            if method == "PATCH":
+                obj = json.loads(body)
+                repo.is_archived = obj.get("archived", repo.is_archived)
+                return _Response(200, self._make_github_obj(state, repo, True))
+
+        return _Response(404, { "message": "Not Found" })
+
+    def _handle_github_graphql(self, state, request_obj):
+        variables = request_obj.get("variables", {})
+        if variables.get("login") != state.user:
+            return _Response(200, { "data": { "repositoryOwner": None } })
+
+        is_descending = variables.get("orderDirection") == "DESC"
+        if variables.get("orderField") == "UPDATED_AT":
+            repos = sorted(state.repos, key=lambda r: r.updated, reverse=is_descending)
+        else:
+            repos = sorted(state.repos, key=lambda r: r.name, reverse=is_descending)
+
+        start = 0 if variables.get("cursor") is None else int(variables["cursor"])
+        page_size = min(variables.get("pageSize", 100), _PAGE_SIZES[_GITHUB][1])
+        end = min(start + page_size, len(repos))
+        return _Response(200, {
+            "data": {
+                "repositoryOwner": {
+                    "repositories": {
+                        "pageInfo": { "hasNextPage": end < len(repos), "endCursor": str(end) },
+                        "nodes": [self._make_github_graphql_node(state, r) for r in repos[start:end]]
+                    }
+                }
+            }
+        })
+
+    def _make_gitlab_obj(self, state, repo, namespace=None):
+        namespace = state.user if namespace is None else namespace
+        path = "{}/{}".format(namespace, repo.name)
+        obj = {
+            "id": repo.id if namespace == state.user else 1000000000 + repo.id,
+            "name": repo.name,
+            "name_with_namespace": "{} / {}".format(namespace, repo.name),
+            "path_with_namespace": path,
+            "description": "Description of {}".format(repo.name),
+            "visibility": "private" if repo.is_private else "public",
+            "archived": repo.is_archived,
+            "http_url_to_repo": "https://gitlab.com/{}.git".format(path),
+            "ssh_url_to_repo": "git@gitlab.com:{}.git".format(path),
+            "last_activity_at": _format_timestamp(repo.updated),
+            "owner": { "id": 1, "username": namespace }
+        }
+        if namespace == state.user and repo.is_fork:
+            obj["forked_from_project"] = self._make_gitlab_obj(state, repo, _UPSTREAM_OWNER)
+        return obj
+
+    def _handle_gitlab(self, state, method, path, query, body):
+        segments = path.strip("/").split("/")
+        if method == "GET" and segments == ["users", state.user, "projects"]:
+            repos = state.repos
+            archived = query.get("archived")
+            if archived is not None:
+                is_archived = archived.lower() == "true"
+                repos = [r for r in repos if r.is_archived == is_archived]
+            last_activity_after = query.get("last_activity_after")
+            if last_activity_after is not None:
+                repos = [r for r in repos if _format_timestamp(r.updated) > last_activity_after]
+
+            page, page_size = _get_page_params(query, "page", "per_page", _GITLAB, self._max_page_size)
+            page_count = max((len(repos) + page_size - 1) // page_size, 1)
+            headers = [
+                ("X-Page", str(page)),
+                ("X-Per-Page", str(page_size)),
+                ("X-Next-Page", str(page + 1) if page < page_count else "")
+            ]
+            if self._gitlab_total_limit is None or len(repos) <= self._gitlab_total_limit:
+                headers.append(("X-Total", str(len(repos))))
+                headers.append(("X-Total-Pages", str(page_count)))
+            page_repos = repos[(page - 1) * page_size:page * page_size]
+            return _Response(200, [self._make_gitlab_obj(state, r) for r in page_repos], headers)
+
+        if method == "POST" and segments == ["projects"]:
+            form = dict(urlparse.parse_qsl(body))
+            if state.get(form["name"]) is not None:
+                return _Response(400, { "message": { "name": ["has already been taken"] } })
+            repo = state.add(form["name"], form.get("visibility", "private") == "private", False, time.time())
+            return _Response(201, self._make_gitlab_obj(state, repo))
+
+        if len(segments) in [2, 3] and segments[0] == "projects":
+            namespace, _, name = urllib.unquote(segments[1]).partition("/")
+            repo = state.get(name) if namespace == state.user else None
+            if repo is None:
+                return _Response(404, { "message": "404 Project Not Found" })
+            if len(segments) == 2 and method == "GET":
+                return _Response(200, self._make_gitlab_obj(state, repo))
+            if len(segments) == 2 and method == "DELETE":
+                state.remove(repo)
+                return _Response(202, { "message": "202 Accepted" })
+            if segments[2:] == ["archive"] and method == "POST":
+                repo.is_archived = True
+                return _Response(201, self._make_gitlab_obj(state, repo))
+
+        return _Response(404, { "message": "404 Not Found" })
+
+    def _make_bitbucket_obj(self, state, repo, owner=None):
+        owner = state.user if owner is None else owner
+        full_name = "{}/{}".format(owner, repo.name)
+        obj = {
+            "uuid": "{{{:08d}-0000-0000-0000-000000000000}}".format(repo.id if owner == state.user else 1000000000 + repo.id),
+            "name": repo.name,
+            "full_name": full_name,
+            "description": "Description of {}".format(repo.name),
+            "scm": "git",
+            "is_private": repo.is_private,
+            "updated_on": _format_timestamp(repo.updated),
+            "owner": {
+                "uuid": "{{00000000-0000-0000-0000-00000000000{}}}".format(1 if owner == state.user else 2),
+                "type": "user" if owner == state.user else "team",
+                "username": owner
+            },
+            "links": {
+                "clone": [
+                    { "name": "https", "href": "https://{}@bitbucket.org/{}.git".format(state.user, full_name) },
+                    { "name": "ssh", "href": "git@bitbucket.org:{}.git".format(full_name) }
+                ]
+            }
+        }
+        # Like the API, only name the parent of a fork
+        if owner == state.user and repo.is_fork:
+            obj["parent"] = { "type": "repository", "full_name": "{}/{}".format(_UPSTREAM_OWNER, repo.name) }
+        return obj
+
+    def _handle_bitbucket(self, state, method, path, query, body):
+        segments = path.strip("/").split("/")
+        if method == "GET" and segments == ["repositories", state.user]:
+            repos = state.repos
+            q = query.get("q")
+            if q is not None and q.startswith("updated_on > "):
+                since = q[len("updated_on > "):]
+                repos = [r for r in repos if _format_timestamp(r.updated) > since]
+
+            page, page_size = _get_page_params(query, "page", "pagelen", _BITBUCKET, self._max_page_size)
+            page_count = max((len(repos) + page_size - 1) // page_size, 1)
+            obj = {
+                "size": len(repos),
+                "page": page,
+                "pagelen": page_size,
+                "values": [self._make_bitbucket_obj(state, r) for r in repos[(page - 1) * page_size:page * page_size]]
+            }
+            if page < page_count:
+                obj["next"] = _make_page_link(self.bitbucket_url, path, query, "page", page + 1)
+            return _Response(200, obj)
+
+        if method == "GET" and len(segments) == 3 and segments[:2] == ["repositories", _UPSTREAM_OWNER]:
+            repo = state.get(segments[2])
+            if repo is None or not repo.is_fork:
+                return _Response(404, { "type": "error", "error": { "message": "Repository not found" } })
+            return _Response(200, self._make_bitbucket_obj(state, repo, _UPSTREAM_OWNER))
+
+        if len(segments) == 3 and segments[:2] == ["repositories", state.user]:
+            repo = state.get(segments[2])
+            if method == "POST":
+                if repo is not None:
+                    return _Response(400, { "type": "error", "error": { "message": "Repository already exists." } })
+                obj = json.loads(body) if body else {}
+                repo = state.add(segments[2], obj.get("is_private", False), False, time.time())
+                return _Response(200, self._make_bitbucket_obj(state, repo))
+            if repo is None:
+                return _Response(404, { "type": "error", "error": { "message": "Repository not found" } })
+            if method == "GET":
+                return _Response(200, self._make_bitbucket_obj(state, repo))
+            if method == "DELETE":
+                state.remove(repo)
+                return _Response(204)
+
+        return _Response(404, { "type": "error", "error": { "message": "Resource not found" } })
+
+class _HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Buffer responses so that headers and body leave in one segment
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_GET(self): self._handle()
+
+    def do_POST(self): self._handle()
+
+    def do_PATCH(self): self._handle()
+
+    def do_DELETE(self): self._handle()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self):
+        content_length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(content_length) if content_length > 0 else ""
+        parts = urlparse.urlparse(self.path)
+        query = dict(urlparse.parse_qsl(parts.query, keep_blank_values=True))
+        try:
+            r = self.server.mock.handle(self.command, parts.path, query, body)
+        except Exception as e:
+            r = _Response(500, { "message": str(e) })
+
+        content = "" if r.obj is None else json.dumps(r.obj)
+        self.send_response(r.status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in r.headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+        self.wfile.flush()